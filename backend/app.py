@@ -1,7 +1,9 @@
 from flask import Flask
 from routes.predict_routes import predict_bp
+import config
 
 app = Flask(__name__)
+app.config["MAX_CONTENT_LENGTH"] = config.MAX_CONTENT_LENGTH_MB * 1024 * 1024
 
 # Register the blueprint containing your routes
 app.register_blueprint(predict_bp)
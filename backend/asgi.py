@@ -0,0 +1,11 @@
+"""
+ASGI entry point, for serving with an ASGI server instead of the Flask development server:
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+"""
+from app import app as flask_app
+from utils.asgi import AsgiAdapter
+import config
+
+app = AsgiAdapter(flask_app, config.ASGI_WORKERS, config.ASGI_SPOOL_MB * 1024 * 1024, config.ASGI_QUEUE,
+                  config.MAX_CONTENT_LENGTH_MB * 1024 * 1024)
@@ -0,0 +1,61 @@
+"""
+Offline batch predictions over whole directories of DICOMs and NIfTI volumes.
+
+Runs the pneumonia and cardiac models over every .dcm file and the atrium model over every
+.nii/.nii.gz file below the input directory, and writes the results to the output
+directory (see utils.batch.BatchRunner). Run it again on the same output directory to
+resume an interrupted run.
+
+Usage: python batch_predict.py <input directory> <output directory> [options]
+"""
+import argparse
+import sys
+import torch
+import config
+from utils.batch import BatchRunner, OUTPUT_FORMATS, check_output_format
+from utils.model_loader import load_model
+from utils.model_registry import checkpoint_version
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the models over all DICOM and NIfTI files in a directory.")
+    parser.add_argument("input", help="directory searched recursively for .dcm, .nii and .nii.gz files")
+    parser.add_argument("output", help="directory for the results, masks and the manifest of finished files")
+    parser.add_argument("--models", default=",".join(config.MODEL_CHECKPOINTS),
+                        help="comma-separated models to run (default: all)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="decode processes (default: one per core; 0 decodes in the main process)")
+    parser.add_argument("--batch-size", type=int, default=64, help="X-ray frames per forward pass")
+    parser.add_argument("--atrium-batch-size", type=int, default=16, help="volume slices per forward pass")
+    parser.add_argument("--part-size", type=int, default=1000, help="DICOM files per output part")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="parquet", help="format of the result tables")
+    parser.add_argument("--device", default="cuda:0" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args(argv)
+    args.models = [name.strip() for name in args.models.split(",") if name.strip()]
+    unknown = set(args.models) - set(config.MODEL_CHECKPOINTS)
+    if unknown:
+        parser.error(f"unknown models: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        check_output_format(args.format)
+    except RuntimeError as e:
+        sys.exit(str(e))
+    device = torch.device(args.device)
+    models = {name: (load_model(name, config.MODEL_CHECKPOINTS[name], device),
+                     checkpoint_version(config.MODEL_CHECKPOINTS[name]))
+              for name in args.models}
+    runner = BatchRunner(args.input, args.output, models, device, workers=args.workers,
+                         batch_size=args.batch_size, atrium_batch_size=args.atrium_batch_size,
+                         part_size=args.part_size, format=args.format, reduced_decode=config.DICOM_REDUCED_DECODE,
+                         log=lambda message: print(message, file=sys.stderr, flush=True))
+    summary = runner.run()
+    print(f"{summary['done']} files done, {summary['failed']} failed, {summary['skipped']} already done "
+          f"in {summary['seconds']:.1f} s: {summary['files_per_second']:.2f} files/s")
+
+
+if __name__ == "__main__":
+    main()
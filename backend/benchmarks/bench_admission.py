@@ -0,0 +1,93 @@
+"""
+Burst load: a few atrium volume jobs and many X-ray predictions at once, with the default
+admission control and with it effectively disabled. Reports X-ray latency percentiles and
+the status codes returned. Every scenario runs in a fresh interpreter.
+
+Usage: python benchmarks/bench_admission.py [atrium_jobs xray_requests]
+"""
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+BACKEND = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(BACKEND, 'benchmarks'))
+
+from bench_warmup import make_dicom  # noqa: E402
+
+
+def child(atrium_jobs, xray_requests):
+    import nibabel as nib
+    import numpy as np
+    sys.path.insert(0, BACKEND)
+    os.chdir(BACKEND)
+    from app import app
+    import routes.predict_routes as predict_routes
+    predict_routes.warmup.wait()
+
+    dicom = make_dicom()
+    nifti = os.path.join(tempfile.mkdtemp(), 'volume.nii.gz')
+    nib.save(nib.Nifti1Image(np.random.rand(224, 224, 24).astype(np.float32), np.eye(4)), nifti)
+    app.config['TESTING'] = True
+    results = {"xray": [], "atrium": []}
+
+    def request(kind):
+        with app.test_client() as client:
+            start = time.perf_counter()
+            if kind == "xray":
+                data = {'dicom': (io.BytesIO(dicom), 'x.dcm')}
+                response = client.post('/predict_cam/pneumonia', data=data, content_type='multipart/form-data')
+            else:
+                data = {'nifti': (open(nifti, 'rb'), 'volume.nii.gz')}
+                response = client.post('/segment_atrium', data=data, content_type='multipart/form-data')
+            results[kind].append((response.status_code, time.perf_counter() - start))
+
+    threads = [threading.Thread(target=request, args=("atrium",)) for _ in range(atrium_jobs)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.2)  # the volumes arrive first
+    for _ in range(xray_requests):
+        threads.append(threading.Thread(target=request, args=("xray",)))
+        threads[-1].start()
+        time.sleep(0.02)
+    for thread in threads:
+        thread.join()
+    print(json.dumps({"results": results, "admission": predict_routes.admission.stats()}))
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else float("nan")
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        return child(int(sys.argv[2]), int(sys.argv[3]))
+    atrium_jobs, xray_requests = (int(v) for v in sys.argv[1:3]) if len(sys.argv) > 2 else (3, 20)
+    scenarios = {
+        "admission control": {},
+        "no admission control": {"ADMISSION_MAX_CONCURRENT": "1000", "ADMISSION_XRAY": "1000,1000,600",
+                                 "ADMISSION_SERIES": "1000,1000,600", "ADMISSION_ATRIUM": "1000,1000,600"},
+    }
+    for name, overrides in scenarios.items():
+        env = dict(os.environ, PYTHONWARNINGS="ignore", **overrides)
+        output = subprocess.run([sys.executable, __file__, "--child", str(atrium_jobs), str(xray_requests)],
+                                env=env, check=True, capture_output=True, text=True).stdout
+        report = json.loads(output.strip().splitlines()[-1])
+        print(name)
+        for kind, results in report["results"].items():
+            ok = [seconds for status, seconds in results if status == 200]
+            codes = dict(Counter(status for status, _ in results))
+            print(f"  {kind:7s} status {codes}  p50 {percentile(ok, 0.5) * 1000:8.1f} ms  "
+                  f"p95 {percentile(ok, 0.95) * 1000:8.1f} ms")
+        shed = {k: (v["shed_queue_full"], v["shed_timeout"]) for k, v in report["admission"].items()}
+        print(f"  shed (queue full, timeout): {shed}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Time fetching every instance of a series from the stand-in DICOMweb server, one by one as
+a viewer would reference them: on a new connection per instance, over the pooled
+keep-alive connections, and with the whole series prefetched on the first reference.
+Runs against a local server and with a simulated 5 ms archive round trip.
+
+Usage: python benchmarks/bench_archive.py [instances]
+"""
+import io
+import os
+import sys
+import tempfile
+import time
+import pydicom
+
+BACKEND = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, BACKEND)
+sys.path.insert(0, os.path.join(BACKEND, 'benchmarks'))
+
+from bench_warmup import make_dicom  # noqa: E402
+from tests.dicomweb_server import DicomWebServer  # noqa: E402
+from utils.archive import ArchiveClient, DicomWebArchive  # noqa: E402
+
+STUDY, SERIES = "1.2.3", "1.2.3.4"
+
+
+def make_archive_dir(instances):
+    """Write a series of X-ray instances; returns the archive directory and their UIDs."""
+    root, uids = tempfile.mkdtemp(), []
+    os.makedirs(os.path.join(root, STUDY, SERIES))
+    for _ in range(instances):
+        data = make_dicom()
+        uids.append(pydicom.dcmread(io.BytesIO(data), stop_before_pixels=True).file_meta.MediaStorageSOPInstanceUID)
+        with open(os.path.join(root, STUDY, SERIES, f"{uids[-1]}.dcm"), "wb") as f:
+            f.write(data)
+    return root, uids
+
+
+def fetch_all(server, make_client, uids):
+    server.connections = server.requests = 0
+    client = make_client()
+    start = time.perf_counter()
+    for uid in uids:
+        client.instance(STUDY, SERIES, uid)
+    return time.perf_counter() - start
+
+
+def main():
+    instances = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    root, uids = make_archive_dir(instances)
+    server = DicomWebServer(root).start()
+
+    class NewConnections(DicomWebArchive):
+        def _retrieve(self, path):
+            self.pool._idle.queue.clear()  # drop the kept-alive connection
+            return super()._retrieve(path)
+
+    scenarios = {
+        "new connection per instance": lambda: ArchiveClient(NewConnections(server.url), 0),
+        "pooled keep-alive": lambda: ArchiveClient(DicomWebArchive(server.url), 0),
+        "pooled + series prefetch": lambda: ArchiveClient(DicomWebArchive(server.url), 1 << 30),
+    }
+    for latency in (0.0, 0.005):
+        server.latency = latency
+        print(f"archive latency {latency * 1000:.0f} ms")
+        for name, make_client in scenarios.items():
+            seconds = min(fetch_all(server, make_client, uids) for _ in range(3))
+            print(f"  {name:28s} {seconds * 1000:8.1f} ms  {server.connections:3d} connections  "
+                  f"{server.requests:3d} requests")
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+Load test of the ASGI serving mode with slow clients, against a WSGI server with a bounded
+pool of as many threads (as in the usual threaded WSGI deployments, where a request holds
+its thread from the first byte of the upload to the last byte of the response).
+
+Slow clients upload a 1 MB X-ray at 256 KB/s and read the overlay at the same rate while
+fast clients send small X-rays back to back, all to /predict_cam. Reports the requests
+completed and the latency of the fast clients for each server.
+
+Usage: python benchmarks/bench_asgi.py [seconds] [slow clients] [fast clients]
+"""
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+BACKEND = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, BACKEND)
+sys.path.insert(0, os.path.join(BACKEND, 'benchmarks'))
+
+from bench_tiles import make_dicom  # noqa: E402
+from bench_admission import percentile  # noqa: E402
+
+WORKERS = 8
+SLOW_RATE = 256 * 1024  # bytes per second, both ways
+
+
+def serve(mode, port):
+    """Run the app in this process: over ASGI with uvicorn, or on a WSGI server with a bounded thread pool."""
+    import logging
+    from concurrent.futures import ThreadPoolExecutor
+    os.chdir(BACKEND)
+    os.environ["ASGI_WORKERS"] = str(WORKERS)
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    if mode == "asgi":
+        import uvicorn
+        from asgi import app
+        uvicorn.run(app, host="127.0.0.1", port=port, log_level="error")
+        return
+    from werkzeug.serving import BaseWSGIServer
+    from app import app
+
+    class PooledWSGIServer(BaseWSGIServer):
+        pool = ThreadPoolExecutor(WORKERS)
+
+        def process_request(self, request, client_address):
+            self.pool.submit(self._handle, request, client_address)
+
+        def _handle(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    PooledWSGIServer("127.0.0.1", port, app).serve_forever()
+
+
+def multipart(dicom):
+    boundary = "benchboundary"
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="dicom"; filename="x.dcm"\r\n'
+            f'Content-Type: application/dicom\r\n\r\n').encode() + dicom + f'\r\n--{boundary}--\r\n'.encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+async def post(port, body, content_type, rate=None):
+    """POST body to /predict_cam/pneumonia, sending and reading at rate bytes/s if given. Returns the status."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        writer.write((f"POST /predict_cam/pneumonia HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n"
+                      f"Content-Type: {content_type}\r\nContent-Length: {len(body)}\r\n\r\n").encode())
+        chunk = 16 * 1024
+        for start in range(0, len(body), chunk):
+            writer.write(body[start:start + chunk])
+            await writer.drain()
+            if rate:
+                await asyncio.sleep(chunk / rate)
+        response = b""
+        while True:
+            data = await reader.read(chunk)
+            if not data:
+                break
+            response += data
+            if rate:
+                await asyncio.sleep(len(data) / rate)
+        return int(response.split(b" ", 2)[1])
+    finally:
+        writer.close()
+
+
+async def load(port, seconds, slow_clients, fast_clients):
+    slow_body, content_type = multipart(make_dicom(1024, 512))
+    fast_body, _ = multipart(make_dicom(256, 256))
+    deadline = time.perf_counter() + seconds
+    results = {"slow": [], "fast": []}
+
+    async def client(kind, body, rate):
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                status = await post(port, body, content_type, rate)
+            except OSError:
+                status = None
+            if time.perf_counter() <= deadline:
+                results[kind].append((status, time.perf_counter() - start))
+
+    await asyncio.gather(*[client("slow", slow_body, SLOW_RATE) for _ in range(slow_clients)],
+                         *[client("fast", fast_body, None) for _ in range(fast_clients)])
+    return results
+
+
+def wait_ready(port, timeout=120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/ready", timeout=5) as response:
+                if response.status == 200:
+                    return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError("Server did not become ready")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--serve":
+        return serve(sys.argv[2], int(sys.argv[3]))
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 30
+    slow_clients = int(sys.argv[2]) if len(sys.argv) > 2 else 24
+    fast_clients = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    print(f"{seconds:.0f} s, {slow_clients} slow clients at {SLOW_RATE // 1024} KB/s, {fast_clients} fast clients, "
+          f"{WORKERS} worker threads")
+    for mode, name in (("wsgi", "WSGI, thread pool"), ("asgi", "ASGI (uvicorn)")):
+        port = free_port()
+        env = dict(os.environ, PYTHONWARNINGS="ignore")
+        server = subprocess.Popen([sys.executable, __file__, "--serve", mode, str(port)], env=env,
+                                  stdout=subprocess.DEVNULL)
+        try:
+            wait_ready(port)
+            results = asyncio.run(load(port, seconds, slow_clients, fast_clients))
+        finally:
+            server.terminate()
+            server.wait()
+        print(name)
+        for kind in ("fast", "slow"):
+            ok = [latency for status, latency in results[kind] if status == 200]
+            failed = len(results[kind]) - len(ok)
+            line = f"  {kind}: {len(ok):5d} completed ({len(ok) / seconds:6.2f}/s), {failed} failed"
+            if ok:
+                line += f", p50 {percentile(ok, 0.5) * 1000:7.0f} ms  p95 {percentile(ok, 0.95) * 1000:7.0f} ms"
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
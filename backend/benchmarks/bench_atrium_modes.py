@@ -0,0 +1,49 @@
+"""
+Time and peak memory of the atrium inference modes on 320x320 slices.
+
+Usage: python benchmarks/bench_atrium_modes.py [slices]
+Each mode runs in its own process so that the peak RSS numbers are independent.
+"""
+import os
+import resource
+import subprocess
+import sys
+import time
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.model_loader import load_model
+from utils.segmentation import segment_volume, tile_size_for_budget
+
+MODES = [("resize", None), ("native", None), ("tiled", 160), ("tiled", 96)]
+
+
+def run_mode(mode, tile_size, slices):
+    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+    model = load_model("atrium", "weights/atrium_weights.ckpt", device)
+    volume = np.random.rand(320, 320, slices)
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    segment_volume(model, volume, device, mode=mode, batch_size=4,
+                   tile_size=tile_size or tile_size_for_budget(256, 4))
+    elapsed = time.perf_counter() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    label = mode if tile_size is None else f"{mode}/{tile_size}"
+    print(f"{label:12s} {elapsed / slices * 1000:8.1f} ms/slice  "
+          f"peak +{(peak_rss - base_rss) / 1024:7.1f} MB")
+
+
+def main():
+    if len(sys.argv) > 2:
+        run_mode(sys.argv[1], int(sys.argv[2]) or None, int(sys.argv[3]))
+        return
+    slices = sys.argv[1] if len(sys.argv) > 1 else "8"
+    for mode, tile_size in MODES:
+        subprocess.run([sys.executable, __file__, mode, str(tile_size or 0), slices],
+                       stderr=subprocess.DEVNULL, check=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+Compare full-slice and ROI-cropped atrium segmentation on a NIfTI volume.
+
+Usage: python benchmarks/bench_atrium_roi.py [volume.nii.gz]
+Without a volume a synthetic 320x320x130 one is used.
+"""
+import os
+import sys
+import time
+import numpy as np
+import nibabel as nib
+import torch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.model_loader import load_model
+from utils.preprocess import normalize_volume, standardize_volume
+from utils.segmentation import segment_volume
+
+
+def dice(a, b):
+    total = a.sum() + b.sum()
+    return 1.0 if total == 0 else 2.0 * np.logical_and(a, b).sum() / total
+
+
+def main():
+    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+    model = load_model("atrium", "weights/atrium_weights.ckpt", device)
+    if len(sys.argv) > 1:
+        volume = nib.load(sys.argv[1]).get_fdata()
+    else:
+        volume = np.random.rand(320, 320, 130)
+        volume[:, :, :20] = 0
+    volume_std = standardize_volume(normalize_volume(volume))
+
+    results = {}
+    for roi in ("off", "auto"):
+        start = time.perf_counter()
+        _, probs = segment_volume(model, volume_std, device, roi=roi)
+        results[roi] = (time.perf_counter() - start, probs > 0.5)
+        print(f"roi={roi:4s}  {results[roi][0]:.2f}s")
+    print(f"speedup {results['off'][0] / results['auto'][0]:.2f}x, "
+          f"dice vs full {dice(results['off'][1], results['auto'][1]):.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Files per second of the offline batch runner against posting the same DICOMs one at a time
+to the X-ray endpoints (pneumonia and cardiac), with 1, 2 and one decode process per core.
+
+Usage: python benchmarks/bench_batch.py [files]
+"""
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+BACKEND = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, BACKEND)
+sys.path.insert(0, os.path.join(BACKEND, 'benchmarks'))
+
+from bench_tiles import make_dicom  # noqa: E402
+
+
+def main():
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    os.chdir(BACKEND)
+    from app import app
+    import routes.predict_routes as predict_routes
+    from utils.batch import BatchRunner
+    predict_routes.warmup.wait()
+    app.config['TESTING'] = True
+
+    input_dir = tempfile.mkdtemp()
+    for n in range(files):
+        with open(os.path.join(input_dir, f"x{n:04d}.dcm"), "wb") as f:
+            f.write(make_dicom(2048, 2048))
+
+    start = time.perf_counter()
+    with app.test_client() as client:
+        for name in sorted(os.listdir(input_dir)):
+            with open(os.path.join(input_dir, name), "rb") as f:
+                dicom = f.read()
+            for endpoint in ('/predict_cam/pneumonia', '/predict_cardiac/cardiac'):
+                client.post(endpoint, data={'dicom': (io.BytesIO(dicom), name)}, content_type='multipart/form-data')
+    print(f"endpoints, one file at a time   {files / (time.perf_counter() - start):7.2f} files/s")
+
+    models = {name: (predict_routes.models[name], predict_routes.model_registry.version(name))
+              for name in ("pneumonia", "cardiac")}
+    for workers in sorted({1, 2, os.cpu_count()}):
+        output_dir = tempfile.mkdtemp()
+        summary = BatchRunner(input_dir, output_dir, models, predict_routes.device, workers=workers,
+                              format="csv").run()
+        shutil.rmtree(output_dir)
+        print(f"batch runner, {workers:2d} decode processes {summary['files_per_second']:7.2f} files/s")
+    print(f"({os.cpu_count()} cores)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Soak test of the buffer pool: a stream of X-ray predictions (CAM and cardiac box, PNG output)
+and atrium re-renders, once with the pool and once with buffer reuse disabled
+(BUFFER_POOL_MB=0). Reports the buffers allocated on the request path, the resident set
+size drift between the end of the first tenth of the run and its end, and latency.
+
+Usage: python benchmarks/bench_buffers.py [iterations]
+"""
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, BACKEND)
+sys.path.insert(0, os.path.join(BACKEND, 'benchmarks'))
+
+from bench_tiles import make_dicom  # noqa: E402
+from bench_admission import percentile  # noqa: E402
+
+
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+
+def child(iterations):
+    import nibabel as nib
+    import numpy as np
+    os.chdir(BACKEND)
+    from app import app
+    import routes.predict_routes as predict_routes
+    predict_routes.warmup.wait()
+    app.config['TESTING'] = True
+    # Uploads of a few different sizes, as from different modalities
+    dicoms = [make_dicom(2048, 2048), make_dicom(2500, 2048), make_dicom(1760, 2140)]
+    nifti = os.path.join(tempfile.mkdtemp(), 'volume.nii.gz')
+    nib.save(nib.Nifti1Image(np.random.rand(256, 256, 24).astype(np.float32), np.eye(4)), nifti)
+
+    latencies, rss = [], []
+    with app.test_client() as client:
+        volume_id = client.post('/segment_atrium', data={'nifti': (open(nifti, 'rb'), 'volume.nii.gz')},
+                                content_type='multipart/form-data').headers['X-Volume-Id']
+        for n in range(iterations):
+            start = time.perf_counter()
+            dicom = dicoms[n % len(dicoms)]
+            for endpoint in ('/predict_cam/pneumonia', '/predict_cardiac/cardiac'):
+                response = client.post(endpoint, data={'dicom': (io.BytesIO(dicom), 'x.dcm')},
+                                       content_type='multipart/form-data')
+                assert response.status_code == 200
+            assert client.get(f'/segment_atrium/{volume_id}?threshold=0.{n % 9 + 1}').status_code == 200
+            latencies.append(time.perf_counter() - start)
+            rss.append(rss_mb())
+    print(json.dumps({"latencies": latencies, "rss": rss, "buffers": predict_routes.buffer_pool.stats()}))
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        return child(int(sys.argv[2]))
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 150
+    for name, pool_mb in (("buffer pool", "256"), ("no reuse", "0")):
+        env = dict(os.environ, PYTHONWARNINGS="ignore", BUFFER_POOL_MB=pool_mb)
+        output = subprocess.run([sys.executable, __file__, "--child", str(iterations)],
+                                env=env, check=True, capture_output=True, text=True).stdout
+        report = json.loads(output.strip().splitlines()[-1])
+        buffers, rss, latencies = report["buffers"], report["rss"], report["latencies"]
+        settled = rss[len(rss) // 10]
+        print(f"{name} ({iterations} rounds of CAM + cardiac + atrium re-render)")
+        print(f"  buffers requested {buffers['allocations'] + buffers['reuses']:6d}, "
+              f"allocated {buffers['allocations']:6d}, idle {buffers['idle_bytes'] / 2 ** 20:6.1f} MB")
+        print(f"  RSS after 10% {settled:7.1f} MB, at the end {rss[-1]:7.1f} MB, "
+              f"drift {rss[-1] - settled:+6.1f} MB, peak {max(rss):7.1f} MB")
+        print(f"  round p50 {percentile(latencies, 0.5) * 1000:7.1f} ms  p95 {percentile(latencies, 0.95) * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Burst of identical X-ray uploads (the same study sent by several viewers at once) with
+in-flight coalescing and with every request computed on its own. Reports the number of
+model runs and the latency percentiles.
+
+Usage: python benchmarks/bench_coalescing.py [requests]
+"""
+import io
+import os
+import sys
+import threading
+import time
+from unittest.mock import patch
+
+BACKEND = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, BACKEND)
+sys.path.insert(0, os.path.join(BACKEND, 'benchmarks'))
+
+from bench_warmup import make_dicom  # noqa: E402
+from bench_admission import percentile  # noqa: E402
+
+
+def burst(app, predict_routes, dicom, requests):
+    runs, latencies = [], []
+    predict_cam = predict_routes._predict_cam
+
+    def counted(model_name, file):
+        runs.append(model_name)
+        return predict_cam(model_name, file)
+
+    def post():
+        with app.test_client() as client:
+            start = time.perf_counter()
+            data = {'dicom': (io.BytesIO(dicom), 'x.dcm')}
+            response = client.post('/predict_cam/pneumonia', data=data, content_type='multipart/form-data')
+            assert response.status_code == 200, response.data
+            latencies.append(time.perf_counter() - start)
+
+    with patch.object(predict_routes, '_predict_cam', counted):
+        threads = [threading.Thread(target=post) for _ in range(requests)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return len(runs), latencies, time.perf_counter() - start
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    os.chdir(BACKEND)
+    from app import app
+    import routes.predict_routes as predict_routes
+    predict_routes.warmup.wait()
+    app.config['TESTING'] = True
+    dicom = make_dicom()
+
+    def uncoalesced(key, fn):
+        return fn(), False
+
+    for name, do in (("coalesced", predict_routes.coalescer.do), ("uncoalesced", uncoalesced)):
+        with patch.object(predict_routes.coalescer, 'do', do):
+            runs, latencies, wall = burst(app, predict_routes, dicom, requests)
+        print(f"{name:12s} model runs {runs:3d}  p50 {percentile(latencies, 0.5) * 1000:8.1f} ms  "
+              f"p95 {percentile(latencies, 0.95) * 1000:8.1f} ms  wall {wall:6.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Compare full-resolution and reduced-resolution decoding of compressed chest X-ray DICOMs,
+for the model input (224) and the display (1024) sizes.
+
+Synthetic 8-bit images are encoded as JPEG Baseline and JPEG 2000 at the given size.
+Peak memory is the traced allocation peak of one decode (pixel buffers included).
+
+Usage: python benchmarks/bench_dicom_decode.py [size]
+"""
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import cv2
+import numpy as np
+import pydicom
+from pydicom.encaps import encapsulate
+from PIL import Image
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.decode import decode_pixels
+
+CODECS = {
+    "JPEG Baseline": ("1.2.840.10008.1.2.4.50", "JPEG", {"quality": 90}),
+    "JPEG 2000": ("1.2.840.10008.1.2.4.91", "JPEG2000", {"quality_mode": "rates", "quality_layers": [10]}),
+}
+
+
+def write_dicom(path, pixels, transfer_syntax, fmt, options):
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, fmt, **options)
+    ds = pydicom.Dataset()
+    ds.file_meta = pydicom.dataset.FileMetaDataset()
+    ds.file_meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.1'
+    ds.file_meta.MediaStorageSOPInstanceUID = pydicom.uid.generate_uid()
+    ds.file_meta.TransferSyntaxUID = transfer_syntax
+    ds.is_little_endian, ds.is_implicit_VR = True, False
+    ds.Modality = 'CR'
+    ds.PhotometricInterpretation = 'MONOCHROME2'
+    ds.SamplesPerPixel = 1
+    ds.Rows, ds.Columns = pixels.shape
+    ds.BitsAllocated = ds.BitsStored = 8
+    ds.HighBit = 7
+    ds.PixelRepresentation = 0
+    ds.PixelData = encapsulate([buffer.getvalue()])
+    ds['PixelData'].is_undefined_length = True
+    ds.save_as(path, write_like_original=False)
+
+
+def measure(path, min_size, target, repeat=3):
+    """Best time and traced peak of decoding and resizing to the target size."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cv2.resize(decode_pixels(path, min_size) / 255.0, (target, target))
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    pixels = decode_pixels(path, min_size)
+    cv2.resize(pixels / 255.0, (target, target))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak, pixels.shape
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    # Smooth anatomy-like content: blurred noise plus a gradient
+    pixels = cv2.GaussianBlur(np.random.randint(0, 256, (size, size), dtype=np.uint8), (0, 0), 8)
+    pixels = cv2.addWeighted(pixels, 0.5, np.tile(np.linspace(0, 255, size, dtype=np.uint8), (size, 1)), 0.5, 0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, (uid, fmt, options) in CODECS.items():
+            path = os.path.join(tmp, f"{fmt}.dcm")
+            write_dicom(path, pixels, uid, fmt, options)
+            print(f"{name} {size}x{size}")
+            for target in (224, 1024):
+                full, full_peak, _ = measure(path, None, target)
+                reduced, reduced_peak, shape = measure(path, target, target)
+                print(f"  {target:4d}: full {full * 1000:7.1f} ms {full_peak / 2 ** 20:6.1f} MB | "
+                      f"reduced to {shape[0]}x{shape[1]} {reduced * 1000:7.1f} ms {reduced_peak / 2 ** 20:6.1f} MB "
+                      f"({full / reduced:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Perceived latency of the progressive output: time until the probability, the preview and
+the full overlay arrive, against the time until the single PNG arrives; and for an atrium
+volume the time until the first slice overlay against the whole ZIP.
+
+Usage: python benchmarks/bench_progressive.py
+"""
+import io
+import os
+import sys
+import tempfile
+import time
+
+BACKEND = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, BACKEND)
+sys.path.insert(0, os.path.join(BACKEND, 'benchmarks'))
+
+from bench_tiles import make_dicom  # noqa: E402
+
+
+def timed_parts(response):
+    """Seconds since the start at which each multipart part (one chunk each) arrived."""
+    start, times = time.perf_counter(), []
+    for _ in response.response:
+        times.append(time.perf_counter() - start)
+    return times[:-1]  # the last chunk is the closing delimiter
+
+
+def median(values):
+    return sorted(values)[len(values) // 2]
+
+
+def main():
+    import nibabel as nib
+    import numpy as np
+    os.chdir(BACKEND)
+    from app import app
+    import routes.predict_routes as predict_routes
+    predict_routes.warmup.wait()
+    app.config['TESTING'] = True
+    dicom = make_dicom(2048, 2048)
+    nifti = os.path.join(tempfile.mkdtemp(), 'volume.nii.gz')
+    nib.save(nib.Nifti1Image(np.random.rand(320, 320, 40).astype(np.float32), np.eye(4)), nifti)
+
+    with app.test_client() as client:
+        def post(url, data, output):
+            start = time.perf_counter()
+            response = client.post(url, data=dict(data, output=output), content_type='multipart/form-data',
+                                   buffered=False)
+            head = time.perf_counter() - start
+            if output != "progressive":
+                response.get_data()
+                return [time.perf_counter() - start]
+            return [head + t for t in timed_parts(response)]
+
+        xray = lambda: {'dicom': (io.BytesIO(dicom), 'x.dcm')}  # noqa: E731
+        volume = lambda: {'nifti': (open(nifti, 'rb'), 'volume.nii.gz')}  # noqa: E731
+        runs = {"png": [], "progressive": [], "zip": [], "atrium progressive": []}
+        for _ in range(5):
+            runs["png"].append(post('/predict_cam/pneumonia', xray(), "png")[0])
+            runs["progressive"].append(post('/predict_cam/pneumonia', xray(), "progressive"))
+        for _ in range(3):
+            runs["zip"].append(post('/segment_atrium', volume(), "png")[0])
+            runs["atrium progressive"].append(post('/segment_atrium', volume(), "progressive"))
+
+    progressive = [median([run[n] for run in runs["progressive"]]) for n in range(3)]
+    print("2048x2048 X-ray (pneumonia)")
+    print(f"  PNG output                  {median(runs['png']) * 1000:7.1f} ms until anything is shown")
+    print(f"  progressive: probability    {progressive[0] * 1000:7.1f} ms")
+    print(f"               256 preview    {progressive[1] * 1000:7.1f} ms")
+    print(f"               1024 overlay   {progressive[2] * 1000:7.1f} ms")
+    first = median([run[1] for run in runs["atrium progressive"]])
+    last = median([run[-1] for run in runs["atrium progressive"]])
+    print("320x320x40 atrium volume")
+    print(f"  ZIP output                  {median(runs['zip']) * 1000:7.1f} ms until anything is shown")
+    print(f"  progressive: central slice  {first * 1000:7.1f} ms, last slice {last * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
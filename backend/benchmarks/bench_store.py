@@ -0,0 +1,90 @@
+"""
+Prediction store benchmark: the time record() takes on the request path with write-behind
+batching versus committing every record as it is made, how fast the background writer
+drains the queue, and the latency of lookups by study UID and by content hash in a store
+holding many predictions.
+
+Usage: python benchmarks/bench_store.py [records]
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from utils.store import PredictionStore, SCHEMA, COLUMNS  # noqa: E402
+from bench_admission import percentile  # noqa: E402
+
+
+def predictions(count):
+    """(args, kwargs) of count X-ray predictions over count / 4 studies, with every 50th an atrium segmentation."""
+    masks = np.zeros((256, 256, 24), dtype=np.float32)
+    masks[96:160, 96:160, 4:20] = 1
+    for n in range(count):
+        content_hash = hashlib.sha256(str(n).encode()).hexdigest()
+        uids = (f"1.2.826.0.1.{n // 4}", f"1.2.826.0.1.{n // 4}.1", f"1.2.826.0.1.{n // 4}.1.{n}")
+        if n % 50 == 0:
+            yield ("segment_atrium", "atrium", "v1", content_hash, {"threshold": 0.5}), dict(uids=uids, masks=masks)
+        else:
+            yield ("predict_cam", "pneumonia", "v1", content_hash, {"probability": n / count}), dict(uids=uids)
+
+
+def report(name, seconds):
+    print(f"  {name:28s} p50 {percentile(seconds, 0.5) * 1e6:8.1f} us  "
+          f"p99 {percentile(seconds, 0.99) * 1e6:8.1f} us  max {max(seconds) * 1e6:8.1f} us")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    directory = tempfile.mkdtemp()
+    print(f"{count} predictions")
+
+    # Committing each record on the request path
+    db = sqlite3.connect(os.path.join(directory, "sync.sqlite"))
+    db.executescript(SCHEMA)
+    db.execute("PRAGMA journal_mode=WAL")
+    sync = []
+    for n, (args, kwargs) in zip(range(2000), predictions(count)):
+        start = time.perf_counter()
+        with db:
+            db.execute(f"INSERT INTO predictions ({', '.join(COLUMNS[1:])}) VALUES ({', '.join('?' * 10)})",
+                       (time.time(),) + args[:4] + tuple(kwargs["uids"]) + (json.dumps(args[4]), None))
+        sync.append(time.perf_counter() - start)
+    report("commit per record (2000)", sync)
+
+    store = PredictionStore(os.path.join(directory, "store"), max_queue=count)
+    recorded = []
+    start = time.perf_counter()
+    for args, kwargs in predictions(count):
+        begin = time.perf_counter()
+        store.record(*args, **kwargs)
+        recorded.append(time.perf_counter() - begin)
+    queued = time.perf_counter() - start
+    store.flush()
+    drained = time.perf_counter() - start
+    report("record (write-behind)", recorded)
+    stats = store.stats()
+    print(f"  queued in {queued:.2f} s, written in {drained:.2f} s ({count / drained:.0f} records/s, "
+          f"{stats['batches']} transactions, {stats['blobs_written']} mask blobs, {stats['dropped']} dropped)")
+
+    rng = np.random.default_rng(0)
+    for name, lookup, key in (("lookup by study", store.by_study, lambda n: f"1.2.826.0.1.{n // 4}"),
+                              ("lookup by content hash", store.by_content,
+                               lambda n: hashlib.sha256(str(n).encode()).hexdigest())):
+        seconds = []
+        for n in rng.integers(0, count, 1000):
+            begin = time.perf_counter()
+            assert lookup(key(int(n)))
+            seconds.append(time.perf_counter() - begin)
+        report(name, seconds)
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Time to first display and bytes transferred for a full-resolution X-ray: the fixed
+1024x1024 overlay PNG against a tile pyramid, for a viewer showing the whole image in a
+1024 pixel viewport and for one zoomed into a 512x512 region at full resolution.
+
+Usage: python benchmarks/bench_tiles.py [rows columns]
+"""
+import io
+import json
+import os
+import sys
+import time
+
+BACKEND = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, BACKEND)
+
+
+def make_dicom(rows, columns):
+    import numpy as np
+    from pydicom.dataset import Dataset, FileMetaDataset
+    from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.1'
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds = Dataset()
+    ds.file_meta = meta
+    ds.is_little_endian, ds.is_implicit_VR = True, False
+    ds.Modality = 'CR'
+    ds.PhotometricInterpretation = 'MONOCHROME2'
+    ds.SamplesPerPixel = 1
+    ds.Rows, ds.Columns = rows, columns
+    ds.BitsAllocated, ds.BitsStored, ds.HighBit = 16, 12, 11
+    ds.PixelRepresentation = 0
+    # A smooth gradient with some noise compresses like a radiograph rather than like noise
+    y, x = np.mgrid[0:rows, 0:columns]
+    pixels = 2000 + 1000 * np.sin(x / 200) * np.cos(y / 300) + np.random.normal(0, 20, (rows, columns))
+    ds.PixelData = pixels.clip(0, 4095).astype(np.uint16).tobytes()
+    buffer = io.BytesIO()
+    ds.save_as(buffer, write_like_original=False)
+    return buffer.getvalue()
+
+
+def main():
+    rows, columns = (int(v) for v in sys.argv[1:3]) if len(sys.argv) > 2 else (3000, 2500)
+    os.chdir(BACKEND)
+    from app import app
+    import routes.predict_routes as predict_routes
+    predict_routes.warmup.wait()
+    app.config['TESTING'] = True
+    dicom = make_dicom(rows, columns)
+
+    with app.test_client() as client:
+        def post(output):
+            data = {'dicom': (io.BytesIO(dicom), 'x.dcm'), 'output': output}
+            return client.post('/predict_cam/pneumonia', data=data, content_type='multipart/form-data')
+
+        def fetch_tiles(tiles, level, x0, y0, x1, y1):
+            """Fetch the tiles of a level covering a region; returns their total bytes."""
+            size = tiles['tile_size']
+            return sum(len(client.get(f"{tiles['url']}/0/{level}/{col}_{row}.png").data)
+                       for row in range(y0 // size, (y1 - 1) // size + 1)
+                       for col in range(x0 // size, (x1 - 1) // size + 1))
+
+        post("png"), post("tiles")  # first-request effects
+        for _ in range(3):
+            start = time.perf_counter()
+            png = post("png").data
+            png_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            response = post("tiles")
+            tiles = json.loads(response.data)['tiles']
+            # The first level that fits the 1024 viewport
+            level = tiles['max_level'] - max(0, (max(rows, columns) - 1).bit_length() - 10)
+            scale = 1 << (tiles['max_level'] - level)
+            fit_bytes = len(response.data) + fetch_tiles(tiles, level, 0, 0, -(-columns // scale), -(-rows // scale))
+            fit_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            zoom_bytes = fetch_tiles(tiles, tiles['max_level'], 1000, 1000, 1512, 1512)
+            zoom_seconds = time.perf_counter() - start
+
+        print(f"{rows}x{columns} X-ray")
+        print(f"  1024 PNG overlay         {png_seconds * 1000:7.1f} ms  {len(png) / 1024:7.1f} KiB")
+        print(f"  tiles, fit to 1024       {fit_seconds * 1000:7.1f} ms  {fit_bytes / 1024:7.1f} KiB  (level {level})")
+        print(f"  tiles, 512 region zoom   {zoom_seconds * 1000:7.1f} ms  {zoom_bytes / 1024:7.1f} KiB  (full resolution)")
+
+
+if __name__ == "__main__":
+    main()
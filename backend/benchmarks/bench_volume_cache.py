@@ -0,0 +1,70 @@
+"""
+Repeat segmentations of the same NIfTI volume with different options, without the volume
+cache, with the volume in memory and with the volume memory-mapped from the disk tier.
+The UNet is replaced by an identity so the timings show decoding, preprocessing and
+rendering rather than inference.
+
+Usage: python benchmarks/bench_volume_cache.py [repeats]
+"""
+import io
+import os
+import sys
+import tempfile
+import time
+from unittest.mock import patch
+
+BACKEND = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, BACKEND)
+sys.path.insert(0, os.path.join(BACKEND, 'benchmarks'))
+
+from bench_admission import percentile  # noqa: E402
+
+
+def main():
+    import nibabel as nib
+    import numpy as np
+    os.chdir(BACKEND)
+    from app import app
+    import routes.predict_routes as predict_routes
+    from utils.volume_cache import VolumeCache
+    predict_routes.warmup.wait()
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+    # A 320x320x120 MRI-like volume: noise with a brighter blob, empty slices at both ends
+    rng = np.random.default_rng(0)
+    volume = np.zeros((320, 320, 120), dtype=np.float32)
+    volume[:, :, 10:110] = rng.normal(100, 20, (320, 320, 100))
+    volume[120:200, 130:210, 40:80] += 300
+    path = os.path.join(tempfile.mkdtemp(), 'volume.nii.gz')
+    nib.save(nib.Nifti1Image(volume, np.eye(4)), path)
+    with open(path, 'rb') as f:
+        nifti = f.read()
+    print(f"{volume.shape} volume, {len(nifti) / 2 ** 20:.1f} MB gzipped, {repeats} repeats")
+
+    thresholds = ['0.3', '0.5', '0.7']
+    caches = (("no cache", lambda: VolumeCache(0)),
+              ("memory", lambda: VolumeCache(1 << 30)),
+              ("disk (mmap)", lambda: VolumeCache(0, tempfile.mkdtemp(), 1 << 30)))
+    with app.test_client() as client, \
+            patch.dict(predict_routes.models, {'atrium': lambda x: x.clamp(0, 1)}):
+        for name, make_cache in caches:
+            cache = make_cache()
+            with patch.object(predict_routes, 'volume_cache', cache):
+                latencies = []
+                for n in range(repeats + 1):
+                    data = {'nifti': (io.BytesIO(nifti), 'volume.nii.gz'), 'threshold': thresholds[n % 3],
+                            'output': 'tiles'}
+                    start = time.perf_counter()
+                    response = client.post('/segment_atrium', data=data, content_type='multipart/form-data')
+                    assert response.status_code == 200
+                    latencies.append(time.perf_counter() - start)
+                    # Repeats read the disk tier, not the volume still waiting to be spilled
+                    cache.flush()
+            first, repeat = latencies[0], latencies[1:]
+            print(f"  {name:12s} first {first * 1000:7.1f} ms   repeats p50 {percentile(repeat, 0.5) * 1000:7.1f} ms  "
+                  f"p95 {percentile(repeat, 0.95) * 1000:7.1f} ms")
+            print(f"  {'':12s} {cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Compare the latency of the first request to each endpoint after startup with and
+without the warm-up phase. Every scenario runs in a fresh interpreter, so lazy
+initialization happens again each time.
+
+Usage: python benchmarks/bench_warmup.py
+"""
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def make_dicom():
+    import numpy as np
+    from pydicom.dataset import Dataset, FileMetaDataset
+    from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.1'
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds = Dataset()
+    ds.file_meta = meta
+    ds.is_little_endian, ds.is_implicit_VR = True, False
+    ds.Modality = 'CR'
+    ds.PhotometricInterpretation = 'MONOCHROME2'
+    ds.SamplesPerPixel = 1
+    ds.Rows = ds.Columns = 1024
+    ds.BitsAllocated, ds.BitsStored, ds.HighBit = 16, 12, 11
+    ds.PixelRepresentation = 0
+    ds.PixelData = np.random.randint(0, 4096, (1024, 1024), dtype=np.uint16).tobytes()
+    buffer = io.BytesIO()
+    ds.save_as(buffer, write_like_original=False)
+    return buffer.getvalue()
+
+
+def make_nifti(path):
+    import nibabel as nib
+    import numpy as np
+    volume = np.random.rand(256, 256, 16).astype(np.float32)
+    nib.save(nib.Nifti1Image(volume, np.eye(4)), path)
+
+
+def child():
+    """Start the app, optionally wait for readiness and time two requests per endpoint."""
+    sys.path.insert(0, BACKEND)
+    os.chdir(BACKEND)
+    started = time.perf_counter()
+    from app import app
+    import routes.predict_routes as predict_routes
+    imported = time.perf_counter() - started
+    predict_routes.warmup.wait()
+    ready = time.perf_counter() - started
+
+    dicom = make_dicom()
+    nifti = os.path.join(tempfile.mkdtemp(), 'volume.nii.gz')
+    make_nifti(nifti)
+    requests = {
+        "pneumonia": ('/predict_cam/pneumonia', lambda: {'dicom': (io.BytesIO(dicom), 'x.dcm')}),
+        "cardiac": ('/predict_cardiac/cardiac', lambda: {'dicom': (io.BytesIO(dicom), 'x.dcm')}),
+        "atrium": ('/segment_atrium', lambda: {'nifti': (open(nifti, 'rb'), 'volume.nii.gz')}),
+    }
+    timings = {"import": imported, "ready": ready}
+    with app.test_client() as client:
+        for name, (endpoint, data) in requests.items():
+            for attempt in ("first", "second"):
+                start = time.perf_counter()
+                response = client.post(endpoint, data=data(), content_type='multipart/form-data')
+                assert response.status_code == 200, response.data[:200]
+                timings[f"{name}_{attempt}"] = time.perf_counter() - start
+    print(json.dumps(timings))
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        return child()
+    results = {}
+    for warmup in ("0", "1"):
+        env = dict(os.environ, WARMUP=warmup, PYTHONWARNINGS="ignore")
+        output = subprocess.run([sys.executable, __file__, "--child"], env=env, check=True,
+                                capture_output=True, text=True).stdout
+        results[warmup] = json.loads(output.strip().splitlines()[-1])
+
+    cold, warm = results["0"], results["1"]
+    print(f"startup until ready: cold {cold['ready']:.2f} s, warm {warm['ready']:.2f} s "
+          f"(import {warm['import']:.2f} s)")
+    for name in ("pneumonia", "cardiac", "atrium"):
+        print(f"{name:10s} first request: cold {cold[name + '_first'] * 1000:7.1f} ms, "
+              f"warm {warm[name + '_first'] * 1000:7.1f} ms | "
+              f"steady state {warm[name + '_second'] * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
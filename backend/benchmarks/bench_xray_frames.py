@@ -0,0 +1,80 @@
+"""
+Compare sending the frames of a serial X-ray study one request at a time with sending
+them as a single multi-frame DICOM, through the Flask test client.
+
+Usage: python benchmarks/bench_xray_frames.py [frames size]
+"""
+import io
+import os
+import sys
+import time
+import numpy as np
+import pydicom
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.chdir(os.path.join(os.path.dirname(__file__), '..'))
+
+from app import app
+
+
+def make_dicom(pixels):
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.1'
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds = Dataset()
+    ds.file_meta = meta
+    ds.is_little_endian, ds.is_implicit_VR = True, False
+    ds.Modality = 'CR'
+    ds.PhotometricInterpretation = 'MONOCHROME2'
+    ds.SamplesPerPixel = 1
+    ds.Rows, ds.Columns = pixels.shape[-2:]
+    ds.BitsAllocated, ds.BitsStored, ds.HighBit = 16, 12, 11
+    ds.PixelRepresentation = 0
+    if pixels.ndim == 3:
+        ds.NumberOfFrames = pixels.shape[0]
+    ds.PixelData = pixels.astype(np.uint16).tobytes()
+    buffer = io.BytesIO()
+    ds.save_as(buffer, write_like_original=False)
+    return buffer.getvalue()
+
+
+def post(client, endpoint, files):
+    data = {'dicom': [(io.BytesIO(f), f'frame_{n}.dcm') for n, f in enumerate(files)]}
+    response = client.post(endpoint, data=data, content_type='multipart/form-data')
+    assert response.status_code == 200, response.data[:200]
+
+
+def main():
+    frames, size = (int(v) for v in sys.argv[1:3]) if len(sys.argv) > 2 else (32, 1024)
+    pixels = np.random.randint(0, 4096, (frames, size, size), dtype=np.uint16)
+    singles = [make_dicom(frame) for frame in pixels]
+    multiframe = make_dicom(pixels)
+
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        for endpoint in ('/predict_cam/pneumonia', '/predict_cardiac/cardiac'):
+            post(client, endpoint, singles[:1])  # warm up
+            start = time.perf_counter()
+            for single in singles:
+                post(client, endpoint, [single])
+            per_frame = time.perf_counter() - start
+
+            start = time.perf_counter()
+            post(client, endpoint, [multiframe])
+            batched = time.perf_counter() - start
+
+            start = time.perf_counter()
+            post(client, endpoint, singles)
+            series = time.perf_counter() - start
+
+            print(f"{endpoint} ({frames} frames of {size}x{size})")
+            print(f"  one request per frame  {per_frame * 1000:8.1f} ms")
+            print(f"  multi-frame request    {batched * 1000:8.1f} ms  ({per_frame / batched:.1f}x)")
+            print(f"  series request         {series * 1000:8.1f} ms  ({per_frame / series:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+import os
+
+
+def parse_box(value):
+    """Parse an "x0,y0,x1,y1" string into a tuple of ints (or None if unset)."""
+    if not value:
+        return None
+    box = tuple(int(v) for v in value.split(","))
+    if len(box) != 4:
+        raise ValueError("Crop box must have the form x0,y0,x1,y1")
+    return box
+
+
+def parse_admission(value):
+    """Parse a "max concurrent,queue size,queue timeout seconds" string into an admission class dict."""
+    max_concurrent, queue_size, queue_timeout = value.split(",")
+    return {"max_concurrent": int(max_concurrent), "queue_size": int(queue_size),
+            "queue_timeout": float(queue_timeout)}
+
+
+# Models
+# Directory with the model checkpoints; hot-reloads may only load checkpoints from here
+MODEL_WEIGHTS_DIR = os.environ.get("MODEL_WEIGHTS_DIR", "weights")
+# Checkpoints of the pneumonia CAM model (ensure you're using the CAM version),
+# the cardiac model and the left atrium segmentation model
+MODEL_CHECKPOINTS = {
+    "pneumonia": os.path.join(MODEL_WEIGHTS_DIR, "pneumonia_weights.ckpt"),
+    "cardiac": os.path.join(MODEL_WEIGHTS_DIR, "cardiac_weights.ckpt"),
+    "atrium": os.path.join(MODEL_WEIGHTS_DIR, "atrium_weights.ckpt"),
+}
+# Token required in the X-Admin-Token header of admin requests (admin endpoints are disabled if unset)
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+# Chest X-ray DICOMs
+# Decode JPEG / JPEG 2000 pixel data at the smallest resolution level that still covers
+# the model input (224) or display (1024) size instead of at full resolution.
+DICOM_REDUCED_DECODE = os.environ.get("DICOM_REDUCED_DECODE", "1") == "1"
+# Number of frames of a multi-frame DICOM or series sent through a model per forward pass
+XRAY_BATCH_SIZE = int(os.environ.get("XRAY_BATCH_SIZE", "16"))
+
+# Archive references
+# Instead of uploading a file, clients may reference it by study, series and instance UID.
+# It is then fetched from the DICOMweb (WADO-RS) server at ARCHIVE_URL, e.g.
+# "http://pacs:8042/dicom-web", or else from the directory ARCHIVE_DIR laid out as
+# <study>/<series>/<instance>.dcm (NIfTI volumes as <study>/<series>.nii.gz).
+# References are rejected if neither is set.
+ARCHIVE_URL = os.environ.get("ARCHIVE_URL")
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR")
+# Keep-alive connections to the DICOMweb server and the timeout of one request in seconds
+ARCHIVE_MAX_CONNECTIONS = int(os.environ.get("ARCHIVE_MAX_CONNECTIONS", "4"))
+ARCHIVE_TIMEOUT = float(os.environ.get("ARCHIVE_TIMEOUT", "30"))
+# Memory for the whole series fetched when one of their instances is referenced, so the
+# following instances are served from memory (0 fetches single instances instead)
+ARCHIVE_PREFETCH_MB = int(os.environ.get("ARCHIVE_PREFETCH_MB", "256"))
+
+# Deep-zoom tiles
+# Results requested with output=tiles keep the full-resolution image and the CAM, box or
+# masks in memory and render overlay tiles of this edge length on demand
+TILE_SIZE = int(os.environ.get("TILE_SIZE", "256"))
+# Memory for the images tiles are rendered from and for the rendered PNG tiles
+TILE_SOURCE_CACHE_MB = int(os.environ.get("TILE_SOURCE_CACHE_MB", "512"))
+TILE_CACHE_MB = int(os.environ.get("TILE_CACHE_MB", "128"))
+
+# Buffer pool
+# Image and tensor buffers of the request path (normalized images, resized CAMs, heatmaps,
+# overlays, UNet input batches) can be reused across requests by shape and dtype. This bounds
+# the memory of the idle buffers kept per worker process. Off (0) by default: reuse saved no
+# end-to-end time in the soak benchmark, while the idle buffers stay resident per worker.
+BUFFER_POOL_MB = int(os.environ.get("BUFFER_POOL_MB", "0"))
+
+# Prediction store
+# Directory of the SQLite database (and the content-addressed mask blobs) every prediction
+# is recorded in with its input hash, study UIDs, model version and result; disabled if unset.
+PREDICTION_STORE_DIR = os.environ.get("PREDICTION_STORE_DIR")
+# Records are written in the background, up to PREDICTION_STORE_BATCH per transaction and at
+# most PREDICTION_STORE_FLUSH_SECONDS after they were made. Records beyond
+# PREDICTION_STORE_QUEUE waiting to be written are dropped rather than delaying responses.
+PREDICTION_STORE_BATCH = int(os.environ.get("PREDICTION_STORE_BATCH", "256"))
+PREDICTION_STORE_FLUSH_SECONDS = float(os.environ.get("PREDICTION_STORE_FLUSH_SECONDS", "1"))
+PREDICTION_STORE_QUEUE = int(os.environ.get("PREDICTION_STORE_QUEUE", "10000"))
+
+# Startup warm-up
+# Run dummy inputs through every model and the decode/encode paths in the background after
+# loading, so the first requests do not pay for lazy initialization. /ready turns healthy
+# once it is done (immediately if disabled).
+WARMUP = os.environ.get("WARMUP", "1") == "1"
+# Batch sizes the X-ray models are warmed up with; the atrium model uses ATRIUM_BATCH_SIZE
+WARMUP_BATCH_SIZES = [int(v) for v in os.environ.get("WARMUP_BATCH_SIZES", f"1,{XRAY_BATCH_SIZE}").split(",")]
+
+# Left atrium segmentation
+# ROI mode for the UNet: "off" runs every foreground slice on the full field of view,
+# "auto" derives a crop from a coarse first pass over the volume.
+ATRIUM_ROI_MODE = os.environ.get("ATRIUM_ROI_MODE", "off")
+# Optional fixed crop box in 224x224 model-input coordinates, e.g. "48,48,176,176"
+ATRIUM_CROP_BOX = parse_box(os.environ.get("ATRIUM_CROP_BOX"))
+# Number of slices sent through the UNet per forward pass
+ATRIUM_BATCH_SIZE = int(os.environ.get("ATRIUM_BATCH_SIZE", "8"))
+# Inference resolution: "resize" (224x224), "native" or "tiled"
+ATRIUM_INFERENCE_MODE = os.environ.get("ATRIUM_INFERENCE_MODE", "resize")
+# Memory budget for one batch of tiles in "tiled" mode, used to pick the tile size
+ATRIUM_TILE_MEMORY_MB = int(os.environ.get("ATRIUM_TILE_MEMORY_MB", "256"))
+# Memory budget for the quantized probability volumes kept for re-thresholding
+ATRIUM_PROBABILITY_CACHE_MB = int(os.environ.get("ATRIUM_PROBABILITY_CACHE_MB", "512"))
+# Compression of the ZIP with the segmented slices: "stored", "deflated", "bzip2" or "lzma".
+# The PNGs are already compressed, so storing them is usually the fastest.
+ATRIUM_ZIP_COMPRESSION = os.environ.get("ATRIUM_ZIP_COMPRESSION", "stored")
+ATRIUM_ZIP_LEVEL = int(os.environ["ATRIUM_ZIP_LEVEL"]) if os.environ.get("ATRIUM_ZIP_LEVEL") else None
+
+# Atrium volumes are kept decoded and preprocessed by upload hash, so segmenting the same
+# volume again (e.g. with other options) skips both. Memory for them, and the dtype the
+# model input is kept in: "float32" or "float16" (half the memory, at half precision).
+VOLUME_CACHE_MB = int(os.environ.get("VOLUME_CACHE_MB", "512"))
+VOLUME_CACHE_DTYPE = os.environ.get("VOLUME_CACHE_DTYPE", "float32")
+# Directory volumes evicted from memory are spilled to and memory-mapped from, and the disk
+# space they may take (spilling is disabled if unset)
+VOLUME_CACHE_DIR = os.environ.get("VOLUME_CACHE_DIR")
+VOLUME_CACHE_DISK_MB = int(os.environ.get("VOLUME_CACHE_DISK_MB", "4096"))
+
+# Admission control
+# Requests processed at once over all endpoints; further requests wait in per-endpoint queues
+ADMISSION_MAX_CONCURRENT = int(os.environ.get("ADMISSION_MAX_CONCURRENT", "4"))
+# Per endpoint class: "max concurrent,queue size,queue timeout in seconds". Requests beyond the
+# queue size get 429, requests that waited longer than the timeout get 503. Single X-ray
+# predictions and re-thresholding are cheap and are admitted before queued multi-frame X-rays
+# and series (up to 256 frames each) and atrium volumes.
+ADMISSION_XRAY = parse_admission(os.environ.get("ADMISSION_XRAY", "4,32,10"))
+ADMISSION_SERIES = parse_admission(os.environ.get("ADMISSION_SERIES", "1,8,60"))
+ADMISSION_RETHRESHOLD = parse_admission(os.environ.get("ADMISSION_RETHRESHOLD", "2,16,10"))
+ADMISSION_ATRIUM = parse_admission(os.environ.get("ADMISSION_ATRIUM", "1,4,60"))
+
+# Largest request body accepted; larger uploads are answered with 413
+MAX_CONTENT_LENGTH_MB = int(os.environ.get("MAX_CONTENT_LENGTH_MB", "2048"))
+
+# ASGI serving (uvicorn asgi:app)
+# Threads the Flask app runs on once a request body has been received. Receiving uploads and
+# sending responses holds no thread, but a request waiting for admission does. The default
+# covers every admitted and queued request plus 8 threads for the endpoints without admission
+# control (/ready, /metrics, tiles, ...), so admission control does the shedding.
+_ADMISSION_CLASSES = (ADMISSION_XRAY, ADMISSION_SERIES, ADMISSION_RETHRESHOLD, ADMISSION_ATRIUM)
+ASGI_WORKERS = int(os.environ.get("ASGI_WORKERS") or
+                   ADMISSION_MAX_CONCURRENT + sum(c["queue_size"] for c in _ADMISSION_CLASSES) + 8)
+# Requests waiting for a thread while all are busy; further ones get 503 with Retry-After
+ASGI_QUEUE = int(os.environ.get("ASGI_QUEUE", "64"))
+# Request bodies up to this size are received into memory, larger ones into a temporary file
+ASGI_SPOOL_MB = int(os.environ.get("ASGI_SPOOL_MB", "16"))
@@ -1,319 +1,991 @@
-from flask import Blueprint, request, jsonify, send_file, make_response
+from flask import Blueprint, Response, request, jsonify, send_file, make_response
+from werkzeug.datastructures import FileStorage
 from flask_cors import CORS  # You'll need to install flask-cors
 import os
 import io
+import json
+import hmac
+import functools
+from contextlib import ExitStack
 import torch
 import cv2
 import numpy as np
-import pydicom
 import nibabel as nib
 import zipfile
 import tempfile
-from utils.preprocess import preprocess_dicom, normalize_volume, standardize_volume
-from utils.cam import compute_cam
+from utils.preprocess import preprocess_dicom, preprocess_pixels, normalize_volume, standardize_volume
+from utils.decode import decode_pixels, iter_series_frames
+from utils.cam import compute_cam, compute_cams
 from utils.model_loader import load_model
+from utils.dicom_validation import validate_dicom_upload, validate_frame_total, frame_count, DicomValidationError
+from utils.render import render_overlays, write_overlays_to_zip
+from utils.pipeline import Pipeline, batched, metrics_snapshot
+from utils.cache import LRUCache, stream_hash
+from utils.postprocess import postprocess_masks
+from utils.warmup import WarmUp, warm_up_model, warm_up_codecs
+from utils.model_registry import ModelRegistry, checkpoint_version
+from utils.admission import AdmissionController, Overloaded
+from utils.singleflight import SingleFlight
+from utils.archive import make_archive, ArchiveError
+from utils.tiles import TileSource, TileStore
+from utils.progressive import multipart_stream, new_boundary, json_part, png_part, center_out
+from utils.buffers import BufferPool, empty, release
+from utils.store import PredictionStore
+from utils.segmentation import (segment_stack, masks_to_native, tile_size_for_budget,
+                                INFERENCE_MODES, MIN_TILE_SIZE, UNET_ALIGNMENT)
+from utils.volume_cache import VolumeCache, prepare_volume, model_stack
+import config
 
 predict_bp = Blueprint('predict_bp', __name__)
 CORS(predict_bp)  # Enable CORS for all routes in this blueprint
 device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
 
-# Load the pneumonia CAM model. Ensure you're using the CAM version.
+# Every model is tagged with the version of its checkpoint, so it can be reloaded while serving
 models = {}
-models["pneumonia"] = load_model("pneumonia", "weights/pneumonia_weights.ckpt", device)
+model_registry = ModelRegistry(models)
+for name, checkpoint in config.MODEL_CHECKPOINTS.items():
+    model_registry.register(name, load_model(name, checkpoint, device), checkpoint_version(checkpoint), checkpoint)
 
-# Add cardiac model to models dict
-models["cardiac"] = load_model("cardiac", "weights/cardiac_weights.ckpt", device)
+def _warmup_batch_sizes(model_name):
+    return [config.ATRIUM_BATCH_SIZE] if model_name == "atrium" else config.WARMUP_BATCH_SIZES
 
-# Add left atrium segmentation model
-models["atrium"] = load_model("atrium", "weights/atrium_weights.ckpt", device)
+# Warm the models and the decode/encode paths up in the background; /ready reports when done
+warmup = WarmUp([
+    (name, lambda name=name: warm_up_model(name, models[name], device, _warmup_batch_sizes(name)))
+    for name in config.MODEL_CHECKPOINTS
+] + [("codecs", warm_up_codecs)] if config.WARMUP else []).start()
+
+ZIP_COMPRESSION_METHODS = {
+    "stored": zipfile.ZIP_STORED,
+    "deflated": zipfile.ZIP_DEFLATED,
+    "bzip2": zipfile.ZIP_BZIP2,
+    "lzma": zipfile.ZIP_LZMA,
+}
+
+# Quantized atrium probability volumes by upload hash, for re-thresholding without re-inference
+probability_cache = LRUCache(config.ATRIUM_PROBABILITY_CACHE_MB * 1024 * 1024)
+
+# Decoded and preprocessed atrium volumes by upload hash, in memory and spilled to disk, so
+# segmenting a volume again with other options skips decoding and preprocessing
+volume_cache = VolumeCache(config.VOLUME_CACHE_MB * 1024 * 1024, config.VOLUME_CACHE_DIR,
+                           config.VOLUME_CACHE_DISK_MB * 1024 * 1024)
+
+# Edge length of the rendered X-ray overlays
+DISPLAY_SIZE = 1024
+
+# Edge length of the preview sent first in progressive responses
+PREVIEW_SIZE = 256
+
+# Image and tensor buffers reused across the requests of this worker, by shape and dtype
+buffer_pool = BufferPool(config.BUFFER_POOL_MB * 1024 * 1024)
+
+# Formats results can be requested in: rendered overlays, tile pyramids served from /tiles,
+# or progressive multipart streams with the result and previews first
+OUTPUT_FORMATS = ("png", "tiles", "progressive")
+tile_store = TileStore(config.TILE_SOURCE_CACHE_MB * 1024 * 1024, config.TILE_CACHE_MB * 1024 * 1024, buffer_pool)
+
+# Per-endpoint concurrency caps and wait queues; lightweight requests are admitted first
+admission = AdmissionController(config.ADMISSION_MAX_CONCURRENT, {
+    "xray": dict(config.ADMISSION_XRAY, priority=0),
+    "series": dict(config.ADMISSION_SERIES, priority=1),
+    "rethreshold": dict(config.ADMISSION_RETHRESHOLD, priority=0),
+    "atrium": dict(config.ADMISSION_ATRIUM, priority=1),
+})
+
+# DICOMweb or filesystem archive that study/series/instance references are fetched from
+archive = make_archive(config.ARCHIVE_URL, config.ARCHIVE_DIR, config.ARCHIVE_MAX_CONNECTIONS,
+                       config.ARCHIVE_TIMEOUT, config.ARCHIVE_PREFETCH_MB * 1024 * 1024)
+
+# Concurrent identical requests (same upload, endpoint, parameters and model version) share one computation
+coalescer = SingleFlight()
+
+# Persistent record of every prediction, written in the background (None if not configured)
+prediction_store = PredictionStore(config.PREDICTION_STORE_DIR, config.PREDICTION_STORE_QUEUE,
+                                   config.PREDICTION_STORE_BATCH, config.PREDICTION_STORE_FLUSH_SECONDS) \
+    if config.PREDICTION_STORE_DIR else None
+
+def _overloaded_response(e):
+    """Answer a request shed by admission control with its status and Retry-After."""
+    response = make_response(jsonify({"error": str(e)}), e.status_code)
+    response.headers['Retry-After'] = str(e.retry_after)
+    response.headers['Access-Control-Allow-Origin'] = 'http://localhost:3000'
+    response.headers['Access-Control-Expose-Headers'] = 'Retry-After'
+    return response
+
+def admitted(endpoint_class):
+    """
+    Run a view under admission control, answering 429/503 with Retry-After when saturated.
+    A progressive response keeps the slot until its last part has been rendered.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            slot = ExitStack()
+            try:
+                slot.enter_context(admission.admit(endpoint_class))
+            except Overloaded as e:
+                return _overloaded_response(e)
+            try:
+                response = view(*args, **kwargs)
+            except BaseException:
+                slot.close()
+                raise
+            return _release_after(response, slot)
+        return wrapper
+    return decorator
+
+def _progressive_slot(endpoint_class, output):
+    """
+    A slot of endpoint_class taken now for progressive output (raising Overloaded when shed),
+    else an empty one. Progressive responses render their parts while they are streamed, so
+    they hold the slot from before inference until the response has been sent.
+    """
+    slot = ExitStack()
+    if output == "progressive":
+        slot.enter_context(admission.admit(endpoint_class))
+    return slot
+
+def _release_after(response, slot):
+    """
+    Give a slot back once a response has been produced: right away unless it is a progressive
+    stream, rendered while it is sent, else after its last part or when it is closed early
+    (the client went away).
+    """
+    if isinstance(response, Response) and response.mimetype == "multipart/mixed":
+        response.response = _release_when_done(response.response, slot)
+        response.call_on_close(slot.close)
+    else:
+        slot.close()
+    return response
+
+def _release_when_done(chunks, slot):
+    yield from chunks
+    slot.close()
+
+def _run_coalesced(key, endpoint_class, compute, admit=True):
+    """
+    Run compute under admission control once for all concurrent requests with the same key.
+    Requests waiting on an identical computation in flight take no admission slot and get
+    its result, or its exception, when it finishes. Requests already holding a slot
+    (admit=False, for progressive output) run compute in it.
+    """
+    def admitted_compute():
+        with admission.admit(endpoint_class):
+            return compute()
+    result, _ = coalescer.do(key, admitted_compute if admit else compute)
+    return result
+
+def _record(endpoint, model_name, model_version, content_hash, result, uids=None, masks=None):
+    """Queue a prediction for the prediction store, if one is configured."""
+    if prediction_store is not None:
+        prediction_store.record(endpoint, model_name, model_version, content_hash, result, uids, masks)
+
+def _dicom_uids(ds):
+    """The (study, series, instance) UIDs of a DICOM header, None where missing."""
+    return tuple(str(ds.get(keyword)) if ds.get(keyword) else None
+                 for keyword in ("StudyInstanceUID", "SeriesInstanceUID", "SOPInstanceUID"))
+
+def _save_upload(file, suffix):
+    """Save an uploaded file to its own temporary file, so concurrent requests never share one."""
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    os.close(fd)
+    file.save(path)
+    return path
+
+def _archive_reference():
+    """The (study, series, instance) UIDs a request references instead of uploading, or None."""
+    if 'study' not in request.form:
+        return None
+    if archive is None:
+        raise ArchiveError("No archive is configured, please upload the file.", 400)
+    study, series = request.form['study'], request.form.get('series')
+    if not series:
+        raise ArchiveError("A series UID is required with the study UID.", 400)
+    return study, series, request.form.get('instance')
+
+def _dicom_files():
+    """
+    The DICOM files of an X-ray request: the uploads, or the referenced archive instance (or
+    all instances of the referenced series) wrapped as uploads.
+    """
+    if 'dicom' in request.files:
+        return request.files.getlist('dicom')
+    reference = _archive_reference()
+    if reference is None:
+        return []
+    study, series, instance = reference
+    if instance:
+        instances = [(instance, archive.instance(study, series, instance))]
+    else:
+        instances = archive.series(study, series)
+    return [FileStorage(io.BytesIO(data), filename=f"{uid}.dcm") for uid, data in instances]
+
+def _nifti_file():
+    """The NIfTI volume of an atrium request: the upload, or the referenced archive volume, or None."""
+    if 'nifti' in request.files:
+        return request.files['nifti']
+    reference = _archive_reference()
+    if reference is None:
+        return None
+    study, series, _ = reference
+    return FileStorage(io.BytesIO(archive.volume(study, series)), filename=f"{series}.nii.gz")
 
 # Helper function to safely normalize images
-def safe_normalize(img):
-    """Safely normalize an image to [0,1] range, handling the case when max=min."""
-    img_min = img.min()
-    img_max = img.max()
+def safe_normalize(img, buffers=None):
+    """
+    Safely normalize an image to a float32 [0,1] range, handling the case when max=min.
+    The result is computed in place in a buffer from buffers (a BufferScope) if given.
+    """
+    normalized = empty(buffers, img.shape, np.float32)
+    np.copyto(normalized, img, casting='unsafe')
+    img_min = normalized.min()
+    img_max = normalized.max()
     if img_max - img_min > 1e-7:  # Only normalize if there's a meaningful difference
-        return (img - img_min) / (img_max - img_min)
+        np.subtract(normalized, img_min, out=normalized)
+        np.divide(normalized, img_max - img_min, out=normalized)
+    else:
+        normalized.fill(0)  # Zeros if the image is flat
+    return normalized
+
+def _xray_request(model_name):
+    """
+    Validate an X-ray upload or archive reference. Returns (file, header, None) for a
+    single-frame DICOM to predict on, or (None, None, response) when the request has already
+    been answered: with an error, or with the ZIP of per-frame results of a multi-frame
+    object or series.
+    """
+    if model_name not in models:
+        return None, None, (jsonify({"error": "Unknown model requested."}), 400)
+    try:
+        files = _dicom_files()
+    except ArchiveError as e:
+        return None, None, (jsonify({"error": str(e)}), e.status_code)
+    if not files:
+        return None, None, (jsonify({"error": "No file provided."}), 400)
+
+    # Reject malformed, oversized or unsupported files from the header alone, before any pixel decode
+    try:
+        headers = [validate_dicom_upload(file.stream, model_name) for file in files]
+        validate_frame_total(headers, model_name)
+    except DicomValidationError as e:
+        return None, None, (jsonify({"error": str(e)}), e.status_code)
+    # Multi-frame objects and series are answered with one ZIP of per-frame results
+    if len(files) > 1 or frame_count(headers[0]) > 1:
+        try:
+            with admission.admit("series"):
+                return None, None, _frame_series_response(model_name, files, headers)
+        except Overloaded as e:
+            return None, None, _overloaded_response(e)
+    return files[0], headers[0], None
+
+def _output_format(params):
+    """
+    The requested result format: "png" (a rendered overlay, the default), "tiles" (a tile
+    pyramid) or "progressive" (a multipart stream with the result first).
+    """
+    output = params.get('output', 'png')
+    if output not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output, expected one of {', '.join(OUTPUT_FORMATS)}.")
+    return output
+
+def _coalesced_xray(endpoint, model_name, file, header, output, compute, field, admit=True):
+    """
+    Run an X-ray prediction, shared with identical uploads to the same endpoint and model in
+    flight. compute returns (result, value, model version); the value is recorded as field,
+    once for every request, including those that shared the computation.
+    """
+    content_hash = stream_hash(file.stream)
+    key = (endpoint, model_name, model_registry.version(model_name), output, content_hash)
+    result, value, model_version = _run_coalesced(key, "xray", lambda: compute(model_name, file, output), admit)
+    _record(endpoint, model_name, model_version, content_hash, {field: value}, _dicom_uids(header))
+    return result, value, model_version
+
+def _xray_response(result, output, headers):
+    """
+    The PNG (for tiles JSON, for progressive output a multipart stream of the given parts)
+    response of an X-ray prediction, with its result headers and CORS headers.
+    """
+    if output == "tiles":
+        response = make_response(jsonify(result))
+    elif output == "progressive":
+        boundary = new_boundary()
+        response = Response(multipart_stream(result, boundary), content_type=f'multipart/mixed; boundary={boundary}')
     else:
-        return np.zeros_like(img)  # Return zeros if the image is flat
+        response = make_response(send_file(io.BytesIO(result), mimetype='image/png'))
+    response.headers.update(headers)
+    response.headers['Access-Control-Allow-Origin'] = 'http://localhost:3000'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+    response.headers['Access-Control-Allow-Methods'] = 'POST'
+    response.headers['Access-Control-Expose-Headers'] = ', '.join(headers)
+    return response
 
 @predict_bp.route('/predict_cam/<model_name>', methods=['POST'])
 def predict_cam_endpoint(model_name):
-    if model_name not in models:
-        return jsonify({"error": "Unknown model requested."}), 400
-    if 'dicom' not in request.files:
-        return jsonify({"error": "No file provided."}), 400
-    
-    file = request.files['dicom']
-    temp_path = "temp.dcm"
-    file.save(temp_path)
-    
     try:
-        # Preprocess the DICOM for model input (224x224 tensor)
-        input_tensor = preprocess_dicom(temp_path)
-        # Compute the CAM and get the prediction probability
-        cam, pred_prob = compute_cam(models[model_name], input_tensor)
-        
-        # Load the original DICOM image for visualization
-        ds = pydicom.read_file(temp_path)
-        raw_img = ds.pixel_array.astype(np.float32)
-        # Use safe normalization
-        raw_img_norm = safe_normalize(raw_img)
-        # Resize the raw image to 1024x1024
-        raw_img_1024 = cv2.resize(raw_img_norm, (1024, 1024))
-        raw_img_1024 = (raw_img_1024 * 255).astype(np.uint8)
-        
-        # Resize the computed CAM (7x7) to 1024x1024
-        cam_resized = cv2.resize(cam.cpu().numpy(), (1024, 1024))
-        # Convert the CAM to a heatmap using a colormap
-        heatmap = cv2.applyColorMap((cam_resized * 255).astype(np.uint8), cv2.COLORMAP_JET)
-        
-        # Convert the raw image to 3 channels
-        raw_img_color = cv2.cvtColor(raw_img_1024, cv2.COLOR_GRAY2BGR)
-        # Overlay the heatmap on the raw image (without adding any text)
-        overlay = cv2.addWeighted(raw_img_color, 0.5, heatmap, 0.5, 0)
-        
-        # Encode the overlay image as PNG
-        _, img_encoded = cv2.imencode('.png', overlay)
-        # Create response with CORS headers
-        response = make_response(send_file(io.BytesIO(img_encoded.tobytes()), mimetype='image/png'))
-        response.headers["X-Probability"] = str(float(pred_prob.item()))  # Convert to float string
-        response.headers['Access-Control-Allow-Origin'] = 'http://localhost:3000'
-        response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
-        response.headers['Access-Control-Allow-Methods'] = 'POST'
-        response.headers['Access-Control-Expose-Headers'] = 'X-Probability'  # Add this line
-        
-        os.remove(temp_path)
+        output = _output_format(request.form)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    file, header, response = _xray_request(model_name)
+    if response is not None:
         return response
+
+    try:
+        slot = _progressive_slot("xray", output)
+    except Overloaded as e:
+        return _overloaded_response(e)
+    try:
+        result, probability, model_version = _coalesced_xray("predict_cam", model_name, file, header, output,
+                                                         _predict_cam, "probability", admit=output != "progressive")
+    except Overloaded as e:
+        slot.close()
+        return _overloaded_response(e)
     except Exception as e:
+        slot.close()
         return jsonify({"error": str(e)}), 500
 
+    if output == "tiles":
+        result = dict(result, probability=probability, model_version=model_version)
+    elif output == "progressive":
+        cam, raw_img = result
+        result = _progressive_parts({"probability": probability, "model_version": model_version}, raw_img,
+                                    lambda display_img, buffers: _cam_overlay(display_img, cam, buffers))
+    # Create response with CORS headers
+    return _release_after(_xray_response(result, output, {
+        "X-Probability": str(probability),  # Convert to float string
+        "X-Model-Version": model_version,
+    }), slot)
+
+def _predict_cam(model_name, file, output="png"):
+    """
+    Compute the CAM of an uploaded X-ray. Returns (PNG bytes of the overlay, the tile
+    pyramid descriptor, or for progressive output the CAM and the decoded image to render
+    later, probability, model version).
+    """
+    temp_path = _save_upload(file, ".dcm")
+    try:
+        with buffer_pool.scope() as buffers:
+            # Preprocess the DICOM for model input (224x224 tensor)
+            input_tensor = preprocess_dicom(temp_path, reduced_decode=config.DICOM_REDUCED_DECODE, buffers=buffers)
+            # Compute the CAM and get the prediction probability
+            with model_registry.lease(model_name) as (model, model_version):
+                cam, pred_prob = compute_cam(model, input_tensor)
+
+            if output == "tiles":
+                # Keep the full-resolution image and the CAM; overlay tiles are rendered on demand
+                source = TileSource([_background_image(decode_pixels(temp_path), buffers)], cam=cam.cpu().numpy(),
+                                    tile_size=config.TILE_SIZE)
+                return {"tiles": tile_store.add(source)}, float(pred_prob.item()), model_version
+
+            # Load the original DICOM image for visualization, at no more resolution than displayed
+            raw_img = decode_pixels(temp_path, min_size=DISPLAY_SIZE if config.DICOM_REDUCED_DECODE else None)
+            if output == "progressive":
+                return (cam.cpu().numpy(), raw_img), float(pred_prob.item()), model_version
+            # Overlay the CAM heatmap on the 1024x1024 image (without adding any text)
+            overlay = _cam_overlay(_display_image(raw_img, buffers=buffers), cam.cpu().numpy(), buffers)
+
+            # Encode the overlay image as PNG
+            _, img_encoded = cv2.imencode('.png', overlay)
+            return img_encoded.tobytes(), float(pred_prob.item()), model_version
+    finally:
+        os.remove(temp_path)
+
 @predict_bp.route('/predict_cardiac/<model_name>', methods=['POST'])
 def predict_cardiac_endpoint(model_name):
-    if model_name not in models:
-        return jsonify({"error": "Unknown model requested."}), 400
-    if 'dicom' not in request.files:
-        return jsonify({"error": "No file provided."}), 400
-    
-    file = request.files['dicom']
-    temp_path = "temp.dcm"
-    file.save(temp_path)
-    
     try:
-        # Preprocess using existing function
-        input_tensor = preprocess_dicom(temp_path)
-        
-        # Get prediction from model
-        with torch.no_grad():
-            bbox = models[model_name](input_tensor.unsqueeze(0))[0]
-        
-        # Scale factor from 224x224 to 1024x1024
-        scale_factor = 1024 / 224
-        
-        # Load and process original image
-        ds = pydicom.read_file(temp_path)
-        raw_img = ds.pixel_array.astype(np.float32)
-        # Use safe normalization
-        raw_img_norm = safe_normalize(raw_img)
-        raw_img_1024 = cv2.resize(raw_img_norm, (1024, 1024))
-        raw_img_1024 = (raw_img_1024 * 255).astype(np.uint8)
-        
-        # Convert to BGR for rectangle drawing
-        img_with_bbox = cv2.cvtColor(raw_img_1024, cv2.COLOR_GRAY2BGR)
-        
-        # Draw predicted bounding box - scale coordinates up to 1024x1024
-        coords = bbox.cpu().numpy()
-        x1, y1, x2, y2 = [int(coord * scale_factor) for coord in coords]
-        cv2.rectangle(img_with_bbox, (x1, y1), (x2, y2), (0, 255, 0), 2)
-        
-        # Encode and return image
-        _, img_encoded = cv2.imencode('.png', img_with_bbox)
-        response = make_response(send_file(io.BytesIO(img_encoded.tobytes()), mimetype='image/png'))
-        
-        # Add CORS headers
-        response.headers['Access-Control-Allow-Origin'] = 'http://localhost:3000'
-        response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
-        response.headers['Access-Control-Allow-Methods'] = 'POST'
-        
-        os.remove(temp_path)
+        output = _output_format(request.form)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    file, header, response = _xray_request(model_name)
+    if response is not None:
         return response
-        
+
+    try:
+        slot = _progressive_slot("xray", output)
+    except Overloaded as e:
+        return _overloaded_response(e)
+    try:
+        result, _, model_version = _coalesced_xray("predict_cardiac", model_name, file, header, output,
+                                                   _predict_cardiac, "bbox", admit=output != "progressive")
+    except Overloaded as e:
+        slot.close()
+        return _overloaded_response(e)
     except Exception as e:
+        slot.close()
         return jsonify({"error": str(e)}), 500
 
-@predict_bp.route('/segment_atrium', methods=['POST'])
-def segment_atrium_endpoint():
-    if 'nifti' not in request.files:
-        return jsonify({"error": "No NIfTI file provided."}), 400
-    
-    file = request.files['nifti']
-    temp_path = "temp.nii.gz"
-    file.save(temp_path)
-    
-    # Create a temporary directory for the slice PNGs
+    if output == "tiles":
+        result = dict(result, model_version=model_version)
+    elif output == "progressive":
+        bbox, raw_img = result
+        result = _progressive_parts({"model_version": model_version}, raw_img,
+                                    lambda display_img, buffers: _bbox_overlay(display_img, bbox, buffers)[0])
+    return _release_after(_xray_response(result, output, {"X-Model-Version": model_version}), slot)
+
+def _predict_cardiac(model_name, file, output="png"):
+    """
+    Predict the heart bounding box of an uploaded X-ray. Returns (PNG bytes of the image
+    with the box drawn, the tile pyramid descriptor and the box, or for progressive output
+    the box and the decoded image to render later, the box in 224x224 model coordinates,
+    model version).
+    """
+    temp_path = _save_upload(file, ".dcm")
+    try:
+        with buffer_pool.scope() as buffers:
+            # Preprocess using existing function
+            input_tensor = preprocess_dicom(temp_path, reduced_decode=config.DICOM_REDUCED_DECODE, buffers=buffers)
+
+            # Get prediction from model
+            with model_registry.lease(model_name) as (model, model_version), torch.no_grad():
+                bbox = model(input_tensor.unsqueeze(0))[0]
+            box = [float(v) for v in bbox.cpu().numpy()]
+
+            if output == "tiles":
+                # Scale the box from 224x224 model coordinates to the full-resolution image
+                background = _background_image(decode_pixels(temp_path), buffers)
+                height, width = background.shape
+                x1, y1, x2, y2 = (float(v) for v in bbox.cpu().numpy() * np.array([width, height, width, height]) / 224)
+                source = TileSource([background], bbox=[x1, y1, x2, y2], tile_size=config.TILE_SIZE)
+                return {"tiles": tile_store.add(source), "bbox": [x1, y1, x2, y2]}, box, model_version
+
+            # Load and process original image, at no more resolution than displayed
+            raw_img = decode_pixels(temp_path, min_size=DISPLAY_SIZE if config.DICOM_REDUCED_DECODE else None)
+            if output == "progressive":
+                return (bbox.cpu().numpy(), raw_img), box, model_version
+            # Draw the predicted bounding box on the 1024x1024 image
+            img_with_bbox, _ = _bbox_overlay(_display_image(raw_img, buffers=buffers), bbox.cpu().numpy(), buffers)
+
+            # Encode the image as PNG
+            _, img_encoded = cv2.imencode('.png', img_with_bbox)
+            return img_encoded.tobytes(), box, model_version
+    finally:
+        os.remove(temp_path)
+
+def _progressive_parts(result, raw_img, render):
+    """
+    The parts of a progressive X-ray response: the result JSON, known right after the
+    forward pass, then the overlay rendered as a small preview and at display size.
+    """
+    yield json_part("result", result)
+    for name, size in (("preview", PREVIEW_SIZE), ("overlay", DISPLAY_SIZE)):
+        with buffer_pool.scope() as buffers:
+            png = cv2.imencode('.png', render(_display_image(raw_img, size, buffers), buffers))[1]
+        yield png_part(name, png)
+
+def _background_image(raw_img, buffers=None):
+    """Normalize a decoded X-ray to a uint8 image at its own resolution, for tile rendering."""
+    img = safe_normalize(raw_img, buffers)
+    np.multiply(img, 255, out=img)
+    return img.astype(np.uint8)
+
+def _display_image(raw_img, size=DISPLAY_SIZE, buffers=None):
+    """
+    Normalize a decoded X-ray and resize it to the (1024x1024) uint8 display image. The
+    image and its intermediates are taken from buffers (a BufferScope) if given; the
+    full-resolution float32 intermediates go back to it as soon as they are done with.
+    """
+    normalized = safe_normalize(raw_img, buffers)
+    resized = cv2.resize(normalized, (size, size), dst=empty(buffers, (size, size), np.float32))
+    release(buffers, normalized)
+    np.multiply(resized, 255, out=resized)
+    display_img = empty(buffers, (size, size), np.uint8)
+    np.copyto(display_img, resized, casting='unsafe')
+    release(buffers, resized)
+    return display_img
+
+def _cam_overlay(display_img, cam, buffers=None):
+    """Blend a (7x7) CAM, resized and color mapped, 50/50 with a display image."""
+    shape = display_img.shape
+    cam_resized = cv2.resize(cam, shape[::-1], dst=empty(buffers, shape, np.float32))
+    np.multiply(cam_resized, 255, out=cam_resized)
+    cam_u8 = empty(buffers, shape, np.uint8)
+    np.copyto(cam_u8, cam_resized, casting='unsafe')
+    # Convert the CAM to a heatmap using a colormap
+    heatmap = cv2.applyColorMap(cam_u8, cv2.COLORMAP_JET, dst=empty(buffers, shape + (3,), np.uint8))
+    # Convert the raw image to 3 channels and blend the heatmap into it in place
+    overlay = cv2.cvtColor(display_img, cv2.COLOR_GRAY2BGR, dst=empty(buffers, shape + (3,), np.uint8))
+    return cv2.addWeighted(overlay, 0.5, heatmap, 0.5, 0, dst=overlay)
+
+def _bbox_overlay(display_img, bbox, buffers=None):
+    """Draw a bounding box predicted in 224x224 model coordinates on a (square) display image."""
+    # Scale factor from 224x224 to 1024x1024
+    scale_factor = display_img.shape[0] / 224
+    # Convert to BGR for rectangle drawing
+    img_with_bbox = cv2.cvtColor(display_img, cv2.COLOR_GRAY2BGR,
+                                 dst=empty(buffers, display_img.shape + (3,), np.uint8))
+    x1, y1, x2, y2 = [int(coord * scale_factor) for coord in bbox]
+    cv2.rectangle(img_with_bbox, (x1, y1), (x2, y2), (0, 255, 0), 2)
+    return img_with_bbox, [x1, y1, x2, y2]
+
+def _predict_frames(model_name, model, dicom_paths):
+    """
+    Run every frame of a series of DICOM files through an X-ray model in batches.
+
+    Frames are decoded lazily, once each at the display resolution from which the model
+    input is derived too. Preparing the next batch, inference and rendering run as
+    overlapping pipeline stages. Returns a list of (per-frame result, overlay PNG, the
+    probability or box in 224x224 model coordinates to record).
+    """
+    min_size = DISPLAY_SIZE if config.DICOM_REDUCED_DECODE else None
+    # The display images of each batch go back to the pool once it has been rendered
+    scopes = []
+
+    def prepare(batch):
+        buffers = buffer_pool.scope()
+        scopes.append(buffers)
+        with buffer_pool.scope() as temporaries:
+            tensors = torch.stack([preprocess_pixels(pixels, temporaries) for _, _, pixels in batch])
+        displays = [_display_image(pixels, buffers=buffers) for _, _, pixels in batch]
+        return [(file_index, frame_index) for file_index, frame_index, _ in batch], tensors, displays, buffers
+
+    def infer(prepared):
+        positions, tensors, displays, buffers = prepared
+        if model_name == "pneumonia":
+            cams, probs = compute_cams(model, tensors.to(device))
+            outputs = list(zip(cams.cpu().numpy(), probs[:, 0].cpu().numpy()))
+        else:
+            with torch.no_grad():
+                outputs = list(model(tensors.to(device)).cpu().numpy())
+        return positions, displays, outputs, buffers
+
+    def render(inferred):
+        positions, displays, outputs, buffers = inferred
+        rendered = []
+        for (file_index, frame_index), display_img, output in zip(positions, displays, outputs):
+            result = {"file": file_index, "frame": frame_index}
+            if model_name == "pneumonia":
+                cam, probability = output
+                overlay = _cam_overlay(display_img, cam, buffers)
+                result["probability"] = float(probability)
+                recorded = {"probability": result["probability"]}
+            else:
+                overlay, result["bbox"] = _bbox_overlay(display_img, output, buffers)
+                recorded = {"bbox": [float(v) for v in output]}
+            rendered.append((result, cv2.imencode('.png', overlay)[1], recorded))
+        buffers.close()
+        return rendered
+
+    pipeline = Pipeline("xray_frames", [("prepare", prepare), ("inference", infer), ("render", render)])
+    frames = iter_series_frames(dicom_paths, min_size)
+    try:
+        return [item for batch in pipeline.run(batched(frames, config.XRAY_BATCH_SIZE)) for item in batch]
+    finally:
+        for buffers in scopes:
+            buffers.close()
+
+def _frame_series_response(model_name, files, headers):
+    """
+    Answer a multi-frame or multi-file upload with a ZIP of per-frame overlays and results,
+    recording each frame under the content hash and UIDs of its file.
+    """
     temp_dir = tempfile.mkdtemp()
-    zip_path = os.path.join(temp_dir, "segmented_slices.zip")
-    
     try:
-        # Load NIfTI volume
-        nifti_img = nib.load(temp_path)
-        volume = nifti_img.get_fdata()
-        
-        nifti_slice_count = volume.shape[2]
-        # print(f"NIfTI volume loaded with {nifti_slice_count} slices.") # Removed log
-
-        # Normalize and standardize volume
-        volume_norm = normalize_volume(volume)
-        volume_std = standardize_volume(volume_norm)
-        
-        # Create a ZIP file to store all segmented slices
+        dicom_paths = []
+        for n, file in enumerate(files):
+            dicom_paths.append(os.path.join(temp_dir, f"upload_{n:03d}.dcm"))
+            file.save(dicom_paths[-1])
+
+        # All frames of one request run on the same model version, even if it is replaced meanwhile
+        with model_registry.lease(model_name) as (model, model_version):
+            frames = _predict_frames(model_name, model, dicom_paths)
+        endpoint = "predict_cam" if model_name == "pneumonia" else "predict_cardiac"
+        content_hashes = [stream_hash(file.stream) for file in files]
+        for result, _, recorded in frames:
+            _record(endpoint, model_name, model_version, content_hashes[result["file"]],
+                    dict(recorded, frame=result["frame"]), _dicom_uids(headers[result["file"]]))
+        results = []
+        zip_path = os.path.join(temp_dir, "frames.zip")
         with zipfile.ZipFile(zip_path, 'w') as zipf:
-            saved_png_count = 0 # Counter for saved PNGs
-            # Process each slice and store predictions
-            for i in range(volume.shape[2]):  # Assuming the slices are along the z-axis
-                # Extract standardized slice for model
-                slice_img = volume_std[:, :, i]
-                
-                # Extract original slice for visualization
-                original_slice = volume[:, :, i]
-                
-                # --- REMOVED Debugging --- 
-                # if i < 3: # Check first 3 slices
-                #     print(f"--- Debug Slice {i} ---")
-                #     print(f"  slice_img shape: {slice_img.shape}")
-                #     print(f"  slice_img dtype: {slice_img.dtype}")
-                #     min_val, max_val = np.min(slice_img), np.max(slice_img)
-                #     has_nan = np.isnan(slice_img).any()
-                #     print(f"  Min value: {min_val:.4f}")
-                #     print(f"  Max value: {max_val:.4f}")
-                #     print(f"  Contains NaN: {has_nan}")
-                # --- End REMOVED Debugging ---
-
-                # Skip completely empty slices (completely black)
-                if np.max(slice_img) < 0.01:
-                    # print(f"Slice {i} skipped (max value < 0.01)") # Removed log
-                    continue
-                
-                # Resize and prepare for model
-                slice_resized = cv2.resize(slice_img, (224, 224))
-                slice_tensor = torch.from_numpy(slice_resized).float().unsqueeze(0).unsqueeze(0).to(device)
-                
-                # Get prediction from model
-                with torch.no_grad():
-                    pred = models["atrium"](slice_tensor)
-                    # AtriumSegmentation forward already applies sigmoid
-                    
-                    # Debug: Output prediction statistics before thresholding
-                    # pred_np = pred.cpu().numpy()
-                    # print(f"Slice {i}: pred min={pred_np.min():.4f}, max={pred_np.max():.4f}, mean={pred_np.mean():.4f}") # Removed log
-                    
-                    # Use a reasonable threshold of 0.5
-                    threshold = 0.5
-                    mask = (pred > threshold).float()
-                    
-                    # Debug: Output mask coverage
-                    # mask_np = mask.cpu().numpy()
-                    # coverage = mask_np.mean() * 100
-                    # print(f"Mask coverage: {coverage:.2f}% of image") # Removed log
-                
-                # Convert prediction to original size
-                mask = mask.squeeze().cpu().numpy()
-                mask_resized = cv2.resize(mask, (slice_img.shape[1], slice_img.shape[0]))
-                
-                # Create RGB visualization with red overlay using OpenCV
-                # Scale the ORIGINAL slice to 0-255 range for visualization based on its own min/max
-                min_orig, max_orig = np.min(original_slice), np.max(original_slice)
-                if max_orig > min_orig: # Avoid division by zero for constant slices
-                    vis_slice = ((original_slice - min_orig) / (max_orig - min_orig) * 255).astype(np.uint8)
-                else:
-                    vis_slice = np.zeros_like(original_slice, dtype=np.uint8) # Handle constant slice
-
-                # Convert grayscale to BGR
-                vis_rgb = cv2.cvtColor(vis_slice, cv2.COLOR_GRAY2BGR)
-                
-                # Create a red mask only where the segmentation is positive
-                red_mask = np.zeros_like(vis_rgb)
-                red_mask[:, :, 2] = (mask_resized * 255).astype(np.uint8)  # Red channel in BGR
-                
-                # Only apply the red overlay where the mask is non-zero
-                overlay = vis_rgb.copy()
-                non_zero_mask = mask_resized > 0
-                if non_zero_mask.any():  # Only blend if there are non-zero pixels in the mask
-                    # Apply red only to the areas with a positive segmentation
-                    overlay[non_zero_mask] = cv2.addWeighted(
-                        vis_rgb[non_zero_mask], 
-                        0.5,  # Alpha for original image
-                        red_mask[non_zero_mask], 
-                        0.5,  # Alpha for red overlay
-                        0
-                    )
-                
-                # Rotate the final overlay image 90 degrees counter-clockwise
-                overlay_rotated = cv2.rotate(overlay, cv2.ROTATE_90_COUNTERCLOCKWISE)
-
-                # Flip the rotated image horizontally (along Y-axis)
-                overlay_final = cv2.flip(overlay_rotated, 1)
-
-                # Create a temporary file for this slice
-                slice_filename = f"slice_{i:03d}.png"
-                temp_slice_path = os.path.join(temp_dir, slice_filename)
-                
-                # Save the ROTATED and FLIPPED slice to the temporary file
-                cv2.imwrite(temp_slice_path, overlay_final)
-                
-                # Add the slice to the ZIP file
-                zipf.write(temp_slice_path, slice_filename)
-                saved_png_count += 1 # Increment counter
-                
-                # Remove the temporary slice file
-                os.remove(temp_slice_path)
-                
-                # --- REMOVED Debugging images save ---
-                # if i == 0 or i == volume.shape[2] // 2:
-                #     debug_dir = os.path.join(temp_dir, "debug")
-                #     os.makedirs(debug_dir, exist_ok=True)
-                # 
-                #     prefix = f"slice_{i:03d}"
-                # 
-                #     # Save scaled original slice used for visualization background
-                #     cv2.imwrite(os.path.join(debug_dir, f"{prefix}_original_scaled.png"), vis_slice)
-                #     zipf.write(os.path.join(debug_dir, f"{prefix}_original_scaled.png"), f"debug/{prefix}_original_scaled.png")
-                # 
-                #     # Save standardized slice fed to model (scale 0-1 to 0-255 for saving)
-                #     standardized_vis = (slice_img * 255).astype(np.uint8)
-                #     cv2.imwrite(os.path.join(debug_dir, f"{prefix}_standardized_model_input.png"), standardized_vis)
-                #     zipf.write(os.path.join(debug_dir, f"{prefix}_standardized_model_input.png"), f"debug/{prefix}_standardized_model_input.png")
-                # 
-                #     # Save binary mask (resized)
-                #     mask_vis = (mask_resized * 255).astype(np.uint8)
-                #     cv2.imwrite(os.path.join(debug_dir, f"{prefix}_binary_mask.png"), mask_vis)
-                #     zipf.write(os.path.join(debug_dir, f"{prefix}_binary_mask.png"), f"debug/{prefix}_binary_mask.png")
-                # --- End REMOVED Debugging images save ---
-        
-            # print(f"Finished processing. Saved {saved_png_count} PNG slices to zip.") # Removed log
-
-        # Create response with the ZIP file
-        response = make_response(send_file(zip_path, 
-                                          mimetype='application/zip',
-                                          as_attachment=True, 
-                                          download_name='segmented_slices.zip'))
-        
-        # Add CORS headers
+            for index, (result, png, _) in enumerate(frames):
+                result = dict(result, index=index, filename=files[result["file"]].filename)
+                zipf.writestr(f"frame_{index:03d}.png", png)
+                results.append(result)
+            zipf.writestr('results.json', json.dumps({"model": model_name, "model_version": model_version,
+                                                      "frames": results}))
+
+        response = make_response(send_file(zip_path,
+                                           mimetype='application/zip',
+                                           as_attachment=True,
+                                           download_name='frames.zip'))
+        response.headers['X-Frame-Count'] = str(len(results))
+        response.headers['X-Model-Version'] = model_version
         response.headers['Access-Control-Allow-Origin'] = 'http://localhost:3000'
         response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
         response.headers['Access-Control-Allow-Methods'] = 'POST'
-        
-        # Clean up
-        os.remove(temp_path)
+        response.headers['Access-Control-Expose-Headers'] = 'X-Frame-Count, X-Model-Version'
         return response
-        
     except Exception as e:
-        # Clean up on error
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
         return jsonify({"error": str(e)}), 500
     finally:
-        # Make sure we clean up the temporary directory
         import shutil
         if os.path.exists(temp_dir):
             shutil.rmtree(temp_dir)
+
+@predict_bp.route('/segment_atrium', methods=['POST'])
+def segment_atrium_endpoint():
+    try:
+        file = _nifti_file()
+    except ArchiveError as e:
+        return jsonify({"error": str(e)}), e.status_code
+    if file is None:
+        return jsonify({"error": "No NIfTI file provided."}), 400
+    # Volumes referenced in the archive are recorded under their study and series
+    uids = None if 'nifti' in request.files else (request.form['study'], request.form['series'], None)
+
+    # Optional ROI settings, defaulting to the server configuration
+    roi = request.form.get('roi', config.ATRIUM_ROI_MODE)
+    if roi not in ("off", "auto"):
+        return jsonify({"error": "Unknown ROI mode, expected 'off' or 'auto'."}), 400
+    try:
+        crop_box = config.parse_box(request.form.get('crop_box')) or config.ATRIUM_CROP_BOX
+    except ValueError:
+        return jsonify({"error": "Invalid crop box, expected x0,y0,x1,y1."}), 400
+
+    # Inference resolution and, for tiled inference, the tile size
+    mode = request.form.get('mode', config.ATRIUM_INFERENCE_MODE)
+    if mode not in INFERENCE_MODES:
+        return jsonify({"error": f"Unknown inference mode, expected one of {', '.join(INFERENCE_MODES)}."}), 400
+    tile_size = request.form.get('tile_size', type=int)
+    if tile_size is None:
+        tile_size = tile_size_for_budget(config.ATRIUM_TILE_MEMORY_MB, config.ATRIUM_BATCH_SIZE)
+    elif tile_size < MIN_TILE_SIZE or tile_size % UNET_ALIGNMENT:
+        return jsonify({"error": f"Tile size must be a multiple of {UNET_ALIGNMENT} and at least {MIN_TILE_SIZE}."}), 400
+    threshold = request.form.get('threshold', 0.5, type=float)
+    if not 0 <= threshold <= 1:
+        return jsonify({"error": "Threshold must be between 0 and 1."}), 400
+    try:
+        zip_options = _zip_options(request.form)
+        output = _output_format(request.form)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    # The upload hash identifies the volume for re-thresholding and for coalescing identical requests
+    volume_id = stream_hash(file.stream)
+    key = ("segment_atrium", model_registry.version("atrium"), volume_id,
+           roi, crop_box, mode, tile_size, threshold, zip_options, output)
+    try:
+        slot = _progressive_slot("atrium", output)
+    except Overloaded as e:
+        return _overloaded_response(e)
+    try:
+        result, stats, model_version, record = _run_coalesced(key, "atrium", lambda: _segment_atrium(
+            file, volume_id, roi, crop_box, mode, tile_size, threshold, zip_options, output, uids),
+            admit=output != "progressive")
+        # Every request is recorded, including those that shared the computation
+        record(uids)
+    except Overloaded as e:
+        slot.close()
+        return _overloaded_response(e)
+    except Exception as e:
+        slot.close()
+        return jsonify({"error": str(e)}), 500
+    return _release_after(_segmentation_response(result, output, volume_id, stats, model_version), slot)
+
+def _segment_atrium(file, volume_id, roi, crop_box, mode, tile_size, threshold, zip_options, output="png",
+                    uids=None):
+    """
+    Segment an uploaded NIfTI volume, decoded and preprocessed only if it is not in the
+    volume cache yet. Returns (ZIP bytes, the slice indices and tile pyramid descriptor, or
+    for progressive output the slices and masks to render later, volume statistics, model
+    version, a function recording the masks under volume_id and the UIDs it is given). The
+    uids are kept with the probabilities for recording re-thresholds.
+    """
+    prepared = volume_cache.get(volume_id)
+    if prepared is None:
+        prepared = _prepare_volume(file)
+        volume_cache.put(volume_id, prepared)
+    slice_indices, depth, voxel_spacing = prepared["indices"], prepared["depth"], prepared["voxel_spacing"]
+    backgrounds = prepared["backgrounds"]
+    native_shape = backgrounds.shape[:2]
+
+    # Run the UNet on the foreground slices (optionally on a cropped ROI)
+    with model_registry.lease("atrium") as (model, model_version), buffer_pool.scope() as buffers:
+        slice_indices, probs = segment_stack(model, slice_indices, model_stack(prepared, mode), device,
+                                             mode=mode, roi=roi, crop_box=crop_box,
+                                             batch_size=config.ATRIUM_BATCH_SIZE,
+                                             tile_size=tile_size, buffers=buffers)
+
+    # Keep the quantized probabilities and the display slices so the volume can be
+    # re-thresholded later without running the model again
+    probability_cache.put(volume_id, {
+        "slice_indices": slice_indices,
+        "probs": np.round(probs * 255).astype(np.uint8),
+        "backgrounds": backgrounds,
+        "depth": depth,
+        "voxel_spacing": voxel_spacing,
+        "model_version": model_version,
+        "uids": uids,
+    })
+
+    # Threshold the probabilities, keep the largest 3D component and measure it
+    masks, stats = postprocess_masks(probs, slice_indices, threshold, depth, voxel_spacing, native_shape)
+    # Convert the masks to the original slice size
+    masks = masks_to_native(masks, 0.5, native_shape)
+
+    def record(request_uids):
+        _record_segmentation(volume_id, model_version, request_uids, slice_indices, threshold, stats, masks,
+                             roi=roi, crop_box=crop_box, mode=mode)
+    result = _segmentation_result(slice_indices, backgrounds, masks, stats, zip_options, output)
+    return result, stats, model_version, record
+
+def _prepare_volume(file):
+    """Decode an uploaded NIfTI volume and prepare it for segmentation (see prepare_volume)."""
+    temp_path = _save_upload(file, ".nii.gz")
+    try:
+        nifti_img = nib.load(temp_path)
+        volume = nifti_img.get_fdata()
+        volume_std = standardize_volume(normalize_volume(volume))
+        return prepare_volume(volume, volume_std, nifti_img.header.get_zooms()[:3],
+                              np.dtype(config.VOLUME_CACHE_DTYPE))
+    finally:
+        os.remove(temp_path)
+
+@predict_bp.route('/segment_atrium/<volume_id>', methods=['GET'])
+@admitted("rethreshold")
+def rethreshold_atrium_endpoint(volume_id):
+    """Re-render the masks of a previously segmented volume at a new threshold."""
+    threshold = request.args.get('threshold', 0.5, type=float)
+    if not 0 <= threshold <= 1:
+        return jsonify({"error": "Threshold must be between 0 and 1."}), 400
+    try:
+        zip_options = _zip_options(request.args)
+        output = _output_format(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    entry = probability_cache.get(volume_id)
+    if entry is None:
+        return jsonify({"error": "Unknown or expired volume, please upload it again."}), 404
+
+    try:
+        # The cached probabilities are quantized to 0-255
+        native_shape = entry["backgrounds"].shape[:2]
+        masks, stats = postprocess_masks(entry["probs"], entry["slice_indices"], threshold * 255,
+                                         entry["depth"], entry["voxel_spacing"], native_shape)
+        masks = masks_to_native(masks, 0.5, native_shape)
+        _record_segmentation(volume_id, entry["model_version"], entry["uids"], entry["slice_indices"],
+                             threshold, stats, masks)
+        result = _segmentation_result(entry["slice_indices"], entry["backgrounds"], masks, stats, zip_options, output)
+        # Tagged with the model version that produced the cached probabilities
+        return _segmentation_response(result, output, volume_id, stats, entry["model_version"], methods='GET')
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def _record_segmentation(volume_id, model_version, uids, slice_indices, threshold, stats, masks, **options):
+    """Record the (H, W, N) masks of the segmented slices of a volume and its statistics."""
+    _record("segment_atrium", "atrium", model_version, volume_id,
+            dict(options, slice_indices=[int(i) for i in slice_indices], threshold=threshold, stats=stats),
+            uids, masks)
+
+def _zip_options(params):
+    """Read the ZIP compression method and level from the request parameters (or the configuration)."""
+    method = params.get('zip_compression', config.ATRIUM_ZIP_COMPRESSION)
+    if method not in ZIP_COMPRESSION_METHODS:
+        raise ValueError(f"Unknown ZIP compression, expected one of {', '.join(ZIP_COMPRESSION_METHODS)}.")
+    level = params.get('zip_level', config.ATRIUM_ZIP_LEVEL, type=int)
+    if level is not None and not 0 <= level <= 9:
+        raise ValueError("ZIP compression level must be between 0 and 9.")
+    return ZIP_COMPRESSION_METHODS[method], level
+
+def _write_segmentation_zip(zip_file, slice_indices, backgrounds, masks, stats, zip_options):
+    """Render the red overlay for every segmented slice and store the PNGs and volume statistics in a ZIP file."""
+    compression, level = zip_options
+    with zipfile.ZipFile(zip_file, 'w', compression=compression, compresslevel=level) as zipf:
+        zipf.writestr('stats.json', json.dumps(stats))
+        # Rendering, PNG encoding and ZIP compression run as overlapping pipeline stages
+        with buffer_pool.scope() as buffers:
+            write_overlays_to_zip(zipf, slice_indices, backgrounds, masks, buffers=buffers)
+
+def _segmentation_tiles(slice_indices, backgrounds, masks):
+    """
+    Register the segmented slices as one tile source, in the display orientation of the ZIP
+    overlays (rotated 90 degrees counter-clockwise and flipped horizontally).
+    """
+    def display(stack, n):
+        return np.ascontiguousarray(stack[::-1, ::-1, n].T)
+    source = TileSource([display(backgrounds, n) for n in range(len(slice_indices))],
+                        masks=[(display(masks, n) * 255).astype(np.uint8) for n in range(len(slice_indices))],
+                        tile_size=config.TILE_SIZE)
+    return {"slices": [int(i) for i in slice_indices], "tiles": tile_store.add(source)}
+
+def _progressive_slices(result, volume_id, stats, model_version, batch_size=8):
+    """
+    The parts of a progressive atrium response: the result JSON, then the slice overlays
+    from the center of the segmented slab (or of the segmented slices) outwards, rendered
+    a batch at a time while the previous ones are sent.
+    """
+    slice_indices, backgrounds, masks = result
+    center = np.mean(stats["slice_range"]) if stats.get("slice_range") else None
+    order = center_out(slice_indices, center)
+    yield json_part("result", {"volume_id": volume_id, "stats": stats, "model_version": model_version,
+                               "slices": [int(slice_indices[n]) for n in order]})
+    for start in range(0, len(order), batch_size):
+        batch = order[start:start + batch_size]
+        with buffer_pool.scope() as buffers:
+            overlays = render_overlays(backgrounds[:, :, batch], masks[:, :, batch], buffers=buffers)
+            for n, overlay in zip(batch, overlays):
+                yield png_part("slice", cv2.imencode('.png', overlay)[1], filename=f"slice_{slice_indices[n]:03d}.png")
+
+def _segmentation_result(slice_indices, backgrounds, masks, stats, zip_options, output):
+    """
+    The ZIP of rendered slice overlays, for tiles the slice indices and the tile pyramid
+    descriptor, and for progressive output the inputs of the overlays, rendered while streaming.
+    """
+    if output == "tiles":
+        return _segmentation_tiles(slice_indices, backgrounds, masks)
+    if output == "progressive":
+        return slice_indices, backgrounds, masks
+    # Create a ZIP file to store all segmented slices
+    zip_buffer = io.BytesIO()
+    _write_segmentation_zip(zip_buffer, slice_indices, backgrounds, masks, stats, zip_options)
+    return zip_buffer.getvalue()
+
+def _segmentation_response(result, output, volume_id, stats, model_version, methods='POST'):
+    """
+    Create the ZIP download (for tiles JSON, for progressive output a multipart stream)
+    response, tagged with the id of the cached volume, its statistics and the model version.
+    """
+    if output == "tiles":
+        response = make_response(jsonify(dict(result, volume_id=volume_id, stats=stats,
+                                              model_version=model_version)))
+    elif output == "progressive":
+        boundary = new_boundary()
+        parts = _progressive_slices(result, volume_id, stats, model_version)
+        response = Response(multipart_stream(parts, boundary), content_type=f'multipart/mixed; boundary={boundary}')
+    else:
+        response = make_response(send_file(io.BytesIO(result), 
+                                          mimetype='application/zip',
+                                          as_attachment=True, 
+                                          download_name='segmented_slices.zip'))
+    response.headers['X-Volume-Id'] = volume_id
+    response.headers['X-Atrium-Stats'] = json.dumps(stats)
+    response.headers['X-Model-Version'] = model_version
+    
+    # Add CORS headers
+    response.headers['Access-Control-Allow-Origin'] = 'http://localhost:3000'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+    response.headers['Access-Control-Allow-Methods'] = methods
+    response.headers['Access-Control-Expose-Headers'] = 'X-Volume-Id, X-Atrium-Stats, X-Model-Version'
+    return response
+
+@predict_bp.route('/tiles/<source_id>', methods=['GET'])
+def tile_source_endpoint(source_id):
+    """Describe the tile pyramid of a result requested with output=tiles."""
+    descriptor = tile_store.descriptor(source_id)
+    if descriptor is None:
+        return jsonify({"error": "Unknown or expired tile source, please request the result again."}), 404
+    response = make_response(jsonify(descriptor))
+    response.headers['Access-Control-Allow-Origin'] = 'http://localhost:3000'
+    return response
+
+@predict_bp.route('/tiles/<source_id>/<int:image>/<int:level>/<int:col>_<int:row>.png', methods=['GET'])
+def tile_endpoint(source_id, image, level, col, row):
+    """Serve one overlay tile, rendering it on first request."""
+    try:
+        png = tile_store.tile_png(source_id, image, level, col, row)
+    except KeyError:
+        return jsonify({"error": "Tile outside the pyramid."}), 404
+    if png is None:
+        return jsonify({"error": "Unknown or expired tile source, please request the result again."}), 404
+    response = make_response(send_file(io.BytesIO(png), mimetype='image/png'))
+    # A tile never changes once its source exists
+    response.headers['Cache-Control'] = 'private, max-age=86400, immutable'
+    response.headers['Access-Control-Allow-Origin'] = 'http://localhost:3000'
+    return response
+
+@predict_bp.route('/predictions', methods=['GET'])
+def predictions_endpoint():
+    """Look up the recorded predictions of a study (study=UID) or of an input (hash=SHA-256), newest first."""
+    if prediction_store is None:
+        return jsonify({"error": "No prediction store is configured."}), 404
+    limit = request.args.get('limit', 100, type=int)
+    if not 1 <= limit <= 1000:
+        return jsonify({"error": "Limit must be between 1 and 1000."}), 400
+    if 'study' in request.args:
+        predictions = prediction_store.by_study(request.args['study'], limit)
+    elif 'hash' in request.args:
+        predictions = prediction_store.by_content(request.args['hash'], limit)
+    else:
+        return jsonify({"error": "A study UID or content hash is required."}), 400
+    response = make_response(jsonify({"predictions": predictions}))
+    response.headers['Access-Control-Allow-Origin'] = 'http://localhost:3000'
+    return response
+
+@predict_bp.route('/predictions/masks/<digest>', methods=['GET'])
+def prediction_masks_endpoint(digest):
+    """Serve recorded segmentation masks, an .npz of their packed bits and (H, W, N) shape."""
+    path = prediction_store.blob_path(digest) if prediction_store is not None else None
+    if path is None:
+        return jsonify({"error": "Unknown masks."}), 404
+    response = make_response(send_file(path, mimetype='application/octet-stream',
+                                       download_name=f"{digest}.npz"))
+    # Blobs are addressed by their contents, so they never change
+    response.headers['Cache-Control'] = 'private, max-age=86400, immutable'
+    response.headers['Access-Control-Allow-Origin'] = 'http://localhost:3000'
+    return response
+
+@predict_bp.route('/admin/models', methods=['GET'])
+def models_status_endpoint():
+    """Report the loaded version of every model, its in-flight requests and the last reload."""
+    if not _is_admin(request):
+        return jsonify({"error": "Admin token required."}), 403
+    return jsonify(model_registry.status())
+
+@predict_bp.route('/admin/models/<model_name>/reload', methods=['POST'])
+def reload_model_endpoint(model_name):
+    """
+    Load a new checkpoint of a model in the background, warm it up and swap it in.
+    Requests already running finish on the old version; new requests get the new one.
+    """
+    if not _is_admin(request):
+        return jsonify({"error": "Admin token required."}), 403
+    if model_name not in config.MODEL_CHECKPOINTS:
+        return jsonify({"error": "Unknown model requested."}), 400
+    checkpoint = request.form.get('checkpoint', model_registry.status()[model_name]["checkpoint"])
+    # Checkpoints are pickles, so only files from the weights directory may be loaded
+    weights_dir = os.path.realpath(config.MODEL_WEIGHTS_DIR)
+    checkpoint_path = os.path.realpath(checkpoint)
+    if os.path.commonpath([weights_dir, checkpoint_path]) != weights_dir:
+        return jsonify({"error": "Checkpoints can only be loaded from the weights directory."}), 400
+    if not os.path.isfile(checkpoint_path):
+        return jsonify({"error": "Checkpoint not found."}), 404
+    version = request.form.get('version') or checkpoint_version(checkpoint_path)
+
+    def load():
+        model = load_model(model_name, checkpoint_path, device)
+        warm_up_model(model_name, model, device, _warmup_batch_sizes(model_name))
+        return model
+
+    if not model_registry.reload(model_name, load, version, checkpoint_path):
+        return jsonify({"error": "A reload of this model is already running."}), 409
+    return jsonify(model_registry.status()[model_name]), 202
+
+def _is_admin(req):
+    """Admin endpoints are only enabled with ADMIN_TOKEN set and need it in the X-Admin-Token header."""
+    token = req.headers.get('X-Admin-Token', '')
+    return bool(config.ADMIN_TOKEN) and hmac.compare_digest(token.encode(), config.ADMIN_TOKEN.encode())
+
+@predict_bp.route('/ready', methods=['GET'])
+def ready_endpoint():
+    """Readiness probe: healthy only once the startup warm-up has completed."""
+    status = warmup.status()
+    response = make_response(jsonify(status), 200 if status["ready"] else 503)
+    if status["warming_up"]:
+        response.headers['Retry-After'] = '1'
+    return response
+
+@predict_bp.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """
+    Report the service metrics: pipelines, probability and volume caches, admission and
+    coalescing, archive, tiles, buffer pool and prediction store.
+    """
+    return jsonify({
+        "pipelines": metrics_snapshot(),
+        "probability_cache": probability_cache.stats(),
+        "admission": admission.stats(),
+        "coalescing": coalescer.stats(),
+        "archive": archive.stats() if archive is not None else None,
+        "tiles": tile_store.stats(),
+        "buffers": buffer_pool.stats(),
+        "volume_cache": volume_cache.stats(),
+        "prediction_store": prediction_store.stats() if prediction_store is not None else None,
+    })
@@ -51,4 +51,67 @@ def mock_atrium_model():
     model = MagicMock(spec=AtriumSegmentation)
     # Configure the mock to return a segmentation mask when called
     model.return_value = MagicMock()  # Mock segmentation mask tensor
-    return model
\ No newline at end of file
+    return model
+
+@pytest.fixture
+def make_dicom():
+    """Factory for small in-memory DICOM files; header attributes can be overridden."""
+    import io
+    import numpy as np
+    import pydicom
+    from pydicom.dataset import Dataset, FileMetaDataset
+    from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+    def _make(rows=64, columns=64, transfer_syntax=ExplicitVRLittleEndian, pixels=None, **attrs):
+        meta = FileMetaDataset()
+        meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.1'  # Computed Radiography
+        meta.MediaStorageSOPInstanceUID = generate_uid()
+        meta.TransferSyntaxUID = transfer_syntax
+
+        ds = Dataset()
+        ds.file_meta = meta
+        ds.is_little_endian = True
+        ds.is_implicit_VR = False
+        ds.SOPClassUID = meta.MediaStorageSOPClassUID
+        ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+        ds.Modality = 'CR'
+        ds.PhotometricInterpretation = 'MONOCHROME2'
+        ds.SamplesPerPixel = 1
+        ds.Rows = rows
+        ds.Columns = columns
+        ds.BitsAllocated = 16
+        ds.BitsStored = 12
+        ds.HighBit = 11
+        ds.PixelRepresentation = 0
+        for keyword, value in attrs.items():
+            setattr(ds, keyword, value)
+        if pixels is None:
+            pixels = np.random.randint(0, 4096, (rows, columns), dtype=np.uint16)
+        ds.PixelData = pixels.astype(np.uint16).tobytes()
+
+        buffer = io.BytesIO()
+        ds.save_as(buffer, write_like_original=False)
+        return buffer.getvalue()
+
+    return _make
+
+@pytest.fixture
+def dicom_archive(make_dicom, tmp_path):
+    """A filesystem archive with one study holding a series of three X-ray instances."""
+    study, series = '1.2.826.0.1.3680043.8.498.1', '1.2.826.0.1.3680043.8.498.1.1'
+    # In instance number order, which is the reverse of the file name order
+    instances = [f'{series}.{n}' for n in (3, 2, 1)]
+    directory = tmp_path / study / series
+    directory.mkdir(parents=True)
+    for number, uid in enumerate(instances, 1):
+        (directory / f'{uid}.dcm').write_bytes(make_dicom(SOPInstanceUID=uid, InstanceNumber=number))
+    return {"root": str(tmp_path), "study": study, "series": series, "instances": instances}
+
+@pytest.fixture
+def dicomweb_server(dicom_archive):
+    """The stand-in DICOMweb server serving dicom_archive."""
+    from tests.dicomweb_server import DicomWebServer
+    server = DicomWebServer(dicom_archive["root"]).start()
+    yield server
+    server.shutdown()
+    server.server_close()
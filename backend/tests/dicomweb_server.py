@@ -0,0 +1,85 @@
+"""
+Small stand-in DICOMweb server for tests and local development. It serves a directory in
+the filesystem archive layout (<study>/<series>/<instance>.dcm) over WADO-RS with HTTP/1.1
+keep-alive and counts the connections, requests and whole-series requests it receives. An optional per-request
+latency stands in for the round trip to a remote archive.
+
+Usage: python tests/dicomweb_server.py <archive directory> [port] [latency seconds]
+"""
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROUTE = re.compile(r"^/dicom-web/studies/([0-9.]+)/series/([0-9.]+)(?:/instances/([0-9.]+))?$")
+
+
+class WadoHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests += 1
+        time.sleep(self.server.latency)
+        match = ROUTE.match(self.path)
+        if not match:
+            return self._send(404, "text/plain", b"Not found")
+        study, series, instance = match.groups()
+        if instance is None:
+            self.server.series_requests += 1
+        directory = os.path.join(self.server.root, study, series)
+        names = sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+        names = [name for name in names if name.endswith(".dcm") and instance in (None, name[:-4])]
+        if not names:
+            return self._send(404, "text/plain", b"Not found")
+
+        boundary = uuid.uuid4().hex
+        parts = []
+        for name in names:
+            with open(os.path.join(directory, name), "rb") as f:
+                parts += [f"--{boundary}\r\nContent-Type: application/dicom\r\n\r\n".encode(), f.read(), b"\r\n"]
+        parts.append(f"--{boundary}--\r\n".encode())
+        self._send(200, f'multipart/related; type="application/dicom"; boundary={boundary}', b"".join(parts))
+
+    def _send(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class DicomWebServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, root, port=0, latency=0.0):
+        super().__init__(("127.0.0.1", port), WadoHandler)
+        self.root = root
+        self.latency = latency
+        self.connections = 0
+        self.requests = 0
+        self.series_requests = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/dicom-web"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+if __name__ == "__main__":
+    server = DicomWebServer(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 8042,
+                            float(sys.argv[3]) if len(sys.argv) > 3 else 0.0)
+    print(f"Serving {sys.argv[1]} at {server.url}")
+    server.serve_forever()
@@ -42,9 +42,10 @@ def sample_nii_file():
 
 
 class TestPneumoniaEndpoint:
+    @patch('routes.predict_routes.validate_dicom_upload')
     @patch('routes.predict_routes.preprocess_dicom')
     @patch('routes.predict_routes.compute_cam')
-    @patch('routes.predict_routes.pydicom.read_file')
+    @patch('utils.decode.pydicom.read_file')
     @patch('routes.predict_routes.cv2.resize')
     @patch('routes.predict_routes.cv2.applyColorMap')
     @patch('routes.predict_routes.cv2.cvtColor')
@@ -54,7 +55,7 @@ class TestPneumoniaEndpoint:
     def test_pneumonia_prediction(self, mock_remove, mock_imencode, mock_addweighted, 
                                   mock_cvtcolor, mock_applycolormap, mock_resize, 
                                   mock_read_file, mock_compute_cam, mock_preprocess, 
-                                  client, sample_dcm_file):
+                                  mock_validate, client, sample_dcm_file):
         """Test the pneumonia classification endpoint."""
         # Mock the preprocessing to return a tensor of the right shape
         mock_preprocess.return_value = torch.zeros((1, 224, 224))
@@ -99,6 +100,26 @@ class TestPneumoniaEndpoint:
         json_data = json.loads(response.data)
         assert 'error' in json_data
     
+    def test_pneumonia_invalid_dicom(self, client, sample_dcm_file):
+        """Test that files that are not DICOM are rejected before any decoding."""
+        data = {
+            'dicom': (sample_dcm_file, 'test.dcm')
+        }
+        response = client.post('/predict_cam/pneumonia', data=data, content_type='multipart/form-data')
+        assert response.status_code == 400
+        json_data = json.loads(response.data)
+        assert 'error' in json_data
+
+    @patch('routes.predict_routes.preprocess_dicom')
+    def test_pneumonia_wrong_modality(self, mock_preprocess, client, make_dicom):
+        """Test that a DICOM of the wrong modality is rejected from its header."""
+        data = {
+            'dicom': (io.BytesIO(make_dicom(Modality='MR')), 'test.dcm')
+        }
+        response = client.post('/predict_cam/pneumonia', data=data, content_type='multipart/form-data')
+        assert response.status_code == 422
+        mock_preprocess.assert_not_called()
+
     def test_pneumonia_invalid_model(self, client, sample_dcm_file):
         """Test the pneumonia endpoint with an invalid model name."""
         data = {
@@ -111,8 +132,9 @@ class TestPneumoniaEndpoint:
 
 
 class TestCardiacEndpoint:
+    @patch('routes.predict_routes.validate_dicom_upload')
     @patch('routes.predict_routes.preprocess_dicom')
-    @patch('routes.predict_routes.pydicom.read_file')
+    @patch('utils.decode.pydicom.read_file')
     @patch('routes.predict_routes.cv2.resize')
     @patch('routes.predict_routes.cv2.cvtColor')
     @patch('routes.predict_routes.cv2.rectangle')
@@ -122,7 +144,7 @@ class TestCardiacEndpoint:
     @patch('routes.predict_routes.send_file')
     def test_cardiac_detection(self, mock_send_file, mock_no_grad, mock_remove, mock_imencode, 
                                mock_rectangle, mock_cvtcolor, mock_resize, 
-                               mock_read_file, mock_preprocess, client, sample_dcm_file):
+                               mock_read_file, mock_preprocess, mock_validate, client, sample_dcm_file):
         """Test the cardiac detection endpoint."""
         # Mock the preprocessing to return a tensor of the right shape
         mock_preprocess.return_value = torch.zeros((1, 224, 224))
@@ -199,12 +221,13 @@ class TestAtriumEndpoint:
         # Mock tempfile.mkdtemp to return a fake temp dir
         mock_mkdtemp.return_value = '/tmp/fake_dir'
         
-        # Mock os.path.join to return a fake path
-        mock_join.return_value = '/tmp/fake_dir/segmented_slices.zip'
+        # Mock os.path.join so the ZIP lands at a fake path inside the fake temp dir
+        mock_join.side_effect = lambda *parts: '/'.join(parts)
         
         # Mock the nifti loading
         mock_nifti = MagicMock()
         mock_nifti.get_fdata.return_value = np.ones((224, 224, 10))
+        mock_nifti.header.get_zooms.return_value = (1.0, 1.0, 1.0)
         mock_nib_load.return_value = mock_nifti
         
         # Mock the normalization and standardization to return valid arrays
@@ -256,8 +279,8 @@ class TestAtriumEndpoint:
         # The remove function is called multiple times: once for the temp nifti file
         # and potentially multiple times for each slice PNG
         assert mock_remove.call_count >= 1
-        # Check that temp.nii.gz was removed
-        mock_remove.assert_any_call('temp.nii.gz')
+        # Check that the uploaded temporary NIfTI file was removed
+        assert any(call.args[0].endswith('.nii.gz') for call in mock_remove.call_args_list)
         
         # Note: In a normal execution, rmtree would be called in the finally block,
         # but in our test environment with mocked functions, the finally block may not be 
@@ -268,4 +291,743 @@ class TestAtriumEndpoint:
         response = client.post('/segment_atrium', data={}, content_type='multipart/form-data')
         assert response.status_code == 400
         json_data = json.loads(response.data)
-        assert 'error' in json_data
\ No newline at end of file
+        assert 'error' in json_data
+
+    def test_atrium_invalid_roi(self, client, sample_nii_file):
+        """Test the atrium endpoint with an unknown ROI mode."""
+        data = {
+            'nifti': (sample_nii_file, 'test.nii.gz'),
+            'roi': 'everywhere'
+        }
+        response = client.post('/segment_atrium', data=data, content_type='multipart/form-data')
+        assert response.status_code == 400
+        json_data = json.loads(response.data)
+        assert 'error' in json_data
+
+    def test_atrium_invalid_mode(self, client, sample_nii_file):
+        """Test the atrium endpoint with an unknown inference mode."""
+        data = {
+            'nifti': (sample_nii_file, 'test.nii.gz'),
+            'mode': 'supersampled'
+        }
+        response = client.post('/segment_atrium', data=data, content_type='multipart/form-data')
+        assert response.status_code == 400
+        json_data = json.loads(response.data)
+        assert 'error' in json_data
+
+
+class TestAtriumRethreshold:
+    @pytest.fixture
+    def nifti_upload(self, tmp_path):
+        """A small real NIfTI volume with a bright blob in the middle slices."""
+        import nibabel as nib
+        volume = np.full((32, 32, 6), 0.2, dtype=np.float32)
+        volume[8:24, 8:24, 1:5] = 0.9
+        volume[12:20, 12:20, 2:4] = 1.0
+        path = tmp_path / 'volume.nii.gz'
+        nib.save(nib.Nifti1Image(volume, np.eye(4)), str(path))
+        return path.read_bytes()
+
+    def test_rethreshold_uses_cached_probabilities(self, client, nifti_upload):
+        """Test that a segmented volume can be re-thresholded without running the model."""
+        import zipfile
+        model = MagicMock(side_effect=lambda x: x)
+        with patch.dict('routes.predict_routes.models', {'atrium': model}):
+            data = {'nifti': (io.BytesIO(nifti_upload), 'test.nii.gz')}
+            response = client.post('/segment_atrium', data=data, content_type='multipart/form-data')
+            assert response.status_code == 200
+            volume_id = response.headers['X-Volume-Id']
+            calls = model.call_count
+
+            response = client.get(f'/segment_atrium/{volume_id}?threshold=0.95')
+
+        assert response.status_code == 200
+        assert model.call_count == calls
+        with zipfile.ZipFile(io.BytesIO(response.data)) as zipf:
+            # The outer slices are empty after standardization and are skipped
+            pngs = [name for name in zipf.namelist() if name.endswith('.png')]
+            assert pngs == [f'slice_{i:03d}.png' for i in range(1, 5)]
+            stats = json.loads(zipf.read('stats.json'))
+        # Only the inner, brighter block passes the higher threshold
+        assert stats['slice_range'] == [2, 3]
+        assert json.loads(response.headers['X-Atrium-Stats']) == stats
+
+    def test_rethreshold_unknown_volume(self, client):
+        """Test that re-thresholding a volume that is not cached returns 404."""
+        response = client.get('/segment_atrium/not-a-volume?threshold=0.3')
+        assert response.status_code == 404
+
+    def test_rethreshold_invalid_threshold(self, client):
+        """Test that thresholds outside [0, 1] are rejected."""
+        response = client.get('/segment_atrium/not-a-volume?threshold=3')
+        assert response.status_code == 400
+
+    def test_rethreshold_zip_compression(self, client, nifti_upload):
+        """Test that the ZIP compression method can be selected per request."""
+        import zipfile
+        with patch.dict('routes.predict_routes.models', {'atrium': MagicMock(side_effect=lambda x: x)}):
+            data = {'nifti': (io.BytesIO(nifti_upload), 'test.nii.gz'), 'zip_compression': 'deflated'}
+            response = client.post('/segment_atrium', data=data, content_type='multipart/form-data')
+            assert response.status_code == 200
+            with zipfile.ZipFile(io.BytesIO(response.data)) as zipf:
+                assert all(info.compress_type == zipfile.ZIP_DEFLATED for info in zipf.infolist())
+
+            volume_id = response.headers['X-Volume-Id']
+            response = client.get(f'/segment_atrium/{volume_id}?zip_compression=gzip')
+            assert response.status_code == 400
+
+
+class TestFrameSeries:
+    def test_pneumonia_multiframe(self, client, make_dicom):
+        """Test that every frame of a multi-frame DICOM is classified in one request."""
+        import zipfile
+        pixels = np.random.randint(0, 4096, (3, 64, 64), dtype=np.uint16)
+        data = {
+            'dicom': (io.BytesIO(make_dicom(pixels=pixels, NumberOfFrames=3)), 'study.dcm')
+        }
+        response = client.post('/predict_cam/pneumonia', data=data, content_type='multipart/form-data')
+        assert response.status_code == 200
+        assert response.headers['Content-Type'] == 'application/zip'
+        assert response.headers['X-Frame-Count'] == '3'
+        assert response.headers['X-Model-Version'] == routes.predict_routes.model_registry.version('pneumonia')
+        with zipfile.ZipFile(io.BytesIO(response.data)) as zipf:
+            results = json.loads(zipf.read('results.json'))
+            assert [(r['file'], r['frame']) for r in results['frames']] == [(0, 0), (0, 1), (0, 2)]
+            assert all(0 <= r['probability'] <= 1 for r in results['frames'])
+            overlay = cv2.imdecode(np.frombuffer(zipf.read('frame_002.png'), np.uint8), cv2.IMREAD_COLOR)
+            assert overlay.shape == (1024, 1024, 3)
+
+    def test_cardiac_series(self, client, make_dicom):
+        """Test that a series of uploaded files is answered with per-frame bounding boxes."""
+        import zipfile
+        data = {
+            'dicom': [(io.BytesIO(make_dicom()), 'first.dcm'), (io.BytesIO(make_dicom()), 'second.dcm')]
+        }
+        response = client.post('/predict_cardiac/cardiac', data=data, content_type='multipart/form-data')
+        assert response.status_code == 200
+        with zipfile.ZipFile(io.BytesIO(response.data)) as zipf:
+            results = json.loads(zipf.read('results.json'))['frames']
+            assert [r['filename'] for r in results] == ['first.dcm', 'second.dcm']
+            assert all(len(r['bbox']) == 4 for r in results)
+            assert set(zipf.namelist()) == {'frame_000.png', 'frame_001.png', 'results.json'}
+
+    def test_series_one_invalid_file(self, client, make_dicom):
+        """Test that a series is rejected if any of its files fails admission."""
+        data = {
+            'dicom': [(io.BytesIO(make_dicom()), 'first.dcm'), (io.BytesIO(make_dicom(Modality='MR')), 'second.dcm')]
+        }
+        response = client.post('/predict_cam/pneumonia', data=data, content_type='multipart/form-data')
+        assert response.status_code == 422
+
+
+class TestMetricsEndpoint:
+    def test_metrics(self, client):
+        """Test that pipeline and cache metrics are reported."""
+        response = client.get('/metrics')
+        assert response.status_code == 200
+        json_data = json.loads(response.data)
+        assert 'pipelines' in json_data
+        assert 'probability_cache' in json_data
+        assert set(json_data['admission']) == {'xray', 'series', 'rethreshold', 'atrium'}
+        assert set(json_data['coalescing']) == {'in_flight', 'leaders', 'followers'}
+        assert set(json_data['tiles']) == {'sources', 'tiles'}
+        assert json_data['buffers']['in_use'] == 0
+
+
+class TestReadyEndpoint:
+    def test_ready_after_warmup(self, client):
+        """Test that the readiness probe is healthy once the startup warm-up is done."""
+        assert routes.predict_routes.warmup.wait(timeout=120)
+        response = client.get('/ready')
+        assert response.status_code == 200
+        json_data = json.loads(response.data)
+        assert json_data['ready']
+        assert 'Retry-After' not in response.headers
+
+    def test_not_ready_while_warming_up(self, client):
+        """Test that the readiness probe answers 503 with Retry-After during warm-up."""
+        import threading
+        from utils.warmup import WarmUp
+        release = threading.Event()
+        with patch('routes.predict_routes.warmup', WarmUp([("blocked", release.wait)]).start()):
+            response = client.get('/ready')
+            assert response.status_code == 503
+            assert response.headers['Retry-After'] == '1'
+            release.set()
+            routes.predict_routes.warmup.wait(timeout=5)
+            assert client.get('/ready').status_code == 200
+
+
+class TestModelReload:
+    def test_admin_token_required(self, client, monkeypatch):
+        """Test that the admin endpoints are refused without the configured token."""
+        monkeypatch.setattr('config.ADMIN_TOKEN', None)
+        assert client.post('/admin/models/cardiac/reload', headers={'X-Admin-Token': ''}).status_code == 403
+        monkeypatch.setattr('config.ADMIN_TOKEN', 'secret')
+        assert client.get('/admin/models', headers={'X-Admin-Token': 'wrong'}).status_code == 403
+        assert client.get('/admin/models', headers={'X-Admin-Token': 'secret'}).status_code == 200
+
+    def test_reload_swaps_model_version(self, client, monkeypatch, make_dicom, tmp_path):
+        """Test that a reloaded checkpoint serves new requests, tagged with its version."""
+        import shutil
+        registry = routes.predict_routes.model_registry
+        original = (routes.predict_routes.models['cardiac'], registry.version('cardiac'),
+                    registry.status()['cardiac']['checkpoint'])
+        monkeypatch.setattr('config.ADMIN_TOKEN', 'secret')
+        monkeypatch.setattr('config.MODEL_WEIGHTS_DIR', str(tmp_path))
+        checkpoint = tmp_path / 'cardiac_v2.ckpt'
+        shutil.copy(original[2], checkpoint)
+        try:
+            response = client.post('/admin/models/cardiac/reload', headers={'X-Admin-Token': 'secret'},
+                                   data={'checkpoint': str(checkpoint), 'version': 'v2'})
+            assert response.status_code == 202
+            assert registry.wait_reload('cardiac', timeout=120) == 'done'
+
+            data = {'dicom': (io.BytesIO(make_dicom()), 'test.dcm')}
+            response = client.post('/predict_cardiac/cardiac', data=data, content_type='multipart/form-data')
+            assert response.status_code == 200
+            assert response.headers['X-Model-Version'] == 'v2'
+            assert routes.predict_routes.models['cardiac'] is not original[0]
+        finally:
+            registry.register('cardiac', *original)
+
+    def test_reload_rejects_checkpoints_outside_weights(self, client, monkeypatch, tmp_path):
+        """Test that only checkpoints from the weights directory can be loaded."""
+        monkeypatch.setattr('config.ADMIN_TOKEN', 'secret')
+        headers = {'X-Admin-Token': 'secret'}
+        response = client.post('/admin/models/cardiac/reload', headers=headers, data={'checkpoint': '/etc/passwd'})
+        assert response.status_code == 400
+        response = client.post('/admin/models/cardiac/reload', headers=headers,
+                               data={'checkpoint': 'weights/missing.ckpt'})
+        assert response.status_code == 404
+        response = client.post('/admin/models/unknown/reload', headers=headers)
+        assert response.status_code == 400
+
+
+class TestAdmissionControl:
+    def test_saturated_endpoint_is_shed(self, client, make_dicom):
+        """Test that a saturated endpoint answers 429 with Retry-After without doing any work."""
+        from utils.admission import AdmissionController
+        controller = AdmissionController(1, {
+            "xray": {"max_concurrent": 1, "queue_size": 0, "queue_timeout": 1, "priority": 0},
+            "rethreshold": {"max_concurrent": 1, "queue_size": 1, "queue_timeout": 1, "priority": 0},
+            "atrium": {"max_concurrent": 1, "queue_size": 1, "queue_timeout": 1, "priority": 1},
+        })
+        with patch('routes.predict_routes.admission', controller), \
+                patch('routes.predict_routes.preprocess_dicom') as mock_preprocess:
+            data = {'dicom': (io.BytesIO(make_dicom()), 'test.dcm')}
+            response = client.post('/predict_cam/pneumonia', data=data, content_type='multipart/form-data')
+            assert response.status_code == 429
+            assert int(response.headers['Retry-After']) >= 1
+            mock_preprocess.assert_not_called()
+            assert controller.stats()['xray']['shed_queue_full'] == 1
+
+    def test_series_admitted_separately(self, client, make_dicom):
+        """Test that multi-frame uploads queue in their own class, so they cannot take the single-image slots."""
+        from utils.admission import AdmissionController
+        controller = AdmissionController(2, {
+            "xray": {"max_concurrent": 1, "queue_size": 1, "queue_timeout": 1, "priority": 0},
+            "series": {"max_concurrent": 1, "queue_size": 0, "queue_timeout": 1, "priority": 1},
+            "rethreshold": {"max_concurrent": 1, "queue_size": 1, "queue_timeout": 1, "priority": 0},
+            "atrium": {"max_concurrent": 1, "queue_size": 1, "queue_timeout": 1, "priority": 1},
+        })
+        pixels = np.random.randint(0, 4096, (3, 64, 64), dtype=np.uint16)
+        with patch('routes.predict_routes.admission', controller):
+            data = {'dicom': (io.BytesIO(make_dicom(pixels=pixels, NumberOfFrames=3)), 'study.dcm')}
+            response = client.post('/predict_cam/pneumonia', data=data, content_type='multipart/form-data')
+            assert response.status_code == 429
+            data = {'dicom': (io.BytesIO(make_dicom()), 'test.dcm')}
+            response = client.post('/predict_cam/pneumonia', data=data, content_type='multipart/form-data')
+            assert response.status_code == 200
+        stats = controller.stats()
+        assert (stats['series']['shed_queue_full'], stats['xray']['admitted']) == (1, 1)
+
+
+class TestCoalescing:
+    def test_identical_requests_share_one_prediction(self, make_dicom, tmp_path):
+        """Test that identical uploads in flight at the same time are computed once, and each recorded."""
+        import threading
+        import time
+        from utils.singleflight import SingleFlight
+        from utils.store import PredictionStore
+        coalescer = SingleFlight()
+        store = PredictionStore(str(tmp_path / 'store'), flush_interval=0.01)
+        started, release = threading.Event(), threading.Event()
+        runs = []
+
+        def predict(model_name, file, output):
+            runs.append(model_name)
+            started.set()
+            release.wait(5)
+            return b'png', 0.25, 'v1'
+
+        dicom = make_dicom()
+        statuses = []
+
+        def post():
+            with app.test_client() as client:
+                data = {'dicom': (io.BytesIO(dicom), 'test.dcm')}
+                response = client.post('/predict_cam/pneumonia', data=data, content_type='multipart/form-data')
+                statuses.append((response.status_code, response.headers.get('X-Probability'), response.data))
+
+        with patch('routes.predict_routes.coalescer', coalescer), \
+                patch('routes.predict_routes.prediction_store', store), \
+                patch('routes.predict_routes._predict_cam', side_effect=predict):
+            threads = [threading.Thread(target=post)]
+            threads[0].start()
+            started.wait(5)
+            threads += [threading.Thread(target=post) for _ in range(2)]
+            for thread in threads[1:]:
+                thread.start()
+            while coalescer.stats()['followers'] < 2:
+                time.sleep(0.005)
+            release.set()
+            for thread in threads:
+                thread.join(5)
+
+        assert runs == ['pneumonia']
+        assert statuses == [(200, '0.25', b'png')] * 3
+        assert coalescer.stats() == {"in_flight": 0, "leaders": 1, "followers": 2}
+        store.flush()
+        import hashlib
+        assert [p['result'] for p in store.by_content(hashlib.sha256(dicom).hexdigest())] == \
+            [{'probability': 0.25}] * 3
+        store.close()
+
+    def test_different_uploads_are_not_coalesced(self, client, make_dicom):
+        """Test that the coalescing key includes the upload contents."""
+        from utils.singleflight import SingleFlight
+        coalescer = SingleFlight()
+        with patch('routes.predict_routes.coalescer', coalescer), \
+                patch('routes.predict_routes._predict_cam', return_value=(b'png', 0.5, 'v1')) as mock_predict:
+            for rows in (64, 96):
+                data = {'dicom': (io.BytesIO(make_dicom(rows=rows)), 'test.dcm')}
+                response = client.post('/predict_cam/pneumonia', data=data, content_type='multipart/form-data')
+                assert response.status_code == 200
+        assert mock_predict.call_count == 2
+        assert coalescer.stats()['followers'] == 0
+
+
+class TestArchiveReferences:
+    def test_instance_reference(self, client, dicom_archive, dicomweb_server):
+        """Test that a referenced instance is fetched from the DICOMweb archive and classified."""
+        from utils.archive import make_archive
+        archive = make_archive(url=dicomweb_server.url, prefetch_bytes=1 << 20)
+        data = {'study': dicom_archive['study'], 'series': dicom_archive['series'],
+                'instance': dicom_archive['instances'][1]}
+        with patch('routes.predict_routes.archive', archive):
+            response = client.post('/predict_cam/pneumonia', data=data, content_type='multipart/form-data')
+        assert response.status_code == 200
+        assert response.headers['Content-Type'] == 'image/png'
+        assert 0 <= float(response.headers['X-Probability']) <= 1
+
+    def test_series_reference(self, client, dicom_archive, dicomweb_server):
+        """Test that a referenced series is fetched in one request and answered per instance."""
+        import zipfile
+        from utils.archive import make_archive
+        archive = make_archive(url=dicomweb_server.url, prefetch_bytes=1 << 20)
+        data = {'study': dicom_archive['study'], 'series': dicom_archive['series']}
+        with patch('routes.predict_routes.archive', archive):
+            response = client.post('/predict_cardiac/cardiac', data=data, content_type='multipart/form-data')
+        assert response.status_code == 200
+        assert response.headers['X-Frame-Count'] == '3'
+        assert dicomweb_server.requests == 1
+        with zipfile.ZipFile(io.BytesIO(response.data)) as zipf:
+            results = json.loads(zipf.read('results.json'))['frames']
+            assert [r['filename'] for r in results] == [f'{uid}.dcm' for uid in dicom_archive['instances']]
+
+    def test_missing_reference(self, client, dicom_archive):
+        """Test that an unknown series answers 404."""
+        from utils.archive import make_archive
+        archive = make_archive(directory=dicom_archive['root'])
+        data = {'study': dicom_archive['study'], 'series': '1.2.3'}
+        with patch('routes.predict_routes.archive', archive):
+            response = client.post('/predict_cam/pneumonia', data=data, content_type='multipart/form-data')
+        assert response.status_code == 404
+
+    def test_no_archive_configured(self, client):
+        """Test that references are rejected when no archive is configured."""
+        with patch('routes.predict_routes.archive', None):
+            response = client.post('/segment_atrium', data={'study': '1.2', 'series': '1.2.3'},
+                                   content_type='multipart/form-data')
+        assert response.status_code == 400
+
+
+class TestTiles:
+    def test_pneumonia_tiles(self, client, make_dicom):
+        """Test that a CAM result can be requested as a tile pyramid over the full-resolution image."""
+        data = {'dicom': (io.BytesIO(make_dicom(rows=600, columns=400)), 'test.dcm'), 'output': 'tiles'}
+        response = client.post('/predict_cam/pneumonia', data=data, content_type='multipart/form-data')
+        assert response.status_code == 200
+        result = json.loads(response.data)
+        assert 0 <= result['probability'] <= 1
+        assert float(response.headers['X-Probability']) == result['probability']
+        tiles = result['tiles']
+        assert (tiles['width'], tiles['height'], tiles['max_level']) == (400, 600, 10)
+
+        descriptor = json.loads(client.get(tiles['url']).data)
+        assert descriptor == tiles
+        response = client.get(f"{tiles['url']}/0/{tiles['max_level']}/1_2.png")
+        assert response.status_code == 200
+        assert 'immutable' in response.headers['Cache-Control']
+        tile = cv2.imdecode(np.frombuffer(response.data, np.uint8), cv2.IMREAD_COLOR)
+        assert tile.shape == (600 - 512, 400 - 256, 3)
+        assert client.get(f"{tiles['url']}/0/{tiles['max_level']}/2_0.png").status_code == 404
+
+    def test_cardiac_tiles(self, client, make_dicom):
+        """Test that the bounding box is reported in full-resolution pixels."""
+        data = {'dicom': (io.BytesIO(make_dicom(rows=448, columns=224)), 'test.dcm'), 'output': 'tiles'}
+        response = client.post('/predict_cardiac/cardiac', data=data, content_type='multipart/form-data')
+        assert response.status_code == 200
+        result = json.loads(response.data)
+        assert len(result['bbox']) == 4
+        assert result['model_version'] == response.headers['X-Model-Version']
+
+    def test_atrium_tiles_match_zip(self, client, tmp_path):
+        """Test that the full-resolution atrium tiles equal the slice overlays of the ZIP download."""
+        import nibabel as nib
+        import zipfile
+        volume = np.full((32, 32, 6), 0.2, dtype=np.float32)
+        volume[8:24, 8:24, 1:5] = 0.9
+        path = tmp_path / 'volume.nii.gz'
+        nib.save(nib.Nifti1Image(volume, np.eye(4)), str(path))
+        with patch.dict('routes.predict_routes.models', {'atrium': MagicMock(side_effect=lambda x: x)}):
+            data = {'nifti': (io.BytesIO(path.read_bytes()), 'test.nii.gz'), 'output': 'tiles'}
+            response = client.post('/segment_atrium', data=data, content_type='multipart/form-data')
+            assert response.status_code == 200
+            result = json.loads(response.data)
+            response = client.get(f"/segment_atrium/{result['volume_id']}")
+        assert result['slices'] == [1, 2, 3, 4]
+        tiles = result['tiles']
+        assert tiles['images'] == 4
+        tile = client.get(f"{tiles['url']}/1/{tiles['max_level']}/0_0.png").data
+        with zipfile.ZipFile(io.BytesIO(response.data)) as zipf:
+            assert cv2.imdecode(np.frombuffer(tile, np.uint8), cv2.IMREAD_COLOR).tolist() == \
+                cv2.imdecode(np.frombuffer(zipf.read('slice_002.png'), np.uint8), cv2.IMREAD_COLOR).tolist()
+
+    def test_invalid_output(self, client, make_dicom):
+        """Test that unknown output formats are rejected."""
+        data = {'dicom': (io.BytesIO(make_dicom()), 'test.dcm'), 'output': 'jpeg'}
+        response = client.post('/predict_cam/pneumonia', data=data, content_type='multipart/form-data')
+        assert response.status_code == 400
+
+    def test_unknown_source(self, client):
+        """Test that tiles of unknown or evicted sources answer 404."""
+        assert client.get('/tiles/missing').status_code == 404
+        assert client.get('/tiles/missing/0/0/0_0.png').status_code == 404
+
+
+def multipart_parts(response):
+    """Split a multipart/mixed response into (headers, body) parts."""
+    boundary = response.headers['Content-Type'].split('boundary=')[1].encode()
+    parts = []
+    for segment in response.data.split(b'--' + boundary)[1:-1]:
+        head, _, body = segment[2:].partition(b'\r\n\r\n')
+        headers = dict(line.split(': ', 1) for line in head.decode().split('\r\n'))
+        parts.append((headers, body[:-2]))
+    return parts
+
+
+class TestProgressive:
+    def test_pneumonia_progressive(self, client, make_dicom):
+        """Test that the probability comes first, then a 256 preview, then the same overlay as the PNG output."""
+        dicom = make_dicom(rows=512, columns=512)
+        data = {'dicom': (io.BytesIO(dicom), 'test.dcm'), 'output': 'progressive'}
+        response = client.post('/predict_cam/pneumonia', data=data, content_type='multipart/form-data')
+        assert response.status_code == 200
+        assert response.is_streamed
+        assert response.headers['Content-Type'].startswith('multipart/mixed')
+        parts = multipart_parts(response)
+        assert [headers['Content-Disposition'] for headers, _ in parts] == \
+            ['inline; name="result"', 'inline; name="preview"', 'inline; name="overlay"']
+        result = json.loads(parts[0][1])
+        assert float(response.headers['X-Probability']) == result['probability']
+        preview = cv2.imdecode(np.frombuffer(parts[1][1], np.uint8), cv2.IMREAD_COLOR)
+        assert preview.shape == (256, 256, 3)
+
+        png = client.post('/predict_cam/pneumonia', data={'dicom': (io.BytesIO(dicom), 'test.dcm')},
+                          content_type='multipart/form-data').data
+        assert parts[2][1] == png
+
+    def test_cardiac_progressive(self, client, make_dicom):
+        """Test that the cardiac endpoint streams the same parts."""
+        data = {'dicom': (io.BytesIO(make_dicom()), 'test.dcm'), 'output': 'progressive'}
+        response = client.post('/predict_cardiac/cardiac', data=data, content_type='multipart/form-data')
+        assert response.status_code == 200
+        parts = multipart_parts(response)
+        assert json.loads(parts[0][1])['model_version'] == response.headers['X-Model-Version']
+        assert [headers['Content-Type'] for headers, _ in parts] == ['application/json', 'image/png', 'image/png']
+
+    def test_slot_held_while_streaming(self, client, make_dicom):
+        """Test that a progressive response renders under its admission slot, given back after the last part."""
+        from utils.admission import AdmissionController
+        controller = AdmissionController(1, {
+            "xray": {"max_concurrent": 1, "queue_size": 1, "queue_timeout": 0.1, "priority": 0},
+            "rethreshold": {"max_concurrent": 1, "queue_size": 1, "queue_timeout": 0.1, "priority": 0},
+            "atrium": {"max_concurrent": 1, "queue_size": 1, "queue_timeout": 0.1, "priority": 1},
+        })
+        dicom = make_dicom()
+        with patch('routes.predict_routes.admission', controller):
+            data = {'dicom': (io.BytesIO(dicom), 'test.dcm'), 'output': 'progressive'}
+            streaming = client.post('/predict_cam/pneumonia', data=data, content_type='multipart/form-data')
+            assert streaming.status_code == 200
+            assert controller.stats()['xray']['running'] == 1
+            # The overlays of the first response are still to be rendered, so this one times out queued
+            data = {'dicom': (io.BytesIO(dicom), 'test.dcm'), 'output': 'progressive'}
+            response = client.post('/predict_cam/pneumonia', data=data, content_type='multipart/form-data')
+            assert response.status_code == 503
+            assert len(multipart_parts(streaming)) == 3
+            assert controller.stats()['xray']['running'] == 0
+            response = client.post('/predict_cam/pneumonia', data={'dicom': (io.BytesIO(dicom), 'test.dcm')},
+                                   content_type='multipart/form-data')
+            assert response.status_code == 200
+            assert controller.stats()['xray']['admitted'] == 2
+
+    def test_atrium_central_slices_first(self, client, tmp_path):
+        """Test that the atrium overlays are streamed from the central slices outwards and match the ZIP."""
+        import nibabel as nib
+        import zipfile
+        volume = np.full((32, 32, 8), 0.2, dtype=np.float32)
+        volume[8:24, 8:24, 1:7] = 0.9
+        path = tmp_path / 'volume.nii.gz'
+        nib.save(nib.Nifti1Image(volume, np.eye(4)), str(path))
+        with patch.dict('routes.predict_routes.models', {'atrium': MagicMock(side_effect=lambda x: x)}):
+            data = {'nifti': (io.BytesIO(path.read_bytes()), 'test.nii.gz'), 'output': 'progressive'}
+            response = client.post('/segment_atrium', data=data, content_type='multipart/form-data')
+            assert response.status_code == 200
+            parts = multipart_parts(response)
+            zip_response = client.get(f"/segment_atrium/{response.headers['X-Volume-Id']}")
+            # Only progressive streams keep their slot while they are sent
+            assert routes.predict_routes.admission.stats()['rethreshold']['running'] == 0
+        result = json.loads(parts[0][1])
+        assert result['slices'] == [3, 4, 2, 5, 1, 6]
+        filenames = [headers['Content-Disposition'].split('filename="')[1][:-1] for headers, _ in parts[1:]]
+        assert filenames == [f'slice_{i:03d}.png' for i in result['slices']]
+        with zipfile.ZipFile(io.BytesIO(zip_response.data)) as zipf:
+            for filename, (_, png) in zip(filenames, parts[1:]):
+                assert png == zipf.read(filename)
+
+
+class TestBufferPool:
+    def test_repeated_predictions_reuse_buffers(self, client, make_dicom):
+        """Test that, with a pool configured, a second prediction of the same size takes all its buffers from it."""
+        from utils.buffers import BufferPool
+        pool = BufferPool(64 * 1024 * 1024)
+        dicom = make_dicom(rows=640, columns=480)
+
+        def predict():
+            data = {'dicom': (io.BytesIO(dicom), 'test.dcm')}
+            response = client.post('/predict_cam/pneumonia', data=data, content_type='multipart/form-data')
+            assert response.status_code == 200
+            return response.data
+
+        with patch('routes.predict_routes.buffer_pool', pool):
+            first = predict()
+            allocations = pool.stats()['allocations']
+            assert predict() == first
+            stats = json.loads(client.get('/metrics').data)['buffers']
+        assert stats['allocations'] == allocations
+        assert stats['reuses'] > 0
+        assert stats['in_use'] == 0
+
+    def test_display_image_keeps_only_the_display_buffer(self):
+        """Test that the full-resolution float32 intermediates of a display image go back to the pool at once."""
+        from utils.buffers import BufferPool
+        from routes.predict_routes import _display_image
+        pool = BufferPool(64 * 1024 * 1024)
+        with pool.scope() as buffers:
+            display_img = _display_image(np.zeros((2048, 2048), np.uint16), buffers=buffers)
+            assert display_img.dtype == np.uint8
+            assert pool.stats()['in_use'] == 1
+
+
+class TestPredictionStore:
+    @pytest.fixture
+    def store(self, tmp_path):
+        from utils.store import PredictionStore
+        store = PredictionStore(str(tmp_path / 'store'), flush_interval=0.01)
+        with patch('routes.predict_routes.prediction_store', store):
+            yield store
+        store.close()
+
+    def test_xray_predictions_are_recorded(self, client, make_dicom, store):
+        """Test that CAM and cardiac predictions are found by study UID and by upload hash."""
+        import hashlib
+        dicom = make_dicom(StudyInstanceUID='1.2.826.0.1.1', SeriesInstanceUID='1.2.826.0.1.1.2')
+        for endpoint in ('/predict_cam/pneumonia', '/predict_cardiac/cardiac'):
+            data = {'dicom': (io.BytesIO(dicom), 'test.dcm')}
+            response = client.post(endpoint, data=data, content_type='multipart/form-data')
+            assert response.status_code == 200
+        store.flush()
+
+        response = client.get('/predictions?study=1.2.826.0.1.1')
+        assert response.status_code == 200
+        cardiac, cam = json.loads(response.data)['predictions']
+        assert (cam['endpoint'], cam['model'], cardiac['endpoint']) == ('predict_cam', 'pneumonia', 'predict_cardiac')
+        assert 0 <= cam['result']['probability'] <= 1
+        assert len(cardiac['result']['bbox']) == 4
+        assert cam['series_uid'] == '1.2.826.0.1.1.2'
+        assert cam['content_hash'] == hashlib.sha256(dicom).hexdigest()
+        by_hash = json.loads(client.get(f"/predictions?hash={cam['content_hash']}").data)['predictions']
+        assert [p['id'] for p in by_hash] == [cardiac['id'], cam['id']]
+
+    def test_series_frames_are_recorded(self, client, make_dicom, store):
+        """Test that every frame of a multi-file upload is recorded under its own instance."""
+        dicoms = [make_dicom(StudyInstanceUID='1.2.826.0.1.2') for _ in range(2)]
+        data = {'dicom': [(io.BytesIO(dicom), f'{n}.dcm') for n, dicom in enumerate(dicoms)]}
+        response = client.post('/predict_cam/pneumonia', data=data, content_type='multipart/form-data')
+        assert response.status_code == 200
+        store.flush()
+        predictions = json.loads(client.get('/predictions?study=1.2.826.0.1.2').data)['predictions']
+        assert len(predictions) == 2
+        assert len({p['instance_uid'] for p in predictions}) == 2
+        assert all(p['result']['frame'] == 0 and 0 <= p['result']['probability'] <= 1 for p in predictions)
+
+    def test_atrium_masks_are_recorded(self, client, tmp_path, store):
+        """Test that segmentations and re-thresholds are recorded with masks matching the response."""
+        import nibabel as nib
+        from utils.store import decode_masks
+        volume = np.full((32, 32, 6), 0.2, dtype=np.float32)
+        volume[8:24, 8:24, 1:5] = 0.9
+        path = tmp_path / 'volume.nii.gz'
+        nib.save(nib.Nifti1Image(volume, np.eye(4)), str(path))
+        with patch.dict('routes.predict_routes.models', {'atrium': MagicMock(side_effect=lambda x: x)}):
+            data = {'nifti': (io.BytesIO(path.read_bytes()), 'test.nii.gz'), 'output': 'tiles'}
+            result = json.loads(client.post('/segment_atrium', data=data, content_type='multipart/form-data').data)
+            assert client.get(f"/segment_atrium/{result['volume_id']}?threshold=0.95").status_code == 200
+        store.flush()
+
+        rethreshold, segmentation = json.loads(client.get(f"/predictions?hash={result['volume_id']}").data)['predictions']
+        assert segmentation['result']['slice_indices'] == result['slices'] == [1, 2, 3, 4]
+        assert segmentation['result']['mode'] == 'resize'
+        assert rethreshold['result']['threshold'] == 0.95
+        response = client.get(f"/predictions/masks/{segmentation['masks']}")
+        assert response.status_code == 200
+        masks = decode_masks(response.data)
+        assert masks.shape == (32, 32, 4)
+        assert masks.any()
+
+    def test_lookup_errors(self, client, store):
+        """Test that lookups need a study or hash and that unknown masks answer 404."""
+        assert client.get('/predictions').status_code == 400
+        assert client.get('/predictions?study=1.2&limit=0').status_code == 400
+        assert json.loads(client.get('/predictions?study=1.2').data) == {"predictions": []}
+        assert client.get(f"/predictions/masks/{'0' * 64}").status_code == 404
+        assert client.get('/predictions/masks/..').status_code == 404
+
+    def test_disabled_store(self, client, make_dicom):
+        """Test that predictions work without a store and lookups answer 404."""
+        data = {'dicom': (io.BytesIO(make_dicom()), 'test.dcm')}
+        assert client.post('/predict_cam/pneumonia', data=data, content_type='multipart/form-data').status_code == 200
+        assert client.get('/predictions?study=1.2').status_code == 404
+        assert json.loads(client.get('/metrics').data)['prediction_store'] is None
+
+
+class TestVolumeCache:
+    @pytest.fixture
+    def nifti(self, tmp_path):
+        import nibabel as nib
+        volume = np.full((32, 32, 6), 0.2, dtype=np.float32)
+        volume[8:24, 8:24, 1:5] = 0.9
+        path = tmp_path / 'volume.nii.gz'
+        nib.save(nib.Nifti1Image(volume, np.eye(4)), str(path))
+        return path.read_bytes()
+
+    def segment(self, client, nifti, **options):
+        with patch.dict('routes.predict_routes.models', {'atrium': MagicMock(side_effect=lambda x: x)}):
+            data = dict(options, nifti=(io.BytesIO(nifti), 'test.nii.gz'))
+            response = client.post('/segment_atrium', data=data, content_type='multipart/form-data')
+        assert response.status_code == 200
+        return response
+
+    def test_repeat_requests_skip_decoding(self, client, nifti):
+        """Test that segmenting a volume again with other options neither decodes nor preprocesses it."""
+        import nibabel as nib
+        from utils.volume_cache import VolumeCache
+        with patch('routes.predict_routes.volume_cache', VolumeCache(1 << 30)), \
+                patch('routes.predict_routes.nib.load', wraps=nib.load) as load, \
+                patch('routes.predict_routes.normalize_volume', wraps=routes.predict_routes.normalize_volume) as normalize:
+            first = self.segment(client, nifti)
+            second = self.segment(client, nifti, threshold='0.4', mode='native')
+            third = self.segment(client, nifti)
+        assert (load.call_count, normalize.call_count) == (1, 1)
+        assert zip_contents(third) == zip_contents(first)
+        assert second.headers['X-Volume-Id'] == first.headers['X-Volume-Id']
+
+    def test_spilled_volumes_give_the_same_result(self, client, nifti, tmp_path):
+        """Test that a volume memory-mapped from the disk tier is segmented as the decoded one."""
+        from utils.volume_cache import VolumeCache
+        cache = VolumeCache(0, str(tmp_path / 'volumes'), 1 << 30)
+        with patch('routes.predict_routes.volume_cache', VolumeCache(0)):
+            expected = zip_contents(self.segment(client, nifti))
+        with patch('routes.predict_routes.volume_cache', cache):
+            self.segment(client, nifti)
+            cache.flush()
+            assert zip_contents(self.segment(client, nifti)) == expected
+        assert cache.stats()['disk']['hits'] == 1
+        assert json.loads(client.get('/metrics').data)['volume_cache']['memory']['max_bytes'] > 0
+
+
+def zip_contents(response):
+    """The files of a ZIP response by name (ZIP timestamps differ between requests)."""
+    import zipfile
+    with zipfile.ZipFile(io.BytesIO(response.data)) as zipf:
+        return {name: zipf.read(name) for name in zipf.namelist()}
+
+
+class TestAsgi:
+    def request(self, path, body=b"", content_type=None, method='POST'):
+        """Send one request through the ASGI adapter, the body in 64 KB messages; returns (status, headers, body)."""
+        import asyncio
+        from utils.asgi import AsgiAdapter
+        adapter = AsgiAdapter(app, max_workers=2)
+        headers = [(b'content-type', content_type.encode())] if content_type else []
+        messages = [{'type': 'http.request', 'body': body[i:i + 65536], 'more_body': i + 65536 < len(body)}
+                    for i in range(0, max(len(body), 1), 65536)]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {'type': 'http', 'method': method, 'path': path, 'query_string': b'', 'headers': headers}
+        asyncio.run(adapter(scope, receive, send))
+        adapter.executor.shutdown()
+        return sent[0]['status'], dict(sent[0]['headers']), b''.join(m.get('body', b'') for m in sent[1:])
+
+    def multipart(self, fields):
+        """Encode (name, filename, bytes) fields as a multipart/form-data body."""
+        boundary = 'asgitestboundary'
+        body = b''.join(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                        f'Content-Type: application/octet-stream\r\n\r\n'.encode() + data + b'\r\n'
+                        for name, filename, data in fields) + f'--{boundary}--\r\n'.encode()
+        return body, f'multipart/form-data; boundary={boundary}'
+
+    def test_prediction_matches_wsgi(self, client, make_dicom):
+        """Test that an X-ray prediction served over ASGI equals the one served over WSGI."""
+        dicom = make_dicom(rows=512, columns=512)
+        status, headers, png = self.request('/predict_cam/pneumonia', *self.multipart([('dicom', 'x.dcm', dicom)]))
+        response = client.post('/predict_cam/pneumonia', data={'dicom': (io.BytesIO(dicom), 'x.dcm')},
+                               content_type='multipart/form-data')
+        assert status == 200
+        assert headers[b'content-type'] == b'image/png'
+        assert headers[b'x-probability'] == response.headers['X-Probability'].encode()
+        assert png == response.data
+
+    def test_zip_download(self, make_dicom):
+        """Test that a ZIP sent from a file over ASGI arrives complete."""
+        import zipfile
+        fields = [('dicom', f'{n}.dcm', make_dicom(rows=256, columns=256)) for n in range(3)]
+        status, headers, data = self.request('/predict_cardiac/cardiac', *self.multipart(fields))
+        assert status == 200
+        assert headers[b'x-frame-count'] == b'3'
+        with zipfile.ZipFile(io.BytesIO(data)) as zipf:
+            assert len(json.loads(zipf.read('results.json'))['frames']) == 3
+
+    def test_errors(self):
+        """Test that error responses pass through the adapter."""
+        status, _, body = self.request('/predict_cam/unknown', *self.multipart([]))
+        assert status == 400
+        assert 'error' in json.loads(body)
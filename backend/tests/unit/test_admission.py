@@ -0,0 +1,104 @@
+import threading
+import time
+import pytest
+import sys
+import os
+
+# Add the parent directory to the path so we can import modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from utils.admission import AdmissionController, Overloaded
+
+
+def make_controller(max_concurrent=1, light=(1, 4, 5.0), heavy=(1, 4, 5.0)):
+    return AdmissionController(max_concurrent, {
+        "light": {"max_concurrent": light[0], "queue_size": light[1], "queue_timeout": light[2], "priority": 0},
+        "heavy": {"max_concurrent": heavy[0], "queue_size": heavy[1], "queue_timeout": heavy[2], "priority": 1},
+    })
+
+
+def hold(controller, name, started, release, order=None):
+    """Occupy a slot of a class until release is set, recording the admission order."""
+    def run():
+        with controller.admit(name):
+            if order is not None:
+                order.append(name)
+            started.set()
+            release.wait(5)
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+class TestAdmissionController:
+    def test_per_class_cap(self):
+        """Test that a class never runs more requests than its cap."""
+        controller = make_controller(max_concurrent=4, heavy=(1, 4, 0.05))
+        started, release = threading.Event(), threading.Event()
+        thread = hold(controller, "heavy", started, release)
+        started.wait(5)
+        # A second heavy request times out in the queue although global slots are free
+        with pytest.raises(Overloaded) as excinfo:
+            with controller.admit("heavy"):
+                pass
+        assert excinfo.value.status_code == 503
+        assert excinfo.value.retry_after >= 1
+        # Other classes still get in
+        with controller.admit("light"):
+            assert controller.stats()["light"]["running"] == 1
+        release.set()
+        thread.join()
+        assert controller.stats()["heavy"]["shed_timeout"] == 1
+
+    def test_queue_full(self):
+        """Test that requests beyond the queue size are shed immediately with 429."""
+        controller = make_controller(light=(1, 1, 5.0))
+        started, release = threading.Event(), threading.Event()
+        first = hold(controller, "light", started, release)
+        started.wait(5)
+        second = hold(controller, "light", threading.Event(), release)
+        wait_for(lambda: controller.stats()["light"]["queued"] == 1)
+        with pytest.raises(Overloaded) as excinfo:
+            with controller.admit("light"):
+                pass
+        assert excinfo.value.status_code == 429
+        release.set()
+        first.join()
+        second.join()
+        stats = controller.stats()["light"]
+        assert stats["shed_queue_full"] == 1
+        assert stats["admitted"] == 2
+        assert stats["max_queued"] == 1
+
+    def test_light_requests_first(self):
+        """Test that a queued light request is admitted before an earlier queued heavy one."""
+        controller = make_controller(max_concurrent=1)
+        order = []
+        started, release = threading.Event(), threading.Event()
+        first = hold(controller, "light", started, release, order)
+        started.wait(5)
+        heavy = hold(controller, "heavy", threading.Event(), release, order)
+        wait_for(lambda: controller.stats()["heavy"]["queued"] == 1)
+        light = hold(controller, "light", threading.Event(), release, order)
+        wait_for(lambda: controller.stats()["light"]["queued"] == 1)
+        release.set()
+        for thread in (first, heavy, light):
+            thread.join()
+        assert order == ["light", "light", "heavy"]
+
+    def test_slot_released_on_error(self):
+        """Test that a failing request gives its slot back."""
+        controller = make_controller()
+        with pytest.raises(ValueError):
+            with controller.admit("light"):
+                raise ValueError("boom")
+        assert controller.stats()["light"]["running"] == 0
+        with controller.admit("light"):
+            pass
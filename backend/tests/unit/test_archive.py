@@ -0,0 +1,133 @@
+import threading
+import pytest
+import sys
+import os
+
+# Add the parent directory to the path so we can import modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from utils.archive import (ArchiveClient, ArchiveError, DicomWebArchive, FilesystemArchive,
+                           check_uid, make_archive, parse_multipart_related)
+
+
+class TestParseMultipartRelated:
+    def test_parts(self):
+        """Test that the payloads are split out, including CRLFs inside them."""
+        body = (b'--abc\r\nContent-Type: application/dicom\r\n\r\nfirst\r\n\r\n'
+                b'--abc\r\nContent-Type: application/dicom\r\n\r\nsecond\r\n--abc--\r\n')
+        parts = parse_multipart_related(body, 'multipart/related; type="application/dicom"; boundary="abc"')
+        assert parts == [b'first\r\n', b'second']
+
+    def test_not_multipart(self):
+        """Test that a response without a boundary is rejected."""
+        with pytest.raises(ArchiveError) as excinfo:
+            parse_multipart_related(b'DICM', 'application/dicom')
+        assert excinfo.value.status_code == 502
+
+
+class TestCheckUid:
+    @pytest.mark.parametrize("uid", ["", "../etc", "1.2.abc", "1." * 40 + "1", "1..2"])
+    def test_invalid(self, uid):
+        """Test that anything but a DICOM UID is rejected before it reaches a path or URL."""
+        with pytest.raises(ArchiveError) as excinfo:
+            check_uid(uid)
+        assert excinfo.value.status_code == 400
+
+    def test_valid(self):
+        """Test that a UID is accepted."""
+        assert check_uid("1.2.840.10008.1.2") == "1.2.840.10008.1.2"
+
+
+class TestArchiveClient:
+    def test_filesystem_series_in_instance_order(self, dicom_archive):
+        """Test that a series is returned sorted by instance number, not by file name."""
+        client = make_archive(directory=dicom_archive["root"], prefetch_bytes=1 << 20)
+        instances = client.series(dicom_archive["study"], dicom_archive["series"])
+        assert [uid for uid, _ in instances] == dicom_archive["instances"]
+
+    def test_filesystem_missing(self, dicom_archive):
+        """Test that unknown references answer 404."""
+        client = make_archive(directory=dicom_archive["root"], prefetch_bytes=1 << 20)
+        with pytest.raises(ArchiveError) as excinfo:
+            client.instance(dicom_archive["study"], dicom_archive["series"], "1.2.3")
+        assert excinfo.value.status_code == 404
+        with pytest.raises(ArchiveError) as excinfo:
+            client.volume(dicom_archive["study"], dicom_archive["series"])
+        assert excinfo.value.status_code == 404
+
+    def test_dicomweb_prefetches_series(self, dicom_archive, dicomweb_server):
+        """Test that the instances of a series are fetched in one request on one kept-alive connection."""
+        client = ArchiveClient(DicomWebArchive(dicomweb_server.url), 1 << 20)
+        study, series = dicom_archive["study"], dicom_archive["series"]
+        local = FilesystemArchive(dicom_archive["root"])
+        for uid in dicom_archive["instances"]:
+            assert client.instance(study, series, uid) == local.fetch_instance(study, series, uid)
+        assert dicomweb_server.requests == 1
+        assert client.stats()["prefetch_cache"]["hits"] == 2
+
+    def test_dicomweb_without_prefetch(self, dicom_archive, dicomweb_server):
+        """Test that without prefetching single instances are fetched, reusing the pooled connection."""
+        client = ArchiveClient(DicomWebArchive(dicomweb_server.url), 0)
+        study, series = dicom_archive["study"], dicom_archive["series"]
+        for uid in dicom_archive["instances"]:
+            client.instance(study, series, uid)
+        assert dicomweb_server.requests == 3
+        assert dicomweb_server.connections == 1
+        assert client.stats()["backend"]["connections_opened"] == 1
+
+    def test_dicomweb_oversized_series_fetches_instances(self, dicom_archive, dicomweb_server):
+        """Test that a series larger than the prefetch budget is fetched once, then instance by instance."""
+        client = ArchiveClient(DicomWebArchive(dicomweb_server.url), 1024)
+        study, series = dicom_archive["study"], dicom_archive["series"]
+        local = FilesystemArchive(dicom_archive["root"])
+        for uid in dicom_archive["instances"]:
+            assert client.instance(study, series, uid) == local.fetch_instance(study, series, uid)
+        assert dicomweb_server.requests == 3
+        assert dicomweb_server.series_requests == 1
+        assert client.stats()["oversized_series"] == 1
+        assert client.stats()["prefetch_cache"]["entries"] == 0
+
+    def test_dicomweb_concurrent_series_fetch(self, dicom_archive, dicomweb_server):
+        """Test that concurrent requests for the same series share one download."""
+        client = ArchiveClient(DicomWebArchive(dicomweb_server.url), 1 << 20)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            client.series(dicom_archive["study"], dicom_archive["series"]))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        assert len(results) == 4 and all(result == results[0] for result in results)
+        assert dicomweb_server.requests <= 4
+        assert client.stats()["backend"]["connections_opened"] <= 4
+
+    def test_dicomweb_errors(self, dicom_archive, dicomweb_server):
+        """Test that missing objects answer 404 and an unreachable server 502."""
+        client = ArchiveClient(DicomWebArchive(dicomweb_server.url), 0)
+        with pytest.raises(ArchiveError) as excinfo:
+            client.instance(dicom_archive["study"], dicom_archive["series"], "1.2.3")
+        assert excinfo.value.status_code == 404
+        unreachable = ArchiveClient(DicomWebArchive("http://127.0.0.1:9/dicom-web", timeout=1), 0)
+        with pytest.raises(ArchiveError) as excinfo:
+            unreachable.series(dicom_archive["study"], dicom_archive["series"])
+        assert excinfo.value.status_code == 502
+
+    def test_dicomweb_empty_instance_response(self):
+        """Test that a multipart response without any part answers 502 instead of failing."""
+        archive = DicomWebArchive("http://127.0.0.1:9/dicom-web")
+        archive.pool.get = lambda path, headers: (200, 'multipart/related; boundary="abc"', b"--abc--\r\n")
+        with pytest.raises(ArchiveError) as excinfo:
+            archive.fetch_instance("1.2", "1.2.3", "1.2.3.4")
+        assert excinfo.value.status_code == 502
+
+    def test_reconnects_after_server_closed_connection(self, dicom_archive, dicomweb_server):
+        """Test that a pooled connection the server has closed is replaced transparently."""
+        client = ArchiveClient(DicomWebArchive(dicomweb_server.url), 0)
+        study, series = dicom_archive["study"], dicom_archive["series"]
+        client.instance(study, series, dicom_archive["instances"][0])
+        # Simulate the idle connection having been dropped
+        idle = client.backend.pool._idle.get_nowait()
+        idle.sock.shutdown(2)
+        client.backend.pool._idle.put(idle)
+        assert client.instance(study, series, dicom_archive["instances"][1])
+        assert client.stats()["backend"]["connections_opened"] == 2
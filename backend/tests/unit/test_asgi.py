@@ -0,0 +1,191 @@
+import asyncio
+import sys
+import os
+import threading
+
+# Add the parent directory to the path so we can import modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from utils.asgi import AsgiAdapter
+
+
+def http_scope(method="POST", path="/echo", query=b"", headers=()):
+    return {"type": "http", "method": method, "path": path, "query_string": query, "root_path": "",
+            "http_version": "1.1", "scheme": "http", "server": ("testserver", 80),
+            "client": ("127.0.0.1", 5000), "headers": list(headers)}
+
+
+def call(adapter, scope, messages):
+    """Run one request through the adapter; returns the messages it sent."""
+    sent = []
+
+    async def run():
+        queue = list(messages)
+
+        async def receive():
+            if queue:
+                return queue.pop(0)
+            await asyncio.sleep(3600)
+
+        async def send(message):
+            sent.append(message)
+
+        await adapter(scope, receive, send)
+    asyncio.run(run())
+    return sent
+
+
+def echo_app(environ, start_response):
+    """Answers with the request body, and the request metadata in headers."""
+    body = environ["wsgi.input"].read(int(environ["CONTENT_LENGTH"]))
+    start_response("201 Created", [
+        ("X-Path", environ["PATH_INFO"]),
+        ("X-Query", environ["QUERY_STRING"]),
+        ("X-Content-Type", environ.get("CONTENT_TYPE", "")),
+        ("X-Custom", environ.get("HTTP_X_CUSTOM", "")),
+        ("X-Spooled", str(environ["wsgi.input"]._rolled)),
+        ("X-Thread", threading.current_thread().name),
+    ])
+    return [body]
+
+
+class TestAsgiAdapter:
+    def test_request_is_passed_to_the_wsgi_app(self):
+        """Test that method, path, query, headers and a body sent in several messages reach the app."""
+        scope = http_scope(query=b"a=1", headers=[(b"content-type", b"text/plain"),
+                                                   (b"x-custom", b"one"), (b"x-custom", b"two")])
+        messages = [{"type": "http.request", "body": b"hello ", "more_body": True},
+                    {"type": "http.request", "body": b"world", "more_body": False}]
+        start, *body = call(AsgiAdapter(echo_app), scope, messages)
+        headers = dict(start["headers"])
+        assert start["status"] == 201
+        assert (headers[b"x-path"], headers[b"x-query"], headers[b"x-content-type"]) == \
+            (b"/echo", b"a=1", b"text/plain")
+        assert headers[b"x-custom"] == b"one,two"
+        assert headers[b"x-thread"].startswith(b"asgi")
+        assert b"".join(m["body"] for m in body) == b"hello world"
+        assert body[-1] == {"type": "http.response.body", "body": b""}
+
+    def test_large_bodies_are_spooled_to_disk(self):
+        """Test that bodies beyond the spool size are received into a temporary file."""
+        adapter = AsgiAdapter(echo_app, spool_bytes=1024)
+        for size, spooled in ((1000, b"False"), (5000, b"True")):
+            messages = [{"type": "http.request", "body": b"x" * 500, "more_body": True}] * (size // 500)
+            messages.append({"type": "http.request", "body": b"", "more_body": False})
+            start, *body = call(adapter, http_scope(), messages)
+            assert dict(start["headers"])[b"x-spooled"] == spooled
+            assert len(b"".join(m["body"] for m in body)) == size
+
+    def test_streamed_responses_are_sent_chunk_by_chunk(self):
+        """Test that every chunk of a streamed response is sent as it is produced, and the response closed."""
+        closed = []
+
+        class Stream:
+            def __iter__(self):
+                yield b"first"
+                yield b""
+                yield b"second"
+
+            def close(self):
+                closed.append(True)
+
+        def app(environ, start_response):
+            start_response("200 OK", [("Content-Type", "text/plain")])
+            return Stream()
+
+        _, *body = call(AsgiAdapter(app), http_scope("GET"), [{"type": "http.request"}])
+        assert [m["body"] for m in body] == [b"first", b"second", b""]
+        assert [m.get("more_body", False) for m in body] == [True, True, False]
+        assert closed == [True]
+
+    def test_disconnect_before_the_body_skips_the_app(self):
+        """Test that a client leaving during the upload never occupies a worker thread."""
+        calls = []
+
+        def app(environ, start_response):
+            calls.append(environ)
+            start_response("200 OK", [])
+            return [b""]
+
+        messages = [{"type": "http.request", "body": b"partial", "more_body": True}, {"type": "http.disconnect"}]
+        assert call(AsgiAdapter(app), http_scope(), messages) == []
+        assert calls == []
+
+    def test_workers_are_bounded(self):
+        """Test that at most max_workers requests run the app at once; the others wait for a thread."""
+        running, peak, lock = [0], [0], threading.Lock()
+        release = threading.Event()
+
+        def app(environ, start_response):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            release.wait(5)
+            with lock:
+                running[0] -= 1
+            start_response("200 OK", [])
+            return [b"done"]
+
+        adapter = AsgiAdapter(app, max_workers=2)
+
+        async def run():
+            async def receive():
+                return {"type": "http.request"}
+
+            async def send(message):
+                pass
+
+            requests = [asyncio.ensure_future(adapter(http_scope("GET"), receive, send)) for _ in range(5)]
+            await asyncio.sleep(0.2)
+            assert running[0] == 2
+            release.set()
+            await asyncio.gather(*requests)
+        asyncio.run(run())
+        assert peak[0] == 2
+
+    def test_saturated_workers_shed_requests(self):
+        """Test that requests beyond the busy threads and the queue are answered 503 with Retry-After."""
+        release = threading.Event()
+
+        def app(environ, start_response):
+            release.wait(5)
+            start_response("200 OK", [])
+            return [b"done"]
+
+        adapter = AsgiAdapter(app, max_workers=1, max_queue=1)
+        statuses = []
+
+        async def run():
+            async def receive():
+                return {"type": "http.request"}
+
+            async def send(message):
+                if message["type"] == "http.response.start":
+                    statuses.append((message["status"], dict(message["headers"]).get(b"retry-after")))
+
+            requests = [asyncio.ensure_future(adapter(http_scope("GET"), receive, send)) for _ in range(2)]
+            await asyncio.sleep(0.1)
+            await adapter(http_scope("GET"), receive, send)
+            release.set()
+            await asyncio.gather(*requests)
+        asyncio.run(run())
+        assert statuses == [(503, b"1"), (200, None), (200, None)]
+
+    def test_oversized_bodies_are_rejected(self):
+        """Test that a body over max_body_bytes is answered 413, by its Content-Length or while it is received."""
+        adapter = AsgiAdapter(echo_app, spool_bytes=100, max_body_bytes=1000)
+        declared = http_scope(headers=[(b"content-length", b"5000")])
+        start, _ = call(adapter, declared, [])
+        assert start["status"] == 413
+        messages = [{"type": "http.request", "body": b"x" * 600, "more_body": True}] * 2
+        start, body = call(adapter, http_scope(), messages)
+        assert start["status"] == 413
+        assert b"too large" in body["body"]
+        start, *body = call(adapter, http_scope(), messages[:1] + [{"type": "http.request", "body": b"y" * 400}])
+        assert (start["status"], len(b"".join(m["body"] for m in body))) == (201, 1000)
+
+    def test_lifespan(self):
+        """Test that startup and shutdown are acknowledged."""
+        sent = call(AsgiAdapter(echo_app), {"type": "lifespan"},
+                    [{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}])
+        assert [m["type"] for m in sent] == ["lifespan.startup.complete", "lifespan.shutdown.complete"]
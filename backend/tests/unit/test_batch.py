@@ -0,0 +1,157 @@
+import csv
+import json
+import pytest
+import sys
+import os
+from types import SimpleNamespace
+import numpy as np
+import nibabel as nib
+import torch
+
+# Add the parent directory to the path so we can import modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from utils.batch import BatchRunner, Manifest, discover
+
+
+class FakeCamModel(torch.nn.Module):
+    """Pneumonia model stand-in: the logit is the mean of the input, the features are constant."""
+
+    def __init__(self):
+        super().__init__()
+        self.model = SimpleNamespace(fc=torch.nn.Linear(512, 1))
+
+    def forward(self, x):
+        return x.mean(dim=(1, 2, 3))[:, None], torch.ones(len(x), 512, 7, 7)
+
+
+def fake_models():
+    return {
+        "pneumonia": (FakeCamModel(), "p1"),
+        "cardiac": (lambda x: torch.tensor([[22.4, 44.8, 112.0, 224.0]]).repeat(len(x), 1), "c1"),
+        "atrium": (lambda x: x, "a1"),  # the standardized intensities as probabilities
+    }
+
+
+def read_parts(directory):
+    rows = []
+    for name in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, name), newline="") as f:
+            rows += list(csv.DictReader(f))
+    return rows
+
+
+@pytest.fixture
+def input_dir(tmp_path, make_dicom):
+    """Two X-rays (one with two frames), an unreadable file, a NIfTI volume and an unrelated file."""
+    root = tmp_path / "input"
+    (root / "study1").mkdir(parents=True)
+    (root / "study2").mkdir()
+    (root / "study1" / "a.dcm").write_bytes(make_dicom(rows=100, columns=200))
+    (root / "study1" / "b.dcm").write_bytes(make_dicom(rows=64, columns=64, NumberOfFrames=2,
+                                                       pixels=np.zeros((128, 64))))
+    (root / "study2" / "broken.dcm").write_bytes(b"not a DICOM file")
+    (root / "study2" / "notes.txt").write_text("ignored")
+    volume = np.zeros((32, 32, 6), dtype=np.float32)
+    volume[8:24, 8:24, 1:5] = 1
+    nib.save(nib.Nifti1Image(volume, np.diag([2.0, 2.0, 3.0, 1.0])), str(root / "study2" / "heart.nii.gz"))
+    return str(root)
+
+
+class TestDiscover:
+    def test_finds_dicom_and_nifti_files(self, input_dir):
+        """Test that DICOM and NIfTI files are found recursively, in sorted order."""
+        dicoms, niftis = discover(input_dir)
+        assert dicoms == ["study1/a.dcm", "study1/b.dcm", "study2/broken.dcm"]
+        assert niftis == ["study2/heart.nii.gz"]
+
+    def test_finds_dicom_files_without_extension(self, input_dir, make_dicom):
+        """Test that files with the DICOM preamble are found whatever their name."""
+        with open(os.path.join(input_dir, "study2", "IM0001"), "wb") as f:
+            f.write(make_dicom())
+        dicoms, _ = discover(input_dir)
+        assert dicoms == ["study1/a.dcm", "study1/b.dcm", "study2/IM0001", "study2/broken.dcm"]
+
+
+class TestBatchRunner:
+    def test_results_and_manifest(self, input_dir, tmp_path):
+        """Test the per-frame X-ray rows, the atrium row and mask volume, and the manifest."""
+        output = str(tmp_path / "output")
+        summary = BatchRunner(input_dir, output, fake_models(), workers=0, batch_size=2, format="csv").run()
+        assert (summary["done"], summary["failed"], summary["skipped"]) == (3, 1, 0)
+        assert summary["files_per_second"] > 0
+
+        rows = read_parts(os.path.join(output, "xray"))
+        assert [(row["path"], row["frame"]) for row in rows] == \
+            [("study1/a.dcm", "0"), ("study1/b.dcm", "0"), ("study1/b.dcm", "1")]
+        assert all(0 <= float(row["pneumonia_probability"]) <= 1 for row in rows)
+        # The box is scaled from 224x224 model coordinates to the 200x100 image
+        assert [float(rows[0][f"cardiac_{v}"]) for v in ("x1", "y1", "x2", "y2")] == \
+            pytest.approx([20.0, 20.0, 100.0, 100.0])
+        assert rows[0]["cardiac_model_version"] == "c1"
+
+        (atrium,) = read_parts(os.path.join(output, "atrium"))
+        assert atrium["mask"] == os.path.join("masks", "study2", "heart.nii.gz")
+        assert (atrium["slice_first"], atrium["slice_last"]) == ("1", "4")
+        mask = nib.load(os.path.join(output, atrium["mask"]))
+        assert mask.shape == (32, 32, 6)
+        assert np.array_equal(mask.affine, np.diag([2.0, 2.0, 3.0, 1.0]))
+        assert mask.get_fdata()[16, 16, 2] == 1 and mask.get_fdata()[2, 2, 2] == 0
+
+        manifest = Manifest(os.path.join(output, "manifest.jsonl"))
+        assert manifest.entries["study2/broken.dcm"]["status"] == "error"
+        assert all(manifest.entries[path]["status"] == "ok"
+                   for path in ("study1/a.dcm", "study1/b.dcm", "study2/heart.nii.gz"))
+
+    def test_resume_skips_finished_files(self, input_dir, tmp_path):
+        """Test that a second run only processes the files missing from the manifest."""
+        output = str(tmp_path / "output")
+        BatchRunner(input_dir, output, fake_models(), workers=0, format="csv").run()
+        manifest_path = os.path.join(output, "manifest.jsonl")
+        with open(manifest_path) as f:
+            entries = [json.loads(line) for line in f]
+        with open(manifest_path, "w") as f:
+            f.writelines(json.dumps(entry) + "\n" for entry in entries if entry["path"] != "study1/a.dcm")
+
+        summary = BatchRunner(input_dir, output, fake_models(), workers=0, format="csv").run()
+        assert (summary["done"], summary["failed"], summary["skipped"]) == (1, 0, 3)
+        assert sorted(os.listdir(os.path.join(output, "xray"))) == ["part-00000.csv", "part-00001.csv"]
+        with open(os.path.join(output, "xray", "part-00001.csv"), newline="") as f:
+            assert [row["path"] for row in csv.DictReader(f)] == ["study1/a.dcm"]
+
+    def test_resume_removes_unrecorded_parts(self, input_dir, tmp_path):
+        """Test that a part written by a run interrupted before recording its files is not duplicated."""
+        output = str(tmp_path / "output")
+        BatchRunner(input_dir, output, fake_models(), workers=0, part_size=1, format="csv").run()
+        manifest_path = os.path.join(output, "manifest.jsonl")
+        with open(manifest_path) as f:
+            entries = [json.loads(line) for line in f]
+        assert entries[0]["part"] == "xray/part-00000.csv"
+        # Interrupted after writing the part of b.dcm, before recording it
+        with open(manifest_path, "w") as f:
+            f.writelines(json.dumps(entry) + "\n" for entry in entries
+                         if entry.get("part") == "xray/part-00000.csv")
+
+        logged = []
+        summary = BatchRunner(input_dir, output, fake_models(), workers=0, part_size=1, format="csv",
+                              log=logged.append).run()
+        assert (summary["done"], summary["failed"], summary["skipped"]) == (2, 1, 1)
+        assert "Removed xray/part-00001.csv, written by an interrupted run" in logged
+        rows = read_parts(os.path.join(output, "xray"))
+        assert [(row["path"], row["frame"]) for row in rows] == \
+            [("study1/a.dcm", "0"), ("study1/b.dcm", "0"), ("study1/b.dcm", "1")]
+
+    def test_process_pool_matches_in_process(self, input_dir, tmp_path):
+        """Test that decoding in worker processes gives the same results as decoding in process."""
+        models = {"cardiac": fake_models()["cardiac"], "pneumonia": fake_models()["pneumonia"]}
+        BatchRunner(input_dir, str(tmp_path / "pool"), models, workers=2, format="csv").run()
+        BatchRunner(input_dir, str(tmp_path / "local"), models, workers=0, format="csv").run()
+        assert read_parts(str(tmp_path / "pool" / "xray")) == read_parts(str(tmp_path / "local" / "xray"))
+
+    def test_parquet_output(self, input_dir, tmp_path):
+        """Test that the result tables can be written as Parquet."""
+        parquet = pytest.importorskip("pyarrow.parquet")
+        output = str(tmp_path / "output")
+        BatchRunner(input_dir, output, fake_models(), workers=0).run()
+        table = parquet.read_table(os.path.join(output, "xray", "part-00000.parquet"))
+        assert table.column("path").to_pylist() == ["study1/a.dcm", "study1/b.dcm", "study1/b.dcm"]
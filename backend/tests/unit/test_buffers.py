@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+import sys
+import os
+
+# Add the parent directory to the path so we can import modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from utils.buffers import BufferPool, empty
+from utils.render import render_overlays
+from utils.segmentation import predict_stack
+
+
+class TestBufferPool:
+    def test_released_buffers_are_reused_by_shape_and_dtype(self):
+        """Test that a released buffer is handed out again for the same shape and dtype only."""
+        pool = BufferPool(1 << 20)
+        buffer = pool.acquire((16, 16), np.uint8)
+        pool.release(buffer)
+        assert pool.acquire((16, 16), np.float32) is not buffer
+        assert pool.acquire((16, 8), np.uint8) is not buffer
+        assert pool.acquire((16, 16), np.uint8) is buffer
+        stats = pool.stats()
+        assert (stats['allocations'], stats['reuses'], stats['in_use']) == (3, 1, 3)
+
+    def test_idle_bytes_are_bounded(self):
+        """Test that the least recently released shapes are dropped beyond the byte budget."""
+        pool = BufferPool(3000)
+        old, new, small = (pool.acquire((size,), np.uint8) for size in (1000, 2000, 500))
+        for buffer in (old, new, small):
+            pool.release(buffer)
+        stats = pool.stats()
+        assert (stats['idle_bytes'], stats['evictions']) == (2500, 1)
+        assert pool.acquire((2000,), np.uint8) is new
+        assert pool.acquire((1000,), np.uint8) is not old
+
+    def test_disabled_pool_keeps_nothing(self):
+        """Test that a pool without budget allocates every time."""
+        pool = BufferPool(0)
+        pool.release(pool.acquire((4, 4)))
+        assert pool.stats()['idle_buffers'] == 0
+
+
+class TestBufferScope:
+    def test_scope_returns_buffers_on_error(self):
+        """Test that the buffers of a scope go back to the pool even if the work fails."""
+        pool = BufferPool(1 << 20)
+        with pytest.raises(RuntimeError):
+            with pool.scope() as buffers:
+                empty(buffers, (8, 8))
+                raise RuntimeError("failed")
+        assert pool.stats()['in_use'] == 0
+        assert pool.stats()['idle_buffers'] == 1
+
+    def test_early_release_is_not_repeated(self):
+        """Test that a buffer released before the scope closes is returned only once."""
+        pool = BufferPool(1 << 20)
+        with pool.scope() as buffers:
+            buffer = buffers.empty((8, 8))
+            buffers.release(buffer)
+        assert pool.stats()['idle_buffers'] == 1
+        assert pool.stats()['in_use'] == 0
+
+    def test_pooled_rendering_matches(self):
+        """Test that overlays and UNet batches in pooled buffers equal the freshly allocated ones."""
+        rng = np.random.default_rng(0)
+        backgrounds = rng.integers(0, 255, (30, 20, 5), dtype=np.uint8)
+        masks = (rng.random((30, 20, 5)) > 0.7).astype(np.float32)
+        stack = rng.random((30, 20, 5)).astype(np.float32)
+        model = lambda x: x  # noqa: E731
+        pool = BufferPool(1 << 20)
+        for _ in range(2):
+            with pool.scope() as buffers:
+                assert np.array_equal(render_overlays(backgrounds, masks, buffers=buffers),
+                                      render_overlays(backgrounds, masks))
+                assert np.array_equal(predict_stack(model, stack, "cpu", batch_size=2, buffers=buffers), stack)
+        assert pool.stats()['reuses'] > 0
@@ -0,0 +1,163 @@
+import io
+import numpy as np
+import pytest
+import sys
+import os
+
+# Add the parent directory to the path so we can import modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from utils.decode import (decode_pixels, reduction_level, pixel_handler, register_pixel_handler,
+                          iter_frames, iter_series_frames, _pixel_handlers)
+
+JPEG_BASELINE = '1.2.840.10008.1.2.4.50'
+JPEG_2000 = '1.2.840.10008.1.2.4.91'
+
+
+@pytest.fixture
+def compressed_dicom(tmp_path):
+    """Factory writing a CR DICOM whose 8-bit gradient pixels are JPEG or JPEG 2000 encoded."""
+    import pydicom
+    from pydicom.encaps import encapsulate
+    from PIL import Image
+
+    def _make(transfer_syntax, size=1024, frames=1):
+        ramp = np.linspace(0, 255, size, dtype=np.float32)
+        pixels = ((ramp[:, None] + ramp[None, :]) / 2).astype(np.uint8)
+        encoded = []
+        for n in range(frames):
+            buffer = io.BytesIO()
+            # Every frame is shifted in brightness so frames can be told apart
+            Image.fromarray(np.clip(pixels.astype(int) - 20 * n, 0, 255).astype(np.uint8)).save(
+                buffer, 'JPEG2000' if transfer_syntax == JPEG_2000 else 'JPEG',
+                **({'irreversible': False} if transfer_syntax == JPEG_2000 else {'quality': 95}))
+            encoded.append(buffer.getvalue())
+
+        ds = pydicom.Dataset()
+        ds.file_meta = pydicom.dataset.FileMetaDataset()
+        ds.file_meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.1'
+        ds.file_meta.MediaStorageSOPInstanceUID = pydicom.uid.generate_uid()
+        ds.file_meta.TransferSyntaxUID = transfer_syntax
+        ds.is_little_endian, ds.is_implicit_VR = True, False
+        ds.Modality = 'CR'
+        ds.PhotometricInterpretation = 'MONOCHROME2'
+        ds.SamplesPerPixel = 1
+        ds.Rows = ds.Columns = size
+        ds.BitsAllocated = ds.BitsStored = 8
+        ds.HighBit = 7
+        ds.PixelRepresentation = 0
+        if frames > 1:
+            ds.NumberOfFrames = frames
+        ds.PixelData = encapsulate(encoded)
+        ds['PixelData'].is_undefined_length = True
+        path = str(tmp_path / f'{transfer_syntax}_{frames}.dcm')
+        ds.save_as(path, write_like_original=False)
+        return path, pixels
+
+    return _make
+
+
+class TestReductionLevel:
+    def test_levels(self):
+        """Test that the reduction keeps both sides at least min_size."""
+        assert reduction_level((3000, 3000), 224) == 3
+        assert reduction_level((1024, 1024), 224) == 2
+        assert reduction_level((1024, 1024), 1024) == 0
+        assert reduction_level((3000, 1000), 224) == 2
+
+    def test_max_level(self):
+        """Test that the reduction is capped at the codec's number of levels."""
+        assert reduction_level((8192, 8192), 16, max_level=5) == 5
+
+
+class TestDecodePixels:
+    @pytest.mark.parametrize("transfer_syntax,shape", [(JPEG_BASELINE, (256, 256)), (JPEG_2000, (256, 256))])
+    def test_reduced_decode(self, compressed_dicom, transfer_syntax, shape):
+        """Test that compressed images are decoded at the smallest sufficient resolution."""
+        path, pixels = compressed_dicom(transfer_syntax)
+        reduced = decode_pixels(path, min_size=224)
+        assert reduced.shape == shape
+        # Matches a full decode followed by a downscale
+        expected = pixels.reshape(256, 4, 256, 4).mean(axis=(1, 3))
+        assert np.abs(reduced.astype(np.float32) - expected).mean() < 2
+
+    def test_full_decode_when_display_size_needs_it(self, compressed_dicom):
+        """Test that no reduction is applied when the full resolution is needed."""
+        path, _ = compressed_dicom(JPEG_BASELINE)
+        assert decode_pixels(path, min_size=1024).shape == (1024, 1024)
+        assert decode_pixels(path).shape == (1024, 1024)
+
+    def test_uncompressed_decodes_in_full(self, make_dicom, tmp_path):
+        """Test that uncompressed pixel data falls back to the full decode."""
+        path = tmp_path / 'raw.dcm'
+        path.write_bytes(make_dicom(rows=512, columns=512))
+        assert decode_pixels(str(path), min_size=224).shape == (512, 512)
+
+    def test_handler_can_decline(self, compressed_dicom, monkeypatch):
+        """Test that a handler returning None falls back to the full decode."""
+        monkeypatch.setitem(_pixel_handlers, JPEG_BASELINE, lambda frame, ds, min_size: None)
+        path, _ = compressed_dicom(JPEG_BASELINE)
+        assert decode_pixels(path, min_size=224).shape == (1024, 1024)
+
+    def test_register_handler(self, compressed_dicom, monkeypatch):
+        """Test that custom handlers can be plugged in per transfer syntax."""
+        monkeypatch.setattr('utils.decode._pixel_handlers', dict(_pixel_handlers))
+        register_pixel_handler([JPEG_BASELINE], lambda frame, ds, min_size: np.ones((min_size, min_size)))
+        assert pixel_handler(JPEG_BASELINE) is not None
+        path, _ = compressed_dicom(JPEG_BASELINE)
+        assert decode_pixels(path, min_size=300).shape == (300, 300)
+
+
+class TestIterFrames:
+    def test_native_multiframe(self, make_dicom):
+        """Test that uncompressed frames are read one by one without decoding the whole object."""
+        import pydicom
+        pixels = np.random.randint(0, 4096, (3, 32, 48), dtype=np.uint16)
+        ds = pydicom.dcmread(io.BytesIO(make_dicom(rows=32, columns=48, pixels=pixels, NumberOfFrames=3)))
+        frames = list(iter_frames(ds))
+        assert len(frames) == 3
+        for frame, expected in zip(frames, pixels):
+            assert np.array_equal(frame, expected)
+        assert ds._pixel_array is None
+
+    @pytest.mark.parametrize("transfer_syntax", [JPEG_BASELINE, JPEG_2000])
+    def test_compressed_multiframe(self, compressed_dicom, transfer_syntax):
+        """Test that compressed frames are decoded one at a time at reduced resolution."""
+        import pydicom
+        path, _ = compressed_dicom(transfer_syntax, size=512, frames=3)
+        frames = list(iter_frames(pydicom.dcmread(path), min_size=224))
+        assert [frame.shape for frame in frames] == [(256, 256)] * 3
+        # Frames come out in order
+        means = [frame.mean() for frame in frames]
+        assert means[0] > means[1] > means[2]
+
+    def test_rle_multiframe(self, make_dicom):
+        """Test that frames without a reduced-resolution handler are still decoded one at a time."""
+        import pydicom
+        from pydicom.uid import RLELossless
+        pixels = np.random.randint(0, 4096, (3, 32, 48), dtype=np.uint16)
+        ds = pydicom.dcmread(io.BytesIO(make_dicom(rows=32, columns=48, pixels=pixels, NumberOfFrames=3)))
+        ds.compress(RLELossless)
+        ds._pixel_array = None
+        frames = list(iter_frames(ds, min_size=16))
+        for frame, expected in zip(frames, pixels):
+            assert np.array_equal(frame, expected)
+        assert len(frames) == 3
+        assert ds._pixel_array is None
+
+    def test_declined_frames_decoded_one_at_a_time(self, compressed_dicom, monkeypatch):
+        """Test that frames a handler declines are decoded singly at full resolution."""
+        import pydicom
+        monkeypatch.setitem(_pixel_handlers, JPEG_BASELINE, lambda frame, ds, min_size: None)
+        path, _ = compressed_dicom(JPEG_BASELINE, size=512, frames=2)
+        ds = pydicom.dcmread(path)
+        assert [frame.shape for frame in iter_frames(ds, min_size=224)] == [(512, 512)] * 2
+        assert ds._pixel_array is None
+
+    def test_series(self, compressed_dicom, make_dicom, tmp_path):
+        """Test that a series yields the frames of every file with their positions."""
+        raw = tmp_path / 'raw.dcm'
+        raw.write_bytes(make_dicom(rows=16, columns=16))
+        path, _ = compressed_dicom(JPEG_BASELINE, size=256, frames=2)
+        positions = [(f, n, pixels.shape) for f, n, pixels in iter_series_frames([path, str(raw)])]
+        assert positions == [(0, 0, (256, 256)), (0, 1, (256, 256)), (1, 0, (16, 16))]
@@ -0,0 +1,78 @@
+import io
+import pytest
+import sys
+import os
+
+# Add the parent directory to the path so we can import modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from utils.dicom_validation import (read_dicom_header, validate_dicom_header, validate_dicom_upload,
+                                    validate_frame_total, DicomValidationError, XRAY_RULES)
+
+
+class TestDicomValidation:
+    def test_valid_upload(self, make_dicom):
+        """Test that a valid chest X-ray header is admitted and the stream is rewound."""
+        stream = io.BytesIO(make_dicom())
+        ds = validate_dicom_upload(stream, "pneumonia")
+        assert ds.Modality == 'CR'
+        assert stream.tell() == 0
+        # Only the header was parsed
+        assert 'PixelData' not in ds
+
+    def test_not_dicom(self):
+        """Test that garbage input is rejected as a bad request."""
+        with pytest.raises(DicomValidationError) as excinfo:
+            read_dicom_header(io.BytesIO(b'DICM' + b'\0' * 1024))
+        assert excinfo.value.status_code == 400
+
+    @pytest.mark.parametrize("attrs,status_code", [
+        ({"Modality": "MR"}, 422),
+        ({"PhotometricInterpretation": "RGB"}, 422),
+        ({"BitsStored": 32}, 422),
+        ({"NumberOfFrames": 1000}, 413),
+        ({"Rows": 10000, "Columns": 10000}, 413),
+    ])
+    def test_rule_violations(self, make_dicom, attrs, status_code):
+        """Test that headers violating the X-ray rules are rejected with the right status."""
+        ds = read_dicom_header(io.BytesIO(make_dicom(rows=8, columns=8)))
+        for keyword, value in attrs.items():
+            setattr(ds, keyword, value)
+        with pytest.raises(DicomValidationError) as excinfo:
+            validate_dicom_header(ds, XRAY_RULES)
+        assert excinfo.value.status_code == status_code
+
+    def test_unsupported_transfer_syntax(self, make_dicom):
+        """Test that transfer syntaxes we cannot decode are rejected as unsupported media."""
+        ds = read_dicom_header(io.BytesIO(make_dicom()))
+        ds.file_meta.TransferSyntaxUID = '1.2.840.10008.1.2.4.100'  # MPEG2 video
+        with pytest.raises(DicomValidationError) as excinfo:
+            validate_dicom_header(ds, XRAY_RULES)
+        assert excinfo.value.status_code == 415
+
+    def test_multiframe_admitted(self, make_dicom):
+        """Test that multi-frame objects within the frame limit are admitted."""
+        ds = read_dicom_header(io.BytesIO(make_dicom(rows=8, columns=8)))
+        ds.NumberOfFrames = 12
+        assert validate_dicom_header(ds, XRAY_RULES) is ds
+
+    def test_multiframe_total_pixels(self, make_dicom):
+        """Test that a multi-frame object is rejected when all its frames together are too large."""
+        ds = read_dicom_header(io.BytesIO(make_dicom(rows=8, columns=8)))
+        ds.file_meta.TransferSyntaxUID = '1.2.840.10008.1.2.5'  # RLE Lossless
+        ds.Rows = ds.Columns = 6000  # 36 million pixels, within the per-frame limit
+        ds.NumberOfFrames = 1
+        assert validate_dicom_header(ds, XRAY_RULES) is ds
+        ds.NumberOfFrames = XRAY_RULES["max_frames"]
+        with pytest.raises(DicomValidationError) as excinfo:
+            validate_dicom_header(ds, XRAY_RULES)
+        assert excinfo.value.status_code == 413
+
+    def test_series_frame_total(self, make_dicom):
+        """Test that the frames of all files in a series count against one limit."""
+        headers = [read_dicom_header(io.BytesIO(make_dicom(rows=8, columns=8))) for _ in range(3)]
+        assert validate_frame_total(headers, "pneumonia") == 3
+        headers[0].NumberOfFrames = XRAY_RULES["max_frames"]
+        with pytest.raises(DicomValidationError) as excinfo:
+            validate_frame_total(headers, "pneumonia")
+        assert excinfo.value.status_code == 413
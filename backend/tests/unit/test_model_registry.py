@@ -0,0 +1,76 @@
+import threading
+import pytest
+import sys
+import os
+
+# Add the parent directory to the path so we can import modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from utils.model_registry import ModelRegistry, checkpoint_version
+
+
+class TestModelRegistry:
+    def test_lease_returns_current_version(self):
+        """Test that a lease yields the registered model and its version."""
+        models = {}
+        registry = ModelRegistry(models)
+        registry.register("cardiac", "model-v1", "v1")
+        with registry.lease("cardiac") as (model, version):
+            assert (model, version) == ("model-v1", "v1")
+            assert registry.status()["cardiac"]["in_flight"] == 1
+        assert registry.status()["cardiac"]["in_flight"] == 0
+        assert models == {"cardiac": "model-v1"}
+
+    def test_swap_while_in_flight(self):
+        """Test that in-flight requests keep the old version, which drains once they finish."""
+        registry = ModelRegistry({})
+        registry.register("cardiac", "model-v1", "v1")
+        with registry.lease("cardiac") as (old_model, old_version):
+            registry.register("cardiac", "model-v2", "v2")
+            assert registry.status()["cardiac"]["draining"] == {"v1": 1}
+            # New requests see the new version immediately
+            with registry.lease("cardiac") as (model, version):
+                assert (model, version) == ("model-v2", "v2")
+            assert (old_model, old_version) == ("model-v1", "v1")
+        assert registry.status()["cardiac"]["draining"] == {}
+        assert registry.version("cardiac") == "v2"
+
+    def test_background_reload(self):
+        """Test that a reload swaps the new model in once it has loaded."""
+        registry = ModelRegistry({})
+        registry.register("cardiac", "model-v1", "v1")
+        release = threading.Event()
+
+        def load():
+            release.wait(5)
+            return "model-v2"
+
+        assert registry.reload("cardiac", load, "v2")
+        # Only one reload per model at a time, and the old model serves until the swap
+        assert not registry.reload("cardiac", load, "v3")
+        assert registry.version("cardiac") == "v1"
+        release.set()
+        assert registry.wait_reload("cardiac", timeout=5) == "done"
+        assert registry.models["cardiac"] == "model-v2"
+
+    def test_failed_reload_keeps_old_model(self):
+        """Test that a checkpoint that fails to load leaves the serving model in place."""
+        registry = ModelRegistry({})
+        registry.register("cardiac", "model-v1", "v1")
+
+        def load():
+            raise RuntimeError("corrupt checkpoint")
+
+        registry.reload("cardiac", load, "v2")
+        assert registry.wait_reload("cardiac", timeout=5) == "failed"
+        assert registry.version("cardiac") == "v1"
+        assert "corrupt checkpoint" in registry.status()["cardiac"]["reload"]["error"]
+
+    def test_checkpoint_version(self, tmp_path):
+        """Test that checkpoint versions follow the file contents."""
+        first, second = tmp_path / "a.ckpt", tmp_path / "b.ckpt"
+        first.write_bytes(b"weights")
+        second.write_bytes(b"weights")
+        assert checkpoint_version(str(first)) == checkpoint_version(str(second))
+        second.write_bytes(b"new weights")
+        assert checkpoint_version(str(first)) != checkpoint_version(str(second))
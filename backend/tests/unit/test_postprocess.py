@@ -0,0 +1,57 @@
+import pytest
+import numpy as np
+import sys
+import os
+
+# Add the parent directory to the path so we can import modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from utils.postprocess import (assemble_mask_volume, keep_largest_component,
+                               mask_statistics, postprocess_masks)
+
+
+class TestPostprocessUtils:
+    def test_assemble_mask_volume(self):
+        """Test that masks are placed at their slice indices and other slices stay empty."""
+        masks = np.ones((4, 4, 2), dtype=bool)
+        mask_volume = assemble_mask_volume(masks, np.array([1, 3]), depth=5)
+        assert mask_volume.shape == (4, 4, 5)
+        assert list(mask_volume.any(axis=(0, 1))) == [False, True, False, True, False]
+
+    def test_keep_largest_component(self):
+        """Test that only the largest 3D component survives."""
+        mask_volume = np.zeros((20, 20, 10), dtype=bool)
+        mask_volume[2:10, 2:10, 2:8] = True   # large component
+        mask_volume[15:17, 15:17, 1:3] = True  # small speckle
+        filtered, removed = keep_largest_component(mask_volume)
+        assert removed == 1
+        assert filtered[5, 5, 5]
+        assert not filtered[16, 16, 2]
+
+    def test_keep_largest_component_empty(self):
+        """Test that an empty mask volume is returned unchanged."""
+        mask_volume = np.zeros((5, 5, 5), dtype=bool)
+        filtered, removed = keep_largest_component(mask_volume)
+        assert removed == 0
+        assert not filtered.any()
+
+    def test_mask_statistics_uses_spacing_and_native_size(self):
+        """Test that the volume accounts for the voxel spacing and the model-to-native scale."""
+        mask_volume = np.zeros((10, 10, 4), dtype=bool)
+        mask_volume[:5, :5, 1:3] = True  # 50 voxels at model resolution
+        stats = mask_statistics(mask_volume, (0.5, 0.5, 2.0), native_shape=(20, 20))
+        # Every model voxel covers 4 native voxels of 0.5 mm^3
+        assert stats["voxel_count"] == 200
+        assert stats["volume_ml"] == pytest.approx(0.1)
+        assert stats["slice_range"] == [1, 2]
+
+    def test_postprocess_masks(self):
+        """Test thresholding, filtering and statistics over a probability stack."""
+        probs = np.zeros((8, 8, 3), dtype=np.float32)
+        probs[1:5, 1:5, :] = 0.9
+        probs[7, 7, 0] = 0.9
+        masks, stats = postprocess_masks(probs, np.array([0, 1, 2]), 0.5, 3, (1.0, 1.0, 1.0), (8, 8))
+        assert masks.shape == (8, 8, 3)
+        assert not masks[7, 7, 0]
+        assert stats["voxel_count"] == 48
+        assert stats["components_removed"] == 1
@@ -0,0 +1,47 @@
+import json
+import numpy as np
+import sys
+import os
+
+# Add the parent directory to the path so we can import modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from utils.progressive import multipart_stream, json_part, png_part, center_out
+from utils.archive import parse_multipart_related
+
+
+class TestMultipartStream:
+    def test_one_chunk_per_part(self):
+        """Test that every part is yielded as its own chunk and the body parses as multipart."""
+        parts = [json_part("result", {"probability": 0.5}), png_part("preview", b"\x89PNG\r\n\r\n", "a.png")]
+        chunks = list(multipart_stream(iter(parts), "xyz"))
+        assert len(chunks) == 3
+        assert b'Content-Disposition: inline; name="preview"; filename="a.png"' in chunks[1]
+        payloads = parse_multipart_related(b"".join(chunks), 'multipart/mixed; boundary=xyz')
+        assert json.loads(payloads[0]) == {"probability": 0.5}
+        assert payloads[1] == b"\x89PNG\r\n\r\n"
+
+    def test_parts_are_produced_lazily(self):
+        """Test that a part is only produced when the previous one has been consumed."""
+        produced = []
+
+        def parts():
+            for n in range(3):
+                produced.append(n)
+                yield json_part("n", n)
+
+        stream = multipart_stream(parts(), "xyz")
+        next(stream)
+        assert produced == [0]
+
+
+class TestCenterOut:
+    def test_middle_of_range(self):
+        """Test that positions are ordered by distance from the middle of their range."""
+        positions = np.array([10, 11, 12, 13, 14, 15, 16])
+        assert positions[center_out(positions)].tolist() == [13, 12, 14, 11, 15, 10, 16]
+
+    def test_given_center(self):
+        """Test ordering around an explicit center, with ties in the original order."""
+        assert center_out([1, 2, 3, 4, 5, 6], center=4.5).tolist() == [3, 4, 2, 5, 1, 0]
+        assert center_out([]).tolist() == []
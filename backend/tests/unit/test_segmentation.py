@@ -0,0 +1,105 @@
+import pytest
+import numpy as np
+import torch
+import cv2
+import sys
+import os
+
+# Add the parent directory to the path so we can import modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from models.atrium_model import AtriumSegmentation
+from utils.segmentation import (foreground_slices, resize_stack, align_box,
+                                segment_volume, masks_to_native, predict_stack,
+                                predict_tiled, tile_size_for_budget)
+
+
+@pytest.fixture
+def blob_volume():
+    """A (64, 64, 20) volume with two empty slices and a bright blob in slices 5-14."""
+    volume = np.full((64, 64, 20), 0.2)
+    volume[:, :, :2] = 0
+    volume[20:36, 24:40, 5:15] = 1.0
+    return volume
+
+
+class TestSliceSelection:
+    def test_foreground_slices(self, blob_volume):
+        """Test that completely black slices are skipped."""
+        indices = foreground_slices(blob_volume)
+        assert list(indices) == list(range(2, 20))
+
+    def test_resize_stack_matches_per_slice_resize(self):
+        """Test that the bulk resize matches resizing each slice on its own."""
+        stack = np.random.rand(40, 50, 200)
+        resized = resize_stack(stack, (30, 20))
+        assert resized.shape == (20, 30, 200)
+        for i in (0, 127, 128, 199):
+            expected = cv2.resize(stack[:, :, i].astype(np.float32), (30, 20))
+            assert np.allclose(resized[:, :, i], expected, atol=1e-5)
+
+    def test_align_box(self):
+        """Test that crop boxes are grown to a multiple of 8 and clamped."""
+        assert align_box((-5, 9, 101, 230)) == (0, 8, 104, 224)
+
+
+class TestSegmentVolume:
+    def test_auto_roi_matches_full_inference(self, blob_volume):
+        """Test that the ROI path produces the same masks as the full path."""
+        model = torch.nn.Identity()
+        indices_off, probs_off = segment_volume(model, blob_volume, "cpu", roi="off")
+        indices_auto, probs_auto = segment_volume(model, blob_volume, "cpu", roi="auto")
+
+        assert list(indices_off) == list(indices_auto)
+        assert np.array_equal(probs_off > 0.5, probs_auto > 0.5)
+        # Most of the field of view should not have been run through the model
+        assert (probs_auto == 0).mean() > 0.5
+
+    def test_crop_box(self, blob_volume):
+        """Test that a configured crop box restricts inference to that region."""
+        model = torch.nn.Identity()
+        _, probs = segment_volume(model, blob_volume, "cpu", crop_box=(64, 64, 160, 160))
+        assert np.all(probs[:64] == 0)
+        assert np.all(probs[:, 160:] == 0)
+        assert probs[64:160, 64:160].max() == pytest.approx(1.0)
+
+    def test_masks_to_native(self, blob_volume):
+        """Test that masks are returned at the native slice size."""
+        model = torch.nn.Identity()
+        indices, probs = segment_volume(model, blob_volume, "cpu")
+        masks = masks_to_native(probs, 0.5, blob_volume.shape[:2])
+        assert masks.shape == (64, 64, len(indices))
+        assert masks[28, 32, 5].item() == 1
+        assert masks[5, 5, 5].item() == 0
+
+
+class TestInferenceModes:
+    def test_predict_stack_pads_to_unet_alignment(self):
+        """Test that slices which are not a multiple of 8 are padded and cropped back."""
+        model = AtriumSegmentation()
+        model.eval()
+        stack = np.random.rand(50, 43, 3).astype(np.float32)
+        probs = predict_stack(model, stack, "cpu")
+        assert probs.shape == (50, 43, 3)
+
+    def test_tiled_matches_native(self):
+        """Test that blending overlapping tiles reproduces a full-slice prediction."""
+        model = torch.nn.Identity()
+        stack = np.random.rand(100, 90, 3).astype(np.float32)
+        native = predict_stack(model, stack, "cpu")
+        tiled = predict_tiled(model, stack, "cpu", tile_size=64, overlap=16)
+        assert np.allclose(native, tiled, atol=1e-6)
+
+    def test_native_mode_keeps_slice_size(self, blob_volume):
+        """Test that native mode returns probabilities at the volume resolution."""
+        model = torch.nn.Identity()
+        indices, probs = segment_volume(model, blob_volume, "cpu", mode="native")
+        assert probs.shape == (64, 64, len(indices))
+        assert masks_to_native(probs, 0.5, (64, 64)).shape == (64, 64, len(indices))
+
+    def test_tile_size_for_budget(self):
+        """Test that the tile size grows with the memory budget and stays aligned."""
+        small = tile_size_for_budget(64, batch_size=8)
+        large = tile_size_for_budget(1024, batch_size=8)
+        assert small % 8 == 0 and large % 8 == 0
+        assert small < large
@@ -0,0 +1,95 @@
+import threading
+import time
+import pytest
+import sys
+import os
+
+# Add the parent directory to the path so we can import modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from utils.singleflight import SingleFlight
+
+
+def call_concurrently(flight, key, fn, callers):
+    """Call flight.do(key, fn) from several threads; returns the threads and the list their outcomes go to."""
+    outcomes = []
+
+    def run():
+        try:
+            outcomes.append(flight.do(key, fn))
+        except Exception as e:
+            outcomes.append(e)
+
+    threads = [threading.Thread(target=run, daemon=True) for _ in range(callers)]
+    for thread in threads:
+        thread.start()
+    return threads, outcomes
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+class TestSingleFlight:
+    def test_concurrent_calls_share_one_execution(self):
+        """Test that callers arriving while a call runs get its result without running fn again."""
+        flight = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        runs = []
+
+        def compute():
+            runs.append(1)
+            started.set()
+            release.wait(5)
+            return "result"
+
+        threads, outcomes = call_concurrently(flight, "key", compute, 1)
+        started.wait(5)
+        followers, follower_outcomes = call_concurrently(flight, "key", compute, 3)
+        wait_for(lambda: flight.stats()["followers"] == 3)
+        release.set()
+        for thread in threads + followers:
+            thread.join(5)
+        assert len(runs) == 1
+        assert outcomes == [("result", False)]
+        assert follower_outcomes == [("result", True)] * 3
+        assert flight.stats() == {"in_flight": 0, "leaders": 1, "followers": 3}
+
+    def test_errors_are_shared(self):
+        """Test that the callers waiting on a failing call receive its exception."""
+        flight = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+
+        def fail():
+            started.set()
+            release.wait(5)
+            raise ValueError("broken")
+
+        threads, outcomes = call_concurrently(flight, "key", fail, 1)
+        started.wait(5)
+        followers, follower_outcomes = call_concurrently(flight, "key", fail, 2)
+        wait_for(lambda: flight.stats()["followers"] == 2)
+        release.set()
+        for thread in threads + followers:
+            thread.join(5)
+        assert all(isinstance(e, ValueError) for e in outcomes + follower_outcomes)
+
+    def test_key_is_forgotten_after_call(self):
+        """Test that sequential calls are not deduplicated, so results are never stale."""
+        flight = SingleFlight()
+        values = iter([1, 2])
+        assert flight.do("key", lambda: next(values)) == (1, False)
+        assert flight.do("key", lambda: next(values)) == (2, False)
+        with pytest.raises(KeyError):
+            flight.do("key", lambda: {}["missing"])
+        assert flight.stats()["in_flight"] == 0
+
+    def test_different_keys_run_separately(self):
+        """Test that calls with different keys do not wait on each other."""
+        flight = SingleFlight()
+        assert flight.do("a", lambda: "a") == ("a", False)
+        assert flight.do("b", lambda: "b") == ("b", False)
+        assert flight.stats()["leaders"] == 2
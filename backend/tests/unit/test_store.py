@@ -0,0 +1,133 @@
+import numpy as np
+import sqlite3
+import sys
+import os
+import threading
+
+# Add the parent directory to the path so we can import modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from utils.store import PredictionStore, decode_masks
+
+HASH = "ab" * 32
+
+
+class TestPredictionStore:
+    def test_lookup_by_study_and_content(self, tmp_path):
+        """Test that recorded predictions are found by study UID and by content hash, newest first."""
+        store = PredictionStore(str(tmp_path), flush_interval=0.01)
+        store.record("predict_cam", "pneumonia", "v1", HASH, {"probability": 0.25}, ("1.2", "1.2.3", "1.2.3.4"))
+        store.record("predict_cam", "pneumonia", "v2", HASH, {"probability": 0.5}, ("1.2", "1.2.3", "1.2.3.4"))
+        store.record("predict_cardiac", "cardiac", "v1", "cd" * 32, {"bbox": [1, 2, 3, 4]}, ("9.9", None, None))
+        store.flush()
+        by_study = store.by_study("1.2")
+        assert [(p["model_version"], p["result"]) for p in by_study] == \
+            [("v2", {"probability": 0.5}), ("v1", {"probability": 0.25})]
+        assert by_study[0]["instance_uid"] == "1.2.3.4"
+        assert [p["endpoint"] for p in store.by_content("cd" * 32)] == ["predict_cardiac"]
+        assert store.by_study("unknown") == []
+        assert len(store.by_content(HASH, limit=1)) == 1
+        store.close()
+
+    def test_lookups_use_the_indexes(self, tmp_path):
+        """Test that lookups by study UID and content hash are index searches, not table scans."""
+        store = PredictionStore(str(tmp_path))
+        db = sqlite3.connect(store.path)
+        for column in ("study_uid", "content_hash"):
+            plan = db.execute(f"EXPLAIN QUERY PLAN SELECT * FROM predictions WHERE {column} = ? "
+                              f"ORDER BY created DESC", ("x",)).fetchall()
+            assert "USING INDEX" in plan[0][-1]
+        store.close()
+
+    def test_masks_are_stored_once_by_content(self, tmp_path):
+        """Test that masks round-trip through their blob and identical masks share it."""
+        store = PredictionStore(str(tmp_path), flush_interval=0.01)
+        masks = np.zeros((12, 10, 3), dtype=np.float32)
+        masks[2:6, 3:9, 1] = 1
+        for threshold in (0.4, 0.5):
+            store.record("segment_atrium", "atrium", "v1", HASH, {"threshold": threshold}, masks=masks)
+        store.flush()
+        first, second = store.by_content(HASH)
+        assert first["masks"] == second["masks"]
+        with open(store.blob_path(first["masks"]), "rb") as f:
+            assert np.array_equal(decode_masks(f.read()), masks > 0)
+        stats = store.stats()
+        assert (stats["blobs_written"], stats["blobs_shared"]) == (1, 1)
+        assert store.blob_path("../predictions.sqlite") is None
+        store.close()
+
+    def test_records_are_written_in_batches(self, tmp_path):
+        """Test that queued records are committed several per transaction."""
+        store = PredictionStore(str(tmp_path), batch_size=50, flush_interval=0.5)
+        for n in range(120):
+            store.record("predict_cam", "pneumonia", "v1", HASH, {"probability": n / 120})
+        store.flush()
+        stats = store.stats()
+        assert (stats["recorded"], stats["written"], stats["queued"]) == (120, 120, 0)
+        assert stats["batches"] <= 3
+        store.close()
+
+    def test_recording_never_blocks(self, tmp_path):
+        """Test that records beyond the queue size are dropped instead of waiting for the writer."""
+        store = PredictionStore(str(tmp_path), max_queue=2)
+        # Hold the database write lock so the writer cannot drain the queue
+        db = sqlite3.connect(store.path, isolation_level=None)
+        db.execute("BEGIN IMMEDIATE")
+        results = [store.record("predict_cam", "pneumonia", "v1", HASH, {"probability": 0.1}) for _ in range(8)]
+        assert results.count(False) >= 5
+        assert store.stats()["dropped"] == results.count(False)
+        db.execute("ROLLBACK")
+        store.flush()
+        assert len(store.by_content(HASH)) == results.count(True)
+        store.close()
+
+    def test_writer_survives_bad_records(self, tmp_path):
+        """Test that records that cannot be written are counted and the writer keeps going."""
+        store = PredictionStore(str(tmp_path), flush_interval=0.01)
+        store.record("predict_cam", "pneumonia", "v1", HASH, {"probability": object()})
+        store.record("predict_cam", "pneumonia", "v1", HASH, {"probability": 0.5})
+        store.flush()
+        assert [p["result"] for p in store.by_content(HASH)] == [{"probability": 0.5}]
+        # Fails the whole batch in SQLite, with an error that is not an sqlite3.Error
+        store.record("predict_cam", "pneumonia", "v1", HASH, {"probability": 0.1}, (2 ** 70, None, None))
+        store.flush()
+        store.record("predict_cam", "pneumonia", "v1", HASH, {"probability": 0.75})
+        store.flush()
+        assert len(store.by_content(HASH)) == 2
+        stats = store.stats()
+        assert (stats["errors"], stats["written"]) == (2, 2)
+        assert stats["error"].startswith("OverflowError")
+        store.close()
+
+    def test_records_persist_across_instances(self, tmp_path):
+        """Test that records written by one store are found by the next one on the same directory."""
+        store = PredictionStore(str(tmp_path))
+        store.record("predict_cam", "pneumonia", "v1", HASH, {"probability": 0.75}, ("1.2", None, None))
+        store.close()
+        reopened = PredictionStore(str(tmp_path))
+        assert [p["result"] for p in reopened.by_study("1.2")] == [{"probability": 0.75}]
+        reopened.close()
+
+    def test_concurrent_readers(self, tmp_path):
+        """Test that lookups from several threads work while records are written."""
+        store = PredictionStore(str(tmp_path), flush_interval=0.01)
+        errors = []
+
+        def read():
+            try:
+                for _ in range(20):
+                    store.by_content(HASH)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=read) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for n in range(50):
+            store.record("predict_cam", "pneumonia", "v1", HASH, {"probability": n / 50})
+        for thread in threads:
+            thread.join()
+        store.flush()
+        assert errors == []
+        assert len(store.by_content(HASH)) == 50
+        store.close()
@@ -0,0 +1,91 @@
+import pytest
+import numpy as np
+import cv2
+import sys
+import os
+
+# Add the parent directory to the path so we can import modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from utils.tiles import TileSource, TileStore
+from utils.render import render_overlays
+
+
+def stitch(source, image, level):
+    """Assemble all tiles of a level into one image."""
+    columns, rows = source.grid_size(level)
+    return np.vstack([np.hstack([source.render_tile(image, level, col, row) for col in range(columns)])
+                      for row in range(rows)])
+
+
+class TestTileSource:
+    def test_levels(self):
+        """Test the Deep Zoom level sizes and tile grid."""
+        source = TileSource([np.zeros((2000, 3000), np.uint8)], tile_size=256)
+        assert source.max_level == 12
+        assert source.level_size(12) == (3000, 2000)
+        assert source.level_size(11) == (1500, 1000)
+        assert source.level_size(0) == (1, 1)
+        assert source.grid_size(12) == (12, 8)
+        assert source.render_tile(0, 12, 11, 7).shape == (2000 - 7 * 256, 3000 - 11 * 256, 3)
+
+    def test_outside_pyramid(self):
+        """Test that tiles outside the pyramid are rejected."""
+        source = TileSource([np.zeros((300, 300), np.uint8)], tile_size=256)
+        for coordinates in [(1, 9, 0, 0), (0, 10, 0, 0), (0, 9, 2, 0), (0, 9, 0, -1), (0, -1, 0, 0)]:
+            with pytest.raises(KeyError):
+                source.render_tile(*coordinates)
+
+    def test_cam_tiles_match_full_render(self):
+        """Test that CAM tiles stitched together match blending the CAM resized to the whole level."""
+        background = np.random.randint(0, 256, (600, 500), dtype=np.uint8)
+        cam = np.random.rand(7, 7).astype(np.float32)
+        source = TileSource([background], cam=cam, tile_size=128)
+        for level in (source.max_level, source.max_level - 2):
+            width, height = source.level_size(level)
+            level_background = background if level == source.max_level else \
+                cv2.resize(cv2.resize(background, source.level_size(level + 1), interpolation=cv2.INTER_AREA),
+                           (width, height), interpolation=cv2.INTER_AREA)
+            heatmap = cv2.applyColorMap((cv2.resize(cam, (width, height)) * 255).astype(np.uint8), cv2.COLORMAP_JET)
+            expected = cv2.addWeighted(cv2.cvtColor(level_background, cv2.COLOR_GRAY2BGR), 0.5, heatmap, 0.5, 0)
+            tiled = stitch(source, 0, level)
+            assert tiled.shape == expected.shape
+            assert np.abs(tiled.astype(int) - expected).max() <= 2
+
+    def test_mask_tiles_match_zip_overlays(self):
+        """Test that full-resolution mask tiles equal the overlays rendered for the ZIP download."""
+        backgrounds = np.random.randint(0, 256, (40, 30, 2), dtype=np.uint8)
+        masks = (np.random.rand(40, 30, 2) > 0.7).astype(np.float32)
+        display = [np.ascontiguousarray(stack[::-1, ::-1, n].T) for stack in (backgrounds, masks) for n in range(2)]
+        source = TileSource(display[:2], masks=[(m * 255).astype(np.uint8) for m in display[2:]], tile_size=16)
+        expected = render_overlays(backgrounds, masks)
+        for n in range(2):
+            np.testing.assert_array_equal(stitch(source, n, source.max_level), expected[n])
+
+    def test_bbox_scaled_per_level(self):
+        """Test that the bounding box is drawn in the level's coordinates."""
+        source = TileSource([np.zeros((512, 512), np.uint8)], bbox=[100, 100, 300, 300], tile_size=512)
+        full = source.render_tile(0, source.max_level, 0, 0)
+        half = source.render_tile(0, source.max_level - 1, 0, 0)
+        assert tuple(full[100, 200]) == (0, 255, 0)
+        assert tuple(half[50, 100]) == (0, 255, 0)
+        assert tuple(half[100, 100]) == (0, 0, 0)
+
+
+class TestTileStore:
+    def test_tiles_are_cached(self):
+        """Test that a tile is rendered once and then served from the tile cache."""
+        store = TileStore(1 << 20, 1 << 20)
+        descriptor = store.add(TileSource([np.zeros((300, 200), np.uint8)], tile_size=256))
+        assert descriptor["url"] == f"/tiles/{descriptor['id']}"
+        assert store.descriptor(descriptor["id"]) == descriptor
+        png = store.tile_png(descriptor["id"], 0, descriptor["max_level"], 0, 1)
+        assert cv2.imdecode(np.frombuffer(png, np.uint8), cv2.IMREAD_COLOR).shape == (300 - 256, 200, 3)
+        assert store.tile_png(descriptor["id"], 0, descriptor["max_level"], 0, 1) == png
+        assert store.stats()["tiles"]["hits"] == 1
+
+    def test_unknown_source(self):
+        """Test that tiles of unknown sources are not found."""
+        store = TileStore(1 << 20, 1 << 20)
+        assert store.descriptor("missing") is None
+        assert store.tile_png("missing", 0, 0, 0, 0) is None
@@ -1,6 +1,7 @@
 import pytest
 import numpy as np
 import torch
+import cv2
 from unittest.mock import MagicMock
 import sys
 import os
@@ -9,7 +10,11 @@ import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
 
 from utils.preprocess import normalize_volume, standardize_volume
-from utils.cam import compute_cam
+from utils.cam import compute_cam, compute_cams
+from utils.cache import LRUCache
+from utils.render import window_slices, render_overlays
+from utils.pipeline import Pipeline, batched, metrics_snapshot
+from utils.warmup import WarmUp, warm_up_model, warm_up_codecs
 
 class TestPreprocessUtils:
     def test_normalize_volume(self):
@@ -99,4 +104,160 @@ class TestCAMUtils:
         assert torch.max(cam) <= 1
         
         # Check prediction is passed through
-        assert pred.item() == torch.sigmoid(mock_pred).item()
\ No newline at end of file
+        assert pred.item() == torch.sigmoid(mock_pred).item()
+
+    def test_compute_cams_matches_compute_cam(self):
+        """Test that batched CAMs equal the CAMs computed one image at a time."""
+        from models.pneumonia_model_cam import PneumoniaModelCAM
+        torch.manual_seed(0)
+        model = PneumoniaModelCAM()
+        batch = torch.randn((3, 1, 224, 224))
+        cams, preds = compute_cams(model, batch)
+        assert cams.shape == (3, 7, 7)
+        assert preds.shape == (3, 1)
+        for n in range(3):
+            cam, pred = compute_cam(model, batch[n])
+            assert torch.allclose(cams[n], cam, atol=1e-5)
+            assert torch.allclose(preds[n], pred[0], atol=1e-5)
+
+
+class TestCacheUtils:
+    def test_lru_cache_evicts_by_bytes(self):
+        """Test that the least recently used entries are evicted once the byte budget is exceeded."""
+        cache = LRUCache(max_bytes=3000)
+        cache.put("a", np.zeros(1000, dtype=np.uint8))
+        cache.put("b", np.zeros(1000, dtype=np.uint8))
+        assert cache.get("a") is not None  # "a" is now the most recently used
+        cache.put("c", np.zeros(1500, dtype=np.uint8))
+
+        assert "a" in cache
+        assert "b" not in cache
+        assert "c" in cache
+        assert cache.stats()["bytes"] == 2500
+        assert cache.stats()["evictions"] == 1
+
+    def test_lru_cache_rejects_oversized_values(self):
+        """Test that values larger than the whole budget are not stored."""
+        cache = LRUCache(max_bytes=100)
+        assert not cache.put("big", {"probs": np.zeros(200, dtype=np.uint8)})
+        assert len(cache) == 0
+
+    def test_lru_cache_reports_evictions(self):
+        """Test that on_evict receives every evicted entry."""
+        evicted = []
+        cache = LRUCache(max_bytes=2000, on_evict=lambda key, value: evicted.append((key, value.nbytes)))
+        for key in "abc":
+            cache.put(key, np.zeros(1000, dtype=np.uint8))
+        assert evicted == [("a", 1000)]
+
+
+class TestRenderUtils:
+    def test_window_slices(self):
+        """Test that every slice is scaled to 0-255 by its own min/max."""
+        volume = np.random.rand(16, 16, 4) * 100
+        volume[:, :, 2] = 7  # constant slice
+        windowed = window_slices(volume, [0, 2, 3])
+
+        assert windowed.dtype == np.uint8
+        assert windowed.shape == (16, 16, 3)
+        expected = ((volume[:, :, 3] - volume[:, :, 3].min()) / np.ptp(volume[:, :, 3]) * 255).astype(np.uint8)
+        assert np.array_equal(windowed[:, :, 2], expected)
+        assert np.all(windowed[:, :, 1] == 0)
+
+    def test_render_overlays_matches_per_slice_opencv(self):
+        """Test that the vectorized renderer matches blending, rotating and flipping each slice with OpenCV."""
+        backgrounds = np.random.randint(0, 256, (30, 20, 3), dtype=np.uint8)
+        masks = np.clip(np.random.rand(30, 20, 3) * 2 - 0.7, 0, 1).astype(np.float32)
+        overlays = render_overlays(backgrounds, masks)
+        assert overlays.shape == (3, 20, 30, 3)
+        # Volumes loaded by nibabel are Fortran-ordered
+        assert np.array_equal(render_overlays(np.asfortranarray(backgrounds), masks), overlays)
+
+        for n in range(3):
+            vis_rgb = cv2.cvtColor(backgrounds[:, :, n], cv2.COLOR_GRAY2BGR)
+            red_mask = np.zeros_like(vis_rgb)
+            red_mask[:, :, 2] = (masks[:, :, n] * 255).astype(np.uint8)
+            expected = vis_rgb.copy()
+            positive = masks[:, :, n] > 0
+            expected[positive] = cv2.addWeighted(vis_rgb[positive], 0.5, red_mask[positive], 0.5, 0)
+            expected = cv2.flip(cv2.rotate(expected, cv2.ROTATE_90_COUNTERCLOCKWISE), 1)
+            assert np.array_equal(overlays[n], expected)
+
+
+class TestPipelineUtils:
+    def test_pipeline_preserves_order(self):
+        """Test that items pass through all stages in order."""
+        pipeline = Pipeline("test_order", [("double", lambda x: x * 2), ("increment", lambda x: x + 1)])
+        assert pipeline.run(range(10)) == [x * 2 + 1 for x in range(10)]
+
+        assert pipeline.stats["double"]["items"] == 10
+        assert pipeline.stats["increment"]["items"] == 10
+        assert 0 <= pipeline.stats["double"]["utilization"] <= 1
+        assert metrics_snapshot()["test_order"]["runs"] >= 1
+
+    def test_batched(self):
+        """Test that items are grouped lazily into batches with a shorter last batch."""
+        assert list(batched(iter(range(7)), 3)) == [[0, 1, 2], [3, 4, 5], [6]]
+        assert list(batched([], 3)) == []
+
+    def test_pipeline_propagates_errors(self):
+        """Test that an exception in a stage is raised once the pipeline has drained."""
+        def fail_on_three(x):
+            if x == 3:
+                raise ValueError("bad item")
+            return x
+
+        pipeline = Pipeline("test_errors", [("check", fail_on_three), ("identity", lambda x: x)], queue_size=1)
+        with pytest.raises(ValueError, match="bad item"):
+            pipeline.run(range(20))
+
+    def test_pipeline_stops_after_an_error(self):
+        """Test that after a downstream failure the input is no longer pulled and upstream stages stop working."""
+        pulled, prepared = [], []
+
+        def source():
+            for x in range(100):
+                pulled.append(x)
+                yield x
+
+        def fail(x):
+            raise ValueError("bad item")
+
+        pipeline = Pipeline("test_stop", [("prepare", prepared.append), ("fail", fail)], queue_size=1)
+        with pytest.raises(ValueError, match="bad item"):
+            pipeline.run(source())
+        assert len(pulled) < 10
+        assert len(prepared) < 10
+
+
+class TestWarmUp:
+    def test_ready_after_tasks(self):
+        """Test that readiness turns healthy once every warm-up task has run."""
+        calls = []
+        warmup = WarmUp([("first", lambda: calls.append(1)), ("second", lambda: calls.append(2))]).start()
+        assert warmup.wait(timeout=5)
+        assert calls == [1, 2]
+        status = warmup.status()
+        assert status["ready"] and not status["warming_up"]
+        assert set(status["seconds"]) == {"first", "second"}
+
+    def test_failed_task_is_not_ready(self):
+        """Test that a failing warm-up task keeps the service unready and reports the error."""
+        def fail():
+            raise RuntimeError("no weights")
+
+        warmup = WarmUp([("broken", fail)]).start()
+        assert not warmup.wait(timeout=5)
+        assert "no weights" in warmup.status()["error"]
+
+    def test_no_tasks(self):
+        """Test that a disabled warm-up is ready immediately."""
+        assert WarmUp([]).start().wait(timeout=5)
+
+    def test_warm_up_model_and_codecs(self):
+        """Test that the model and codec warm-ups run with dummy inputs."""
+        model = MagicMock(return_value=torch.zeros((2, 4)))
+        warm_up_model("cardiac", model, torch.device("cpu"), [1, 2])
+        assert [call.args[0].shape[0] for call in model.call_args_list] == [1, 2]
+        warm_up_codecs(display_size=64)
+
@@ -0,0 +1,115 @@
+import numpy as np
+import os
+import sys
+
+# Add the parent directory to the path so we can import modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from utils.cache import nbytes
+from utils.preprocess import normalize_volume, standardize_volume
+from utils.render import window_slices
+from utils.segmentation import model_input
+from utils.volume_cache import VolumeCache, prepare_volume, model_stack
+
+
+def prepared_volume(seed=0, dtype=np.float32, shape=(48, 40, 8)):
+    volume = np.random.default_rng(seed).random(shape) * 1000
+    volume[:, :, 0] = volume.min()  # An empty slice
+    return volume, prepare_volume(volume, standardize_volume(normalize_volume(volume)), (1, 1, 2.5), dtype)
+
+
+class TestPrepareVolume:
+    def test_matches_uncached_preprocessing(self):
+        """Test that the prepared model inputs and display slices equal those computed per request."""
+        volume, prepared = prepared_volume()
+        volume_std = standardize_volume(normalize_volume(volume))
+        for mode in ("resize", "native"):
+            indices, stack = model_input(volume_std, mode)
+            assert np.array_equal(prepared["indices"], indices)
+            assert np.array_equal(model_stack(prepared, mode), stack)
+        assert prepared["indices"].tolist() == list(range(1, 8))
+        assert np.array_equal(prepared["backgrounds"], window_slices(volume, indices))
+        assert (prepared["depth"], prepared["voxel_spacing"]) == (8, (1.0, 1.0, 2.5))
+
+    def test_half_precision(self):
+        """Test that float16 volumes take half the memory and are handed to the model as float32."""
+        _, single = prepared_volume()
+        _, half = prepared_volume(dtype=np.float16)
+        assert half["foreground"].nbytes * 2 == single["foreground"].nbytes
+        stack = model_stack(half, "resize")
+        assert stack.dtype == np.float32
+        assert np.allclose(stack, model_stack(single, "resize"), atol=1e-3)
+
+
+class TestVolumeCache:
+    def test_memory_hits(self):
+        """Test that volumes are served from memory until evicted, and dropped without a directory."""
+        _, prepared = prepared_volume()
+        cache = VolumeCache(int(nbytes(prepared) * 1.5))
+        cache.put("a", prepared)
+        assert cache.get("a") is prepared
+        cache.put("b", prepared_volume(1)[1])
+        assert cache.get("a") is None
+        stats = cache.stats()
+        assert (stats["memory"]["hits"], stats["memory"]["evictions"], stats["disk"]["spills"]) == (1, 1, 0)
+
+    def test_evicted_volumes_are_memory_mapped_from_disk(self, tmp_path):
+        """Test that volumes evicted from memory are spilled and read back memory-mapped."""
+        _, a = prepared_volume(0)
+        cache = VolumeCache(int(nbytes(a) * 1.5), str(tmp_path), 1 << 30)
+        cache.put("a", a)
+        cache.put("b", prepared_volume(1)[1])
+        cache.flush()
+        spilled = cache.get("a")
+        assert isinstance(spilled["foreground"], np.memmap)
+        for name in ("indices", "foreground", "resized", "backgrounds"):
+            assert np.array_equal(spilled[name], a[name])
+        assert (spilled["depth"], spilled["voxel_spacing"]) == (a["depth"], a["voxel_spacing"])
+        stats = cache.stats()["disk"]
+        assert (stats["entries"], stats["spills"], stats["hits"]) == (1, 1, 1)
+
+    def test_disk_is_bounded_by_bytes(self, tmp_path):
+        """Test that the least recently used spilled volumes are deleted beyond the disk budget."""
+        volumes = [prepared_volume(seed)[1] for seed in range(4)]
+        size = nbytes(volumes[0])
+        cache = VolumeCache(0, str(tmp_path), int(size * 2.5))
+        cache.put("a", volumes[0])
+        cache.put("b", volumes[1])
+        cache.flush()
+        assert cache.get("a") is not None  # "a" is now the most recently used
+        cache.put("c", volumes[2])
+        cache.flush()
+        assert cache.get("b") is None
+        assert cache.get("a") is not None and cache.get("c") is not None
+        assert sorted(os.listdir(tmp_path)) == ["a", "c"]
+        assert cache.stats()["disk"]["evictions"] == 1
+
+    def test_spilled_volumes_survive_restarts(self, tmp_path):
+        """Test that a new cache on the same directory finds the spilled volumes and drops unfinished ones."""
+        _, prepared = prepared_volume()
+        first = VolumeCache(0, str(tmp_path), 1 << 30)
+        first.put("a", prepared)
+        first.flush()
+        os.makedirs(tmp_path / ".spill-unfinished")
+        cache = VolumeCache(0, str(tmp_path), 1 << 30)
+        assert np.array_equal(cache.get("a")["resized"], prepared["resized"])
+        assert os.listdir(tmp_path) == ["a"]
+
+    def test_spills_do_not_block_puts(self, tmp_path, monkeypatch):
+        """Test that evicted volumes are written in the background and served from memory until then."""
+        import threading
+        _, a = prepared_volume(0)
+        cache = VolumeCache(int(nbytes(a) * 1.5), str(tmp_path), 1 << 30, max_pending=1)
+        release = threading.Event()
+        write = cache._write
+        monkeypatch.setattr(cache, "_write", lambda key, prepared: release.wait(5) and write(key, prepared))
+        cache.put("a", a)
+        cache.put("b", prepared_volume(1)[1])  # Evicts "a" without waiting for its spill
+        cache.put("c", prepared_volume(2)[1])  # "b" is dropped, "a" is still waiting
+        assert cache.get("a") is a
+        stats = cache.stats()["disk"]
+        assert (stats["pending"], stats["spills_dropped"], stats["spills"]) == (1, 1, 0)
+        release.set()
+        cache.flush()
+        assert isinstance(cache.get("a")["foreground"], np.memmap)
+        assert cache.get("b") is None
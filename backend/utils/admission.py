@@ -0,0 +1,110 @@
+import itertools
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Overloaded(Exception):
+    """A request that was shed by admission control, with the HTTP status and Retry-After seconds."""
+
+    def __init__(self, message, status_code, retry_after):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Admits requests to endpoint classes under a global and a per-class concurrency cap.
+
+    classes maps a class name to a dict with its concurrency cap ("max_concurrent"),
+    wait queue size ("queue_size"), the longest a request may wait ("queue_timeout",
+    seconds) and its "priority" (lower goes first). When a slot frees up, the waiting
+    request of the best priority whose class is below its cap is admitted next, first
+    come first served within a priority. Requests are shed with 429 when their class's
+    queue is full and with 503 when their wait deadline passes, both with a Retry-After
+    estimated from the class's recent service times.
+    """
+
+    def __init__(self, max_concurrent, classes):
+        self.max_concurrent = max_concurrent
+        self.classes = classes
+        self._running = {name: 0 for name in classes}
+        self._waiting = []  # (priority, sequence, class name) of queued requests
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._stats = {name: {"admitted": 0, "shed_queue_full": 0, "shed_timeout": 0, "max_queued": 0,
+                              "wait_seconds": 0.0, "service_seconds": None} for name in classes}
+
+    def _queued(self, name):
+        return sum(1 for _, _, waiting in self._waiting if waiting == name)
+
+    def _can_run(self, ticket):
+        """Whether a queued request is the first one, in priority order, that fits under the caps."""
+        if sum(self._running.values()) >= self.max_concurrent:
+            return False
+        for waiting in sorted(self._waiting):
+            if self._running[waiting[2]] < self.classes[waiting[2]]["max_concurrent"]:
+                return waiting == ticket
+        return False
+
+    def retry_after(self, name):
+        """Seconds a shed client should wait: the queue ahead of it drained at the recent service rate."""
+        service = self._stats[name]["service_seconds"] or 1.0
+        rounds = (self._queued(name) + 1) / self.classes[name]["max_concurrent"]
+        return max(1, math.ceil(service * rounds))
+
+    @contextmanager
+    def admit(self, name):
+        """Hold a slot of an endpoint class while the block runs, waiting in its queue if needed."""
+        spec, stats = self.classes[name], self._stats[name]
+        with self._condition:
+            if self._queued(name) >= spec["queue_size"]:
+                stats["shed_queue_full"] += 1
+                raise Overloaded("Server busy, too many queued requests.", 429, self.retry_after(name))
+            ticket = (spec["priority"], next(self._sequence), name)
+            self._waiting.append(ticket)
+            stats["max_queued"] = max(stats["max_queued"], self._queued(name))
+            queued_at = time.monotonic()
+            deadline = queued_at + spec["queue_timeout"]
+            while not self._can_run(ticket):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._waiting.remove(ticket)
+                    stats["shed_timeout"] += 1
+                    # Someone behind this request may fit now
+                    self._condition.notify_all()
+                    raise Overloaded("Server busy, request timed out in the queue.", 503, self.retry_after(name))
+                self._condition.wait(remaining)
+            self._waiting.remove(ticket)
+            self._running[name] += 1
+            stats["admitted"] += 1
+            stats["wait_seconds"] += time.monotonic() - queued_at
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._running[name] -= 1
+                # Exponential moving average of the time a request holds its slot
+                elapsed = time.monotonic() - started
+                previous = stats["service_seconds"]
+                stats["service_seconds"] = elapsed if previous is None else 0.8 * previous + 0.2 * elapsed
+                self._condition.notify_all()
+
+    def stats(self):
+        with self._condition:
+            return {name: {
+                "running": self._running[name],
+                "queued": self._queued(name),
+                "max_concurrent": self.classes[name]["max_concurrent"],
+                "queue_size": self.classes[name]["queue_size"],
+                "max_queued": s["max_queued"],
+                "admitted": s["admitted"],
+                "shed_queue_full": s["shed_queue_full"],
+                "shed_timeout": s["shed_timeout"],
+                "mean_wait_seconds": round(s["wait_seconds"] / s["admitted"], 4) if s["admitted"] else 0.0,
+                "mean_service_seconds": round(s["service_seconds"] or 0.0, 4),
+            } for name, s in self._stats.items()}
@@ -0,0 +1,264 @@
+import http.client
+import os
+import queue
+import re
+import threading
+import urllib.parse
+import pydicom
+from utils.cache import LRUCache
+from utils.singleflight import SingleFlight
+
+# DICOM UIDs: dot-separated numeric components, at most 64 characters
+UID_PATTERN = re.compile(r"^[0-9]+(\.[0-9]+)*$")
+
+DICOM_MULTIPART = 'multipart/related; type="application/dicom"'
+
+# Number of series remembered as too large to prefetch
+OVERSIZED_SERIES = 4096
+
+
+class ArchiveError(Exception):
+    """A referenced object that could not be fetched from the archive, with the HTTP status to answer with."""
+
+    def __init__(self, message, status_code=502):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def check_uid(uid):
+    """Reject references that are not DICOM UIDs (they end up in archive URLs and paths)."""
+    if not uid or len(uid) > 64 or not UID_PATTERN.match(uid):
+        raise ArchiveError(f"Invalid UID: {uid!r}.", 400)
+    return uid
+
+
+def instance_order(data):
+    """Sort key of an instance within its series: (InstanceNumber, SOPInstanceUID) from its header."""
+    ds = pydicom.dcmread(pydicom.filebase.DicomBytesIO(data), stop_before_pixels=True,
+                         specific_tags=["InstanceNumber", "SOPInstanceUID"])
+    number = ds.get("InstanceNumber")
+    uid = ds.get("SOPInstanceUID") or ds.file_meta.get("MediaStorageSOPInstanceUID", "")
+    return (int(number) if number is not None else 0, str(uid))
+
+
+def parse_multipart_related(body, content_type):
+    """Split a multipart/related response body into the payloads of its parts."""
+    match = re.search(r'boundary="?([^";]+)"?', content_type)
+    if not match:
+        raise ArchiveError("Archive response is not multipart.")
+    delimiter = b"--" + match.group(1).encode()
+    parts = []
+    for segment in body.split(delimiter)[1:]:
+        if segment.startswith(b"--"):
+            break  # closing delimiter
+        _, separator, payload = segment.partition(b"\r\n\r\n")
+        if not separator:
+            raise ArchiveError("Malformed multipart part in archive response.")
+        parts.append(payload[:-2] if payload.endswith(b"\r\n") else payload)
+    return parts
+
+
+class ConnectionPool:
+    """
+    Keep-alive HTTP(S) connections to one server, shared by all request threads. At most
+    max_connections requests are in flight; idle connections are reused so series fetches
+    skip the TCP (and TLS) handshake. A reused connection the server has meanwhile closed
+    is replaced transparently.
+    """
+
+    def __init__(self, base_url, max_connections=4, timeout=30):
+        parts = urllib.parse.urlsplit(base_url)
+        self.host = parts.netloc
+        self.base_path = parts.path.rstrip("/")
+        self.timeout = timeout
+        self._connection_class = (http.client.HTTPSConnection if parts.scheme == "https"
+                                  else http.client.HTTPConnection)
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self.max_connections = max_connections
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.requests = 0
+
+    def _connect(self):
+        with self._lock:
+            self.opened += 1
+        return self._connection_class(self.host, timeout=self.timeout)
+
+    def _send(self, connection, path, headers):
+        connection.request("GET", self.base_path + path, headers=headers)
+        return connection.getresponse()
+
+    def get(self, path, headers=None):
+        """GET a path below the base URL. Returns (status, content type, body)."""
+        headers = headers or {}
+        with self._slots:
+            try:
+                connection, reused = self._idle.get_nowait(), True
+            except queue.Empty:
+                connection, reused = self._connect(), False
+            with self._lock:
+                self.requests += 1
+            try:
+                try:
+                    response = self._send(connection, path, headers)
+                except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                    if not reused:
+                        raise
+                    # The server closed the idle connection; retry once on a fresh one
+                    connection.close()
+                    connection = self._connect()
+                    response = self._send(connection, path, headers)
+                body = response.read()
+            except Exception:
+                connection.close()
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                self._idle.put(connection)
+            return response.status, response.getheader("Content-Type", ""), body
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_connections": self.max_connections,
+                "idle_connections": self._idle.qsize(),
+                "connections_opened": self.opened,
+                "requests": self.requests,
+            }
+
+
+class DicomWebArchive:
+    """Fetches DICOM instances and series from a DICOMweb server with WADO-RS."""
+
+    def __init__(self, base_url, max_connections=4, timeout=30):
+        self.pool = ConnectionPool(base_url, max_connections, timeout)
+
+    def _retrieve(self, path):
+        try:
+            status, content_type, body = self.pool.get(path, {"Accept": DICOM_MULTIPART})
+        except (OSError, http.client.HTTPException) as e:
+            raise ArchiveError(f"Archive unreachable: {e}", 502)
+        if status == 404:
+            raise ArchiveError("Object not found in the archive.", 404)
+        if status != 200:
+            raise ArchiveError(f"Archive answered with HTTP {status}.", 502)
+        return parse_multipart_related(body, content_type)
+
+    def fetch_series(self, study, series):
+        """All instances of a series, in one request."""
+        return self._retrieve(f"/studies/{study}/series/{series}")
+
+    def fetch_instance(self, study, series, instance):
+        parts = self._retrieve(f"/studies/{study}/series/{series}/instances/{instance}")
+        if not parts:
+            raise ArchiveError("Archive returned no instance.", 502)
+        return parts[0]
+
+    def fetch_volume(self, study, series):
+        raise ArchiveError("NIfTI volumes can only be referenced in a filesystem archive.", 400)
+
+    def stats(self):
+        return self.pool.stats()
+
+
+class FilesystemArchive:
+    """
+    Fetches objects from a directory laid out as <study>/<series>/<instance>.dcm, with NIfTI
+    volumes stored as <study>/<series>.nii.gz.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def _read(self, *parts):
+        path = os.path.join(self.root, *parts)
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            raise ArchiveError("Object not found in the archive.", 404)
+
+    def fetch_series(self, study, series):
+        directory = os.path.join(self.root, study, series)
+        if not os.path.isdir(directory):
+            raise ArchiveError("Object not found in the archive.", 404)
+        return [self._read(study, series, name) for name in sorted(os.listdir(directory))
+                if name.endswith(".dcm")]
+
+    def fetch_instance(self, study, series, instance):
+        return self._read(study, series, f"{instance}.dcm")
+
+    def fetch_volume(self, study, series):
+        return self._read(study, f"{series}.nii.gz")
+
+    def stats(self):
+        return {"root": self.root}
+
+
+class ArchiveClient:
+    """
+    Resolves study/series/instance references against an archive backend.
+
+    A request for one instance fetches its whole series in a single round trip and keeps
+    it in an LRU cache, so the other instances of the series (typically requested next by
+    the same viewer) are served from memory. Concurrent fetches of the same series share
+    one download. A series larger than the whole prefetch budget cannot be kept, so after
+    the first fetch its instances are fetched one by one instead.
+    """
+
+    def __init__(self, backend, prefetch_bytes):
+        self.backend = backend
+        self.series_cache = LRUCache(prefetch_bytes)
+        # Keys of series that did not fit the cache, each counted as one byte
+        self._oversized = LRUCache(OVERSIZED_SERIES)
+        self._fetches = SingleFlight()
+
+    def series(self, study, series):
+        """The instances of a series as a list of (SOPInstanceUID, bytes), in instance order."""
+        key = (check_uid(study), check_uid(series))
+        instances = self.series_cache.get(key)
+        if instances is None:
+            instances, _ = self._fetches.do(key, lambda: self._fetch_series(study, series))
+        return instances
+
+    def _fetch_series(self, study, series):
+        instances = self.backend.fetch_series(study, series)
+        if not instances:
+            raise ArchiveError("Series not found in the archive.", 404)
+        try:
+            ordered = sorted(((instance_order(data), data) for data in instances), key=lambda item: item[0])
+        except Exception:
+            raise ArchiveError("Archive returned an unreadable DICOM instance.", 502)
+        result = [(uid, data) for (_, uid), data in ordered]
+        if not self.series_cache.put((study, series), result, size=sum(len(data) for _, data in result)):
+            self._oversized.put((study, series), True, size=1)
+        return result
+
+    def instance(self, study, series, instance):
+        """The bytes of one instance, from its prefetched series unless prefetching is disabled."""
+        check_uid(instance)
+        if not self.series_cache.max_bytes or (check_uid(study), check_uid(series)) in self._oversized:
+            return self.backend.fetch_instance(study, series, instance)
+        for uid, data in self.series(study, series):
+            if uid == instance:
+                return data
+        raise ArchiveError("Instance not found in the archive.", 404)
+
+    def volume(self, study, series):
+        """The bytes of a NIfTI volume."""
+        return self.backend.fetch_volume(check_uid(study), check_uid(series))
+
+    def stats(self):
+        return {"backend": self.backend.stats(), "prefetch_cache": self.series_cache.stats(),
+                "oversized_series": len(self._oversized)}
+
+
+def make_archive(url=None, directory=None, max_connections=4, timeout=30, prefetch_bytes=0):
+    """Create the archive client for the configured DICOMweb URL or directory (None if neither is set)."""
+    if url:
+        return ArchiveClient(DicomWebArchive(url, max_connections, timeout), prefetch_bytes)
+    if directory:
+        return ArchiveClient(FilesystemArchive(directory), prefetch_bytes)
+    return None
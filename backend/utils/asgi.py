@@ -0,0 +1,202 @@
+import asyncio
+import io
+import json
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+# Block size of file responses (send_file), instead of WSGI's usual 8 KB
+FILE_BLOCK_SIZE = 256 * 1024
+
+# Returned by _receive_body for a body beyond max_body_bytes
+_TOO_LARGE = object()
+
+
+class _FileWrapper:
+    """wsgi.file_wrapper reading in FILE_BLOCK_SIZE blocks, so a download takes few executor round trips."""
+
+    def __init__(self, file, block_size=FILE_BLOCK_SIZE):
+        self.file = file
+        self.block_size = max(block_size, FILE_BLOCK_SIZE)
+
+    def __iter__(self):
+        return iter(lambda: self.file.read(self.block_size), b"")
+
+    def close(self):
+        if hasattr(self.file, "close"):
+            self.file.close()
+
+
+class AsgiAdapter:
+    """
+    Serves a WSGI application (the Flask app) over ASGI.
+
+    The request body is received on the event loop, in memory up to spool_bytes and in a
+    temporary file beyond that, before the application is called. Bodies larger than
+    max_body_bytes are answered with 413 without being read further. The application and
+    the iteration of its response run on a bounded pool of max_workers threads, and every
+    response chunk is sent from the event loop. So a slow upload or download holds only its
+    connection, not a thread, and one process can keep many slow connections open while
+    the threads are busy with model work. Up to max_queue requests wait for a thread while
+    all are busy; further ones are answered with 503 and Retry-After instead of queueing
+    without bound.
+    """
+
+    def __init__(self, wsgi_app, max_workers=8, spool_bytes=16 * 1024 * 1024, max_queue=64,
+                 max_body_bytes=None, retry_after=1):
+        self.wsgi_app = wsgi_app
+        self.spool_bytes = spool_bytes
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.max_body_bytes = max_body_bytes
+        self.retry_after = retry_after
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix="asgi")
+        # Requests running the application or waiting for a thread to, only changed on the event loop
+        self._pending = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self._lifespan(receive, send)
+        if scope["type"] != "http":
+            raise ValueError(f"Unsupported ASGI scope type: {scope['type']}")
+        if self._too_large(self._content_length(scope)):
+            return await self._error(send, 413, "Request body too large.")
+        body = await self._receive_body(receive)
+        if body is None:
+            return  # The client went away before sending the whole body
+        if body is _TOO_LARGE:
+            return await self._error(send, 413, "Request body too large.")
+        if self._pending >= self.max_workers + self.max_queue:
+            body.close()
+            return await self._error(send, 503, "Server is busy, retry later.",
+                                     [(b"retry-after", str(self.retry_after).encode())])
+        await self._respond(self._environ(scope, body), send)
+
+    @staticmethod
+    def _content_length(scope):
+        for name, value in scope.get("headers", []):
+            if name.lower() == b"content-length" and value.isdigit():
+                return int(value)
+        return 0
+
+    def _too_large(self, length):
+        return self.max_body_bytes is not None and length > self.max_body_bytes
+
+    @staticmethod
+    async def _error(send, status, message, headers=()):
+        body = json.dumps({"error": message}).encode()
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", b"application/json"),
+                                (b"content-length", str(len(body)).encode()), *headers]})
+        await send({"type": "http.response.body", "body": body})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                # Waits for the running requests, off the event loop
+                await asyncio.get_running_loop().run_in_executor(None, self.executor.shutdown)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _receive_body(self, receive):
+        loop = asyncio.get_running_loop()
+        body = tempfile.SpooledTemporaryFile(self.spool_bytes)
+        length = 0
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                body.close()
+                return None
+            chunk = message.get("body", b"")
+            length += len(chunk)
+            if self._too_large(length):
+                body.close()
+                return _TOO_LARGE
+            if length > self.spool_bytes:
+                # Beyond the spool size the body is in a file, written off the event loop
+                await loop.run_in_executor(None, body.write, chunk)
+            else:
+                body.write(chunk)
+            if not message.get("more_body", False):
+                body.seek(0)
+                return body
+
+    def _environ(self, scope, body):
+        server = scope.get("server") or ("localhost", 80)
+        client = scope.get("client") or ("", 0)
+        length = body.seek(0, io.SEEK_END)
+        body.seek(0)
+        environ = {
+            "REQUEST_METHOD": scope["method"],
+            "SCRIPT_NAME": scope.get("root_path", "").encode().decode("latin-1"),
+            "PATH_INFO": scope["path"].encode().decode("latin-1"),
+            "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+            "SERVER_NAME": server[0],
+            "SERVER_PORT": str(server[1]),
+            "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+            "REMOTE_ADDR": client[0],
+            "REMOTE_PORT": str(client[1]),
+            "CONTENT_LENGTH": str(length),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scope.get("scheme", "http"),
+            "wsgi.input": body,
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+            "wsgi.file_wrapper": _FileWrapper,
+        }
+        for name, value in scope.get("headers", []):
+            name = name.decode("latin-1").upper().replace("-", "_")
+            value = value.decode("latin-1")
+            if name == "CONTENT_TYPE":
+                environ["CONTENT_TYPE"] = value
+                continue
+            if name == "CONTENT_LENGTH":
+                continue
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+    async def _respond(self, environ, send):
+        loop = asyncio.get_running_loop()
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and started:
+                raise exc_info[1].with_traceback(exc_info[2])
+            started["status"], started["headers"] = status, headers
+
+        def call_app():
+            # The application and its first chunk in one round trip, which is the whole
+            # response for everything that is not streamed
+            result = self.wsgi_app(environ, start_response)
+            chunks = iter(result)
+            return result, chunks, next(chunks, None)
+
+        def next_chunk(chunks):
+            return next(chunks, None)
+
+        result = None
+        try:
+            self._pending += 1
+            try:
+                result, chunks, chunk = await loop.run_in_executor(self.executor, call_app)
+            finally:
+                self._pending -= 1
+            status = int(started["status"].split(" ", 1)[0])
+            headers = [(name.lower().encode("latin-1"), value.encode("latin-1"))
+                       for name, value in started["headers"]]
+            await send({"type": "http.response.start", "status": status, "headers": headers})
+            while chunk is not None:
+                if chunk:
+                    await send({"type": "http.response.body", "body": bytes(chunk), "more_body": True})
+                chunk = await loop.run_in_executor(self.executor, next_chunk, chunks)
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            if hasattr(result, "close"):
+                await loop.run_in_executor(self.executor, result.close)
+            environ["wsgi.input"].close()
@@ -0,0 +1,408 @@
+import collections
+import csv
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+import cv2
+import nibabel as nib
+import numpy as np
+import pydicom
+import torch
+from utils.cam import compute_cams
+from utils.decode import iter_frames
+from utils.postprocess import postprocess_masks
+from utils.preprocess import preprocess_pixels, normalize_volume, standardize_volume
+from utils.segmentation import model_input, segment_stack, masks_to_native
+
+XRAY_MODELS = ("pneumonia", "cardiac")
+OUTPUT_FORMATS = ("parquet", "csv")
+
+
+def _is_nifti(name):
+    return name.endswith((".nii", ".nii.gz"))
+
+
+def _has_dicom_preamble(path):
+    """Whether a file starts with the 128-byte DICOM preamble and the "DICM" prefix."""
+    try:
+        with open(path, "rb") as f:
+            return f.read(132)[128:] == b"DICM"
+    except OSError:
+        return False
+
+
+def discover(root):
+    """
+    The DICOM and NIfTI (.nii, .nii.gz) files below root as two sorted lists of relative
+    paths. DICOM files are those named .dcm and, whatever their name, those with the DICOM
+    preamble (as PACS exports often have no extension).
+    """
+    dicoms, niftis = [], []
+    for directory, subdirectories, names in os.walk(root):
+        subdirectories.sort()
+        for name in sorted(names):
+            path = os.path.relpath(os.path.join(directory, name), root)
+            if name.lower().endswith(".dcm"):
+                dicoms.append(path)
+            elif _is_nifti(name.lower()):
+                niftis.append(path)
+            elif _has_dicom_preamble(os.path.join(directory, name)):
+                dicoms.append(path)
+    return dicoms, niftis
+
+
+class Manifest:
+    """
+    Append-only record of the input files a batch run is done with, one JSON line per file
+    with its status ("ok" once its results have been written, or "error") and the part
+    file holding its results. Files listed in it are skipped when the run is started
+    again, so an interrupted run resumes where it stopped.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # a line cut off by an interruption
+                    self.entries[entry["path"]] = entry
+
+    def __contains__(self, path):
+        return path in self.entries
+
+    def parts(self):
+        """The part files (relative to the output directory) that recorded files have their results in."""
+        return {entry["part"] for entry in self.entries.values() if entry.get("part")}
+
+    def record(self, entries):
+        """Append entries and flush them to disk."""
+        with open(self.path, "a") as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+                self.entries[entry["path"]] = entry
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def _parquet():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Parquet output needs pyarrow (pip install pyarrow); use the csv format otherwise.")
+    return pyarrow, pyarrow.parquet
+
+
+def check_output_format(format):
+    """Raise ValueError for an unknown output format, RuntimeError for Parquet without pyarrow installed."""
+    if format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format, expected one of {', '.join(OUTPUT_FORMATS)}.")
+    if format == "parquet":
+        _parquet()
+
+
+class PartWriter:
+    """
+    Writes result rows to numbered part files (part-00000.parquet, ...) in a directory.
+    Each part is written to a temporary file first and renamed, so a part file is
+    either complete or missing. Parts of earlier runs named in recorded are kept and
+    numbered after; any other part was written by a run interrupted before recording its
+    files, which are processed again, so it is removed rather than duplicating their rows.
+    """
+
+    def __init__(self, directory, format="parquet", recorded=None):
+        check_output_format(format)
+        self.directory = directory
+        self.format = format
+        os.makedirs(directory, exist_ok=True)
+        self.parts = 0
+        self.removed = []
+        for name in sorted(os.listdir(directory)):
+            if not name.startswith("part-"):
+                continue
+            if recorded is not None and name not in recorded:
+                os.remove(os.path.join(directory, name))
+                self.removed.append(name)
+                continue
+            self.parts = max(self.parts, int(name[len("part-"):].split(".")[0]) + 1)
+
+    def write(self, rows):
+        path = os.path.join(self.directory, f"part-{self.parts:05d}.{self.format}")
+        temp_path = path + ".tmp"
+        columns = list(dict.fromkeys(key for row in rows for key in row))
+        if self.format == "parquet":
+            pyarrow, parquet = _parquet()
+            table = pyarrow.Table.from_pydict({column: [row.get(column) for row in rows] for column in columns})
+            parquet.write_table(table, temp_path)
+        else:
+            with open(temp_path, "w", newline="") as f:
+                writer = csv.DictWriter(f, columns)
+                writer.writeheader()
+                writer.writerows(rows)
+        os.replace(temp_path, path)
+        self.parts += 1
+        return path
+
+
+def _init_worker():
+    # Every decode process uses a single thread; the processes share out the cores
+    cv2.setNumThreads(1)
+    torch.set_num_threads(1)
+
+
+def load_xray(path, reduced_decode=True):
+    """
+    Decode every frame of a DICOM file into a model input. Returns the (rows, columns)
+    of the image and a list of (1, 224, 224) float32 inputs, one per frame.
+    """
+    ds = pydicom.read_file(path)
+    inputs = [preprocess_pixels(pixels).numpy() for pixels in iter_frames(ds, 224 if reduced_decode else None)]
+    return (int(ds.Rows), int(ds.Columns)), inputs
+
+
+def load_volume(path, mode="resize"):
+    """
+    Load, normalize and standardize a NIfTI volume and prepare its model input. Returns a
+    dict with the foreground slice indices, their stack, the volume shape, voxel spacing
+    and affine.
+    """
+    nifti = nib.load(path)
+    volume = nifti.get_fdata()
+    indices, stack = model_input(standardize_volume(normalize_volume(volume)), mode)
+    return {
+        "indices": indices,
+        "stack": stack,
+        "shape": volume.shape[:3],
+        "voxel_spacing": tuple(float(s) for s in nifti.header.get_zooms()[:3]),
+        "affine": nifti.affine,
+    }
+
+
+def _try(load, path, *args):
+    """Run a loader in a worker, returning (result, None) or (None, error message)."""
+    try:
+        return load(path, *args), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def _ordered_map(executor, fn, items, window):
+    """Like executor.map, but with at most window calls submitted ahead of the consumer."""
+    pending = collections.deque()
+    for item in items:
+        pending.append(executor.submit(fn, *item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+class _InProcess:
+    """Stand-in for the process pool that runs every call in the calling process (workers=0)."""
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+    def shutdown(self):
+        pass
+
+
+class BatchRunner:
+    """
+    Runs models over every DICOM and NIfTI file below a directory.
+
+    Files are decoded and preprocessed in a pool of worker processes while the models run
+    on the main process in large batches. X-ray results (one row per frame) and atrium
+    volume statistics are written in parts to <output>/xray and <output>/atrium as Parquet
+    or CSV, atrium masks as NIfTI volumes to <output>/masks, mirroring the input layout.
+    Files are recorded in <output>/manifest.jsonl once their results are written, and
+    skipped when the run is started again. A part holds part_size DICOMs or
+    volume_part_size volumes, which bounds the work repeated after an interruption.
+
+    models maps model names to (model, version) pairs; DICOMs are run through the X-ray
+    models among them, NIfTI volumes through "atrium".
+    """
+
+    def __init__(self, input_dir, output_dir, models, device="cpu", workers=None, batch_size=64,
+                 atrium_batch_size=16, part_size=1000, volume_part_size=10, format="parquet", reduced_decode=True,
+                 log=None):
+        self.input_dir = input_dir
+        self.output_dir = output_dir
+        self.models = models
+        self.device = device
+        self.workers = os.cpu_count() if workers is None else workers
+        self.batch_size = batch_size
+        self.atrium_batch_size = atrium_batch_size
+        self.part_size = part_size
+        self.volume_part_size = volume_part_size
+        self.format = format
+        self.reduced_decode = reduced_decode
+        self.log = log or (lambda message: None)
+        os.makedirs(output_dir, exist_ok=True)
+        self.manifest = Manifest(os.path.join(output_dir, "manifest.jsonl"))
+        self.counts = {"done": 0, "failed": 0, "skipped": 0}
+
+    def run(self):
+        """Process all files not in the manifest yet. Returns the counts and the files per second."""
+        start = time.perf_counter()
+        dicoms, niftis = discover(self.input_dir)
+        xray_models = [name for name in XRAY_MODELS if name in self.models]
+        todo = []
+        if xray_models:
+            todo += [("xray", path) for path in dicoms]
+        if "atrium" in self.models:
+            todo += [("atrium", path) for path in niftis]
+        pending = [(kind, path) for kind, path in todo if path not in self.manifest]
+        self.counts["skipped"] = len(todo) - len(pending)
+        self._total, self._start = len(pending), start
+
+        executor = (ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                        initializer=_init_worker) if self.workers else _InProcess())
+        try:
+            xrays = [path for kind, path in pending if kind == "xray"]
+            volumes = [path for kind, path in pending if kind == "atrium"]
+            if xrays:
+                self._run_xrays(executor, xrays, xray_models)
+            if volumes:
+                self._run_volumes(executor, volumes)
+        finally:
+            executor.shutdown()
+
+        seconds = time.perf_counter() - start
+        processed = self.counts["done"] + self.counts["failed"]
+        return dict(self.counts, seconds=round(seconds, 3),
+                    files_per_second=round(processed / seconds, 2) if seconds > 0 else 0.0)
+
+    def _window(self):
+        # Enough files in flight to keep every worker busy while the models run
+        return max(1, self.workers) * 4
+
+    def _progress(self):
+        processed = self.counts["done"] + self.counts["failed"]
+        elapsed = time.perf_counter() - self._start
+        self.log(f"{processed}/{self._total} files ({self.counts['failed']} failed), "
+                 f"{processed / elapsed if elapsed > 0 else 0:.1f} files/s")
+
+    def _writer(self, kind):
+        """The PartWriter of <output>/<kind>, without the parts the manifest does not name."""
+        recorded = {os.path.basename(part) for part in self.manifest.parts() if os.path.dirname(part) == kind}
+        writer = PartWriter(os.path.join(self.output_dir, kind), self.format, recorded)
+        for name in writer.removed:
+            self.log(f"Removed {kind}/{name}, written by an interrupted run")
+        return writer
+
+    def _finish(self, writer, rows, entries):
+        """Write a part, then record its files (and the failed ones) in the manifest."""
+        if rows:
+            part = os.path.relpath(writer.write(rows), self.output_dir).replace(os.sep, "/")
+            for entry in entries:
+                if entry["status"] == "ok":
+                    entry["part"] = part
+        self.manifest.record(entries)
+        self.counts["done"] += sum(entry["status"] == "ok" for entry in entries)
+        self.counts["failed"] += sum(entry["status"] == "error" for entry in entries)
+        self._progress()
+
+    def _run_xrays(self, executor, paths, model_names):
+        writer = self._writer("xray")
+        loads = ((load_xray, os.path.join(self.input_dir, path), self.reduced_decode) for path in paths)
+        rows, entries, frames = [], [], []
+        for path, (loaded, error) in zip(paths, _ordered_map(executor, _try, loads, self._window())):
+            if error is not None:
+                entries.append({"path": path, "status": "error", "error": error})
+            else:
+                (height, width), inputs = loaded
+                for frame, tensor in enumerate(inputs):
+                    row = {"path": path, "frame": frame, "rows": height, "columns": width}
+                    rows.append(row)
+                    frames.append((row, tensor))
+                entries.append({"path": path, "status": "ok"})
+            # Run the models as soon as a full batch of frames is decoded
+            while len(frames) >= self.batch_size:
+                self._predict_xrays(frames[:self.batch_size], model_names)
+                frames = frames[self.batch_size:]
+            if len(entries) >= self.part_size:
+                self._predict_xrays(frames, model_names)
+                frames = []
+                self._finish(writer, rows, entries)
+                rows, entries = [], []
+        if entries:
+            self._predict_xrays(frames, model_names)
+            self._finish(writer, rows, entries)
+
+    def _predict_xrays(self, frames, model_names):
+        """Fill in the results of a batch of (row, model input) frames."""
+        if not frames:
+            return
+        batch = torch.from_numpy(np.stack([tensor for _, tensor in frames])).to(self.device)
+        for name in model_names:
+            model, version = self.models[name]
+            if name == "pneumonia":
+                _, probabilities = compute_cams(model, batch)
+                for (row, _), probability in zip(frames, probabilities[:, 0].cpu().numpy()):
+                    row.update(pneumonia_probability=float(probability), pneumonia_model_version=version)
+            else:
+                with torch.no_grad():
+                    boxes = model(batch).cpu().numpy()
+                for (row, _), box in zip(frames, boxes):
+                    # From 224x224 model coordinates to the pixels of the full image
+                    scale = np.array([row["columns"], row["rows"], row["columns"], row["rows"]]) / 224
+                    x1, y1, x2, y2 = (float(v) for v in box * scale)
+                    row.update(cardiac_x1=x1, cardiac_y1=y1, cardiac_x2=x2, cardiac_y2=y2,
+                               cardiac_model_version=version)
+
+    def _run_volumes(self, executor, paths):
+        writer = self._writer("atrium")
+        model, version = self.models["atrium"]
+        loads = ((load_volume, os.path.join(self.input_dir, path)) for path in paths)
+        rows, entries = [], []
+        for path, (loaded, error) in zip(paths, _ordered_map(executor, _try, loads, self.workers or 1)):
+            if error is None:
+                try:
+                    rows.append(self._segment(path, loaded, model, version))
+                    entries.append({"path": path, "status": "ok"})
+                except Exception as e:
+                    error = f"{type(e).__name__}: {e}"
+            if error is not None:
+                entries.append({"path": path, "status": "error", "error": error})
+            if len(entries) >= self.volume_part_size:
+                self._finish(writer, rows, entries)
+                rows, entries = [], []
+        if entries:
+            self._finish(writer, rows, entries)
+
+    def _segment(self, path, loaded, model, version):
+        """Segment one prepared volume, save its mask volume and return its result row."""
+        height, width, depth = loaded["shape"]
+        indices, probs = segment_stack(model, loaded["indices"], loaded["stack"], self.device,
+                                       batch_size=self.atrium_batch_size)
+        mask_volume = np.zeros((height, width, depth), dtype=np.uint8)
+        stats = {}
+        if len(indices):
+            masks, stats = postprocess_masks(probs, indices, 0.5, depth, loaded["voxel_spacing"], (height, width))
+            mask_volume[:, :, indices] = masks_to_native(masks, 0.5, (height, width)) > 0.5
+
+        mask_path = os.path.join("masks", path[:-len(".gz")] if path.endswith(".gz") else path) + ".gz"
+        os.makedirs(os.path.dirname(os.path.join(self.output_dir, mask_path)), exist_ok=True)
+        nib.save(nib.Nifti1Image(mask_volume, loaded["affine"]), os.path.join(self.output_dir, mask_path))
+        slice_range = stats.get("slice_range") or [None, None]
+        return {
+            "path": path,
+            "mask": mask_path,
+            "slices": len(indices),
+            "voxel_count": stats.get("voxel_count", 0),
+            "volume_ml": stats.get("volume_ml", 0.0),
+            "slice_count": stats.get("slice_count", 0),
+            "slice_first": slice_range[0],
+            "slice_last": slice_range[1],
+            "components_removed": stats.get("components_removed", 0),
+            "atrium_model_version": version,
+        }
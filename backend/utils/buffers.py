@@ -0,0 +1,123 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+class BufferPool:
+    """
+    Thread-safe pool of reusable NumPy buffers keyed by shape and dtype.
+
+    Released buffers are kept for the next request that needs the same shape and dtype
+    instead of going back to the allocator, which keeps the large per-request image
+    buffers from being allocated and freed over and over. The idle buffers are bounded
+    by their total size in bytes; the least recently released shapes are dropped first.
+    One pool is shared by all request threads of a worker process.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._idle = OrderedDict()  # (shape, dtype) -> list of released buffers
+        self._lock = threading.Lock()
+        self.idle_bytes = 0
+        self.in_use = 0
+        self.allocations = 0
+        self.reuses = 0
+        self.evictions = 0
+
+    def acquire(self, shape, dtype=np.float32):
+        """An uninitialized C-contiguous buffer, reused if one of this shape and dtype is idle."""
+        key = (tuple(shape), np.dtype(dtype).str)
+        with self._lock:
+            self.in_use += 1
+            idle = self._idle.get(key)
+            if idle:
+                buffer = idle.pop()
+                if not idle:
+                    del self._idle[key]
+                self.idle_bytes -= buffer.nbytes
+                self.reuses += 1
+                return buffer
+            self.allocations += 1
+        return np.empty(shape, dtype=dtype)
+
+    def release(self, buffer):
+        """Hand a buffer from acquire back; it must not be used afterwards."""
+        key = (buffer.shape, buffer.dtype.str)
+        with self._lock:
+            self.in_use -= 1
+            if buffer.nbytes > self.max_bytes:
+                return
+            self._idle.setdefault(key, []).append(buffer)
+            self._idle.move_to_end(key)
+            self.idle_bytes += buffer.nbytes
+            while self.idle_bytes > self.max_bytes:
+                oldest = next(iter(self._idle))
+                evicted = self._idle[oldest].pop(0)
+                if not self._idle[oldest]:
+                    del self._idle[oldest]
+                self.idle_bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def scope(self):
+        """A BufferScope on this pool, for the buffers of one request."""
+        return BufferScope(self)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "idle_buffers": sum(len(idle) for idle in self._idle.values()),
+                "idle_bytes": self.idle_bytes,
+                "max_bytes": self.max_bytes,
+                "in_use": self.in_use,
+                "allocations": self.allocations,
+                "reuses": self.reuses,
+                "evictions": self.evictions,
+            }
+
+
+class BufferScope:
+    """
+    The buffers taken from a pool for one piece of work. All of them go back to the pool
+    when the scope is closed (also on errors), unless they were released earlier.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self._buffers = {}
+        self._lock = threading.Lock()
+
+    def empty(self, shape, dtype=np.float32):
+        buffer = self.pool.acquire(shape, dtype)
+        with self._lock:
+            self._buffers[id(buffer)] = buffer
+        return buffer
+
+    def release(self, buffer):
+        """Return one buffer to the pool before the scope closes."""
+        with self._lock:
+            buffer = self._buffers.pop(id(buffer), None)
+        if buffer is not None:
+            self.pool.release(buffer)
+
+    def close(self):
+        with self._lock:
+            buffers, self._buffers = list(self._buffers.values()), {}
+        for buffer in buffers:
+            self.pool.release(buffer)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def empty(buffers, shape, dtype=np.float32):
+    """A buffer from a BufferScope, or a freshly allocated one if buffers is None."""
+    return buffers.empty(shape, dtype) if buffers is not None else np.empty(shape, dtype=dtype)
+
+
+def release(buffers, buffer):
+    """Hand a buffer from empty back to its BufferScope early (a no-op if buffers is None)."""
+    if buffers is not None:
+        buffers.release(buffer)
@@ -34,3 +34,22 @@ def compute_cam(model, image_tensor):
         cam = torch.zeros_like(cam)
         
     return cam, torch.sigmoid(pred)
+
+def compute_cams(model, batch):
+    """
+    Compute the CAMs and probabilities for a batch of image tensors in one forward pass.
+    Assumes batch is of shape (B, C, 224, 224); returns (B, 7, 7) CAMs and (B, 1) probabilities,
+    each CAM normalized like compute_cam.
+    """
+    model.eval()
+    with torch.no_grad():
+        pred, features = model(batch)  # features: (B, 512, 7, 7)
+    n, c, h, w = features.shape
+    weight = list(model.model.fc.parameters())[0][0].detach()  # shape: (512,)
+    cams = torch.matmul(weight, features.reshape(n, c, h * w)).reshape(n, h, w)
+
+    cam_min = cams.amin(dim=(1, 2), keepdim=True)
+    cam_range = cams.amax(dim=(1, 2), keepdim=True) - cam_min
+    # Constant CAMs become zeros, as in compute_cam
+    cams = torch.where(cam_range > 1e-7, (cams - cam_min) / cam_range.clamp_min(1e-7), torch.zeros_like(cams))
+    return cams, torch.sigmoid(pred)
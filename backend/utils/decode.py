@@ -0,0 +1,185 @@
+import io
+import numpy as np
+import pydicom
+from pydicom.encaps import encapsulate, generate_pixel_data_frame
+from pydicom.pixel_data_handlers.util import pixel_dtype
+from PIL import Image
+from utils.dicom_validation import frame_count
+
+# Handlers that decode a compressed frame at reduced resolution, by transfer syntax UID
+_pixel_handlers = {}
+
+
+def register_pixel_handler(transfer_syntaxes, handler):
+    """
+    Register a reduced-resolution decoder for one or more transfer syntaxes.
+
+    handler(frame, ds, min_size) receives the encapsulated bytes of one frame and the
+    dataset, and returns a 2D pixel array at least min_size pixels on both sides (at full
+    resolution if min_size is None), or None when it cannot decode this frame, in which
+    case pydicom decodes it at full resolution.
+    """
+    for uid in transfer_syntaxes:
+        _pixel_handlers[str(uid)] = handler
+
+
+def pixel_handler(transfer_syntax):
+    """Return the reduced-resolution decoder registered for a transfer syntax, or None."""
+    return _pixel_handlers.get(str(transfer_syntax))
+
+
+def reduction_level(shape, min_size, max_level=3):
+    """Largest number of halvings that keeps both sides of an image at least min_size pixels."""
+    level = 0
+    while level < max_level and min(-(-side // 2 ** (level + 1)) for side in shape) >= min_size:
+        level += 1
+    return level
+
+
+def _grayscale(image, ds):
+    if ds.get("SamplesPerPixel", 1) != 1 or ds.get("PixelRepresentation", 0) != 0:
+        return None
+    if image.mode not in ("L", "I;16"):
+        return None
+    return image
+
+
+def decode_jpeg_reduced(frame, ds, min_size):
+    """JPEG: let the decoder scale by 1/2, 1/4 or 1/8 in the DCT domain."""
+    image = _grayscale(Image.open(io.BytesIO(frame)), ds)
+    if image is None:
+        return None
+    if min_size:
+        image.draft(image.mode, (min_size, min_size))
+    return np.asarray(image)
+
+
+def decode_jpeg2000_reduced(frame, ds, min_size):
+    """JPEG 2000: decode only the resolution levels needed for min_size."""
+    image = _grayscale(Image.open(io.BytesIO(frame)), ds)
+    if image is None:
+        return None
+    if min_size:
+        image.reduce = reduction_level(image.size, min_size, max_level=5)
+    image.load()
+    return np.asarray(image)
+
+
+register_pixel_handler([
+    "1.2.840.10008.1.2.4.50",    # JPEG Baseline (8 bit)
+    "1.2.840.10008.1.2.4.51",    # JPEG Extended (12 bit)
+], decode_jpeg_reduced)
+register_pixel_handler([
+    "1.2.840.10008.1.2.4.90",    # JPEG 2000 (lossless only)
+    "1.2.840.10008.1.2.4.91",    # JPEG 2000
+], decode_jpeg2000_reduced)
+
+
+def _decode_frame(handler, frame, ds, min_size):
+    try:
+        return handler(frame, ds, min_size)
+    except OSError:  # the codec cannot handle this frame (e.g. 12 bit JPEG in Pillow)
+        return None
+
+
+# Attributes pydicom needs to decode pixel data
+_PIXEL_ATTRIBUTES = ("Rows", "Columns", "SamplesPerPixel", "PhotometricInterpretation", "BitsAllocated",
+                     "BitsStored", "HighBit", "PixelRepresentation", "PlanarConfiguration")
+
+
+def decode_frame(ds, frame):
+    """Decode one encapsulated frame of a dataset with pydicom, without decoding its other frames."""
+    single = pydicom.Dataset()
+    single.file_meta = ds.file_meta
+    single.is_little_endian, single.is_implicit_VR = ds.is_little_endian, ds.is_implicit_VR
+    for keyword in _PIXEL_ATTRIBUTES:
+        if keyword in ds:
+            setattr(single, keyword, ds.data_element(keyword).value)
+    single.PixelData = encapsulate([frame])
+    return single.pixel_array
+
+
+def decode_reduced(ds, min_size):
+    """
+    Decode the single frame of a compressed dataset close to min_size, or return None
+    if no handler is registered for its transfer syntax or no reduction is possible.
+    """
+    handler = pixel_handler(getattr(ds.file_meta, "TransferSyntaxUID", ""))
+    if handler is None or frame_count(ds) != 1:
+        return None
+    if reduction_level((int(ds.Rows), int(ds.Columns)), min_size) == 0:
+        return None
+    return _decode_frame(handler, next(generate_pixel_data_frame(ds.PixelData, 1)), ds, min_size)
+
+
+def _native_frame_reader(ds):
+    """Return a function reading one frame straight from uncompressed pixel data, or None."""
+    if ds.file_meta.TransferSyntaxUID.is_compressed or ds.get("SamplesPerPixel", 1) != 1:
+        return None
+    if ds.BitsAllocated not in (8, 16, 32):
+        return None  # bit-packed data is left to pydicom
+    dtype = pixel_dtype(ds)
+    shape = (int(ds.Rows), int(ds.Columns))
+    count = shape[0] * shape[1]
+    return lambda index: np.frombuffer(ds.PixelData, dtype, count, index * count * dtype.itemsize).reshape(shape)
+
+
+def iter_frames(ds, min_size=None):
+    """
+    Yield the frames of a (possibly multi-frame) dataset one at a time as 2D arrays.
+
+    Uncompressed frames are read as views into the pixel data and compressed frames
+    are decoded one by one, reduced towards min_size like decode_pixels where a handler
+    is registered, so only one decoded frame is held at a time.
+    """
+    count = frame_count(ds)
+    if count == 1:
+        pixels = decode_reduced(ds, min_size) if min_size else None
+        yield ds.pixel_array if pixels is None else pixels
+        return
+
+    read_native = _native_frame_reader(ds)
+    if read_native is not None:
+        for index in range(count):
+            yield read_native(index)
+        return
+
+    if not ds.file_meta.TransferSyntaxUID.is_compressed:
+        # Bit-packed data
+        for index in range(count):
+            yield ds.pixel_array[index]
+        return
+
+    handler = pixel_handler(ds.file_meta.TransferSyntaxUID)
+    if min_size and reduction_level((int(ds.Rows), int(ds.Columns)), min_size) == 0:
+        min_size = None
+    for frame in generate_pixel_data_frame(ds.PixelData, count):
+        pixels = _decode_frame(handler, frame, ds, min_size) if handler is not None else None
+        yield decode_frame(ds, frame) if pixels is None else pixels
+
+
+def decode_pixels(dicom_path, min_size=None):
+    """
+    Decode the pixel data of a DICOM file.
+
+    With min_size set, compressed images are decoded at the smallest resolution level
+    whose sides are still at least min_size pixels, which is several times faster and
+    smaller than a full decode. Uncompressed data is always decoded in full.
+    """
+    ds = pydicom.read_file(dicom_path)
+    if min_size:
+        pixels = decode_reduced(ds, min_size)
+        if pixels is not None:
+            return pixels
+    return ds.pixel_array
+
+
+def iter_series_frames(dicom_paths, min_size=None):
+    """
+    Yield (file index, frame index, pixels) for every frame of a series of DICOM files,
+    opening each file only when its frames are reached.
+    """
+    for file_index, dicom_path in enumerate(dicom_paths):
+        ds = pydicom.read_file(dicom_path)
+        for frame_index, pixels in enumerate(iter_frames(ds, min_size)):
+            yield file_index, frame_index, pixels
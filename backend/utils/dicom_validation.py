@@ -0,0 +1,121 @@
+import pydicom
+
+# Transfer syntaxes whose pixel data we can decode
+SUPPORTED_TRANSFER_SYNTAXES = {
+    "1.2.840.10008.1.2",         # Implicit VR Little Endian
+    "1.2.840.10008.1.2.1",       # Explicit VR Little Endian
+    "1.2.840.10008.1.2.1.99",    # Deflated Explicit VR Little Endian
+    "1.2.840.10008.1.2.2",       # Explicit VR Big Endian
+    "1.2.840.10008.1.2.4.50",    # JPEG Baseline (8 bit)
+    "1.2.840.10008.1.2.4.51",    # JPEG Extended (12 bit)
+    "1.2.840.10008.1.2.4.57",    # JPEG Lossless
+    "1.2.840.10008.1.2.4.70",    # JPEG Lossless, first-order prediction
+    "1.2.840.10008.1.2.4.90",    # JPEG 2000 (lossless only)
+    "1.2.840.10008.1.2.4.91",    # JPEG 2000
+    "1.2.840.10008.1.2.5",       # RLE Lossless
+}
+
+# Admission rules for the chest X-ray models
+XRAY_RULES = {
+    "modalities": {"CR", "DX"},
+    "photometric_interpretations": {"MONOCHROME1", "MONOCHROME2"},
+    "bits_stored": (1, 16),
+    "samples_per_pixel": 1,
+    "max_frames": 256,           # per request, over all files of a series
+    "max_pixels": 40_000_000,    # per frame
+    # per file, over all its frames: its whole pixel data is read into memory, and
+    # uncompressed it is as large as the decoded frames (256 frames of 1024x1024)
+    "max_total_pixels": 256 * 1024 * 1024,
+    "transfer_syntaxes": SUPPORTED_TRANSFER_SYNTAXES,
+}
+
+MODEL_RULES = {
+    "pneumonia": XRAY_RULES,
+    "cardiac": XRAY_RULES,
+}
+
+
+class DicomValidationError(Exception):
+    """An upload that failed the DICOM header admission checks, with the HTTP status to answer with."""
+
+    def __init__(self, message, status_code=422):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def read_dicom_header(fileobj):
+    """Parse only the DICOM header (everything before the pixel data) of a file or file-like object."""
+    try:
+        return pydicom.dcmread(fileobj, stop_before_pixels=True)
+    except Exception as e:  # malformed files fail in many different ways inside the parser
+        raise DicomValidationError(f"Not a valid DICOM file: {e}", 400)
+
+
+def _require(ds, keyword):
+    value = ds.get(keyword)
+    if value is None or value == "":
+        raise DicomValidationError(f"DICOM header is missing {keyword}.")
+    return value
+
+
+def validate_dicom_header(ds, rules):
+    """Check a parsed DICOM header against a model's admission rules, raising DicomValidationError."""
+    modality = _require(ds, "Modality")
+    if modality not in rules["modalities"]:
+        raise DicomValidationError(
+            f"Unsupported modality {modality}, expected one of {', '.join(sorted(rules['modalities']))}.")
+
+    photometric = _require(ds, "PhotometricInterpretation")
+    if photometric not in rules["photometric_interpretations"]:
+        raise DicomValidationError(f"Unsupported photometric interpretation {photometric}.")
+
+    samples = int(ds.get("SamplesPerPixel", 1))
+    if samples != rules["samples_per_pixel"]:
+        raise DicomValidationError(f"Unsupported number of samples per pixel: {samples}.")
+
+    bits_stored = int(_require(ds, "BitsStored"))
+    low, high = rules["bits_stored"]
+    if not low <= bits_stored <= high:
+        raise DicomValidationError(f"Unsupported bits stored: {bits_stored}.")
+
+    transfer_syntax = getattr(getattr(ds, "file_meta", None), "TransferSyntaxUID", None)
+    if transfer_syntax is None or str(transfer_syntax) not in rules["transfer_syntaxes"]:
+        raise DicomValidationError(f"Unsupported transfer syntax {transfer_syntax}.", 415)
+
+    rows, columns = int(_require(ds, "Rows")), int(_require(ds, "Columns"))
+    if rows <= 0 or columns <= 0:
+        raise DicomValidationError(f"Invalid image size {rows}x{columns}.")
+    frames = frame_count(ds)
+    if frames > rules["max_frames"]:
+        raise DicomValidationError(f"Too many frames: {frames}, at most {rules['max_frames']} supported.", 413)
+    if rows * columns > rules["max_pixels"]:
+        raise DicomValidationError(
+            f"Image too large: {rows}x{columns} pixels, at most {rules['max_pixels']} supported.", 413)
+    if rows * columns * frames > rules["max_total_pixels"]:
+        raise DicomValidationError(
+            f"Image too large: {rows}x{columns}x{frames} pixels, at most {rules['max_total_pixels']} supported.", 413)
+    return ds
+
+
+def frame_count(ds):
+    """Number of frames in a DICOM dataset (1 for single-frame objects)."""
+    return int(ds.get("NumberOfFrames", 1) or 1)
+
+
+def validate_dicom_upload(fileobj, model_name):
+    """
+    Admit an uploaded DICOM for a model by parsing and validating only its header.
+    The stream is rewound afterwards so it can still be saved or decoded in full.
+    """
+    ds = read_dicom_header(fileobj)
+    fileobj.seek(0)
+    return validate_dicom_header(ds, MODEL_RULES.get(model_name, XRAY_RULES))
+
+
+def validate_frame_total(headers, model_name):
+    """Check that the frames of all admitted files of one request stay within the model's frame limit."""
+    rules = MODEL_RULES.get(model_name, XRAY_RULES)
+    total = sum(frame_count(ds) for ds in headers)
+    if total > rules["max_frames"]:
+        raise DicomValidationError(f"Too many frames: {total}, at most {rules['max_frames']} supported.", 413)
+    return total
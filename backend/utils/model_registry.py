@@ -0,0 +1,122 @@
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+import torch
+from utils.cache import content_hash
+
+
+def checkpoint_version(checkpoint_path):
+    """Version tag of a checkpoint: the start of the SHA-256 of its contents."""
+    return content_hash(checkpoint_path)[:12]
+
+
+class ModelRegistry:
+    """
+    Tracks the version of every model in a models dict and the requests using it, so a
+    model can be replaced while requests are in flight.
+
+    Requests take a lease on a model and keep using the model and version they got even
+    if a new version is swapped in meanwhile. A replaced model is kept as draining until
+    its last lease ends, after which its memory is released.
+    """
+
+    def __init__(self, models):
+        self.models = models
+        self._versions = {}
+        self._checkpoints = {}
+        self._in_flight = defaultdict(int)  # (name, version) -> active leases
+        self._draining = {}  # (name, version) -> replaced model with active leases
+        self._reloads = {}  # name -> state of the last background reload
+        self._reload_done = {}  # name -> event set when that reload has finished
+        self._release_pending = False
+        self._lock = threading.Lock()
+
+    def register(self, name, model, version, checkpoint=None):
+        """Add a model, or atomically replace the current version of it."""
+        with self._lock:
+            old_key = (name, self._versions.get(name))
+            old_model = self.models.get(name)
+            self.models[name] = model
+            self._versions[name] = version
+            self._checkpoints[name] = checkpoint
+            if old_model is not None and old_key != (name, version) and self._in_flight.get(old_key):
+                self._draining[old_key] = old_model
+            elif old_model is not None:
+                self._release_pending = True
+
+    def version(self, name):
+        with self._lock:
+            return self._versions.get(name)
+
+    @contextmanager
+    def lease(self, name):
+        """Use the current version of a model for the duration of a request; yields (model, version)."""
+        self._release()
+        with self._lock:
+            model = self.models[name]
+            key = (name, self._versions.get(name))
+            self._in_flight[key] += 1
+        try:
+            yield model, key[1]
+        finally:
+            with self._lock:
+                self._in_flight[key] -= 1
+                if self._in_flight[key] == 0:
+                    del self._in_flight[key]
+                    if self._draining.pop(key, None) is not None:
+                        self._release_pending = True
+
+    def reload(self, name, load, version, checkpoint=None):
+        """
+        Load (and warm up) a new version of a model in a background thread with load(),
+        then swap it in. Returns False if a reload of this model is already running.
+        """
+        with self._lock:
+            if self._reloads.get(name, {}).get("state") == "loading":
+                return False
+            self._reloads[name] = {"state": "loading", "version": version, "checkpoint": checkpoint,
+                                   "started": time.time(), "error": None}
+            self._reload_done[name] = done = threading.Event()
+
+        def run():
+            state = self._reloads[name]
+            try:
+                model = load()
+                self.register(name, model, version, checkpoint)
+                state["state"] = "done"
+            except Exception as e:
+                state.update(state="failed", error=str(e))
+            state["seconds"] = round(time.time() - state["started"], 3)
+            done.set()
+
+        threading.Thread(target=run, name=f"reload-{name}", daemon=True).start()
+        return True
+
+    def wait_reload(self, name, timeout=None):
+        """Block until the last reload of a model has finished; returns its state."""
+        if name in self._reload_done:
+            self._reload_done[name].wait(timeout)
+        return self._reloads.get(name, {}).get("state")
+
+    def _release(self):
+        """
+        Hand the cached GPU memory of replaced, drained models back to the device. This runs
+        at the start of the next lease, when the requests that used them have returned and
+        dropped their last references.
+        """
+        if not self._release_pending:
+            return
+        self._release_pending = False
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def status(self):
+        with self._lock:
+            return {name: {
+                "version": version,
+                "checkpoint": self._checkpoints.get(name),
+                "in_flight": self._in_flight.get((name, version), 0),
+                "draining": {v: self._in_flight.get((n, v), 0) for n, v in self._draining if n == name},
+                "reload": dict(self._reloads[name]) if name in self._reloads else None,
+            } for name, version in self._versions.items()}
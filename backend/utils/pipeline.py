@@ -0,0 +1,148 @@
+import queue
+import threading
+import time
+
+_DONE = object()
+
+# Cumulative per-stage statistics of all pipeline runs, by pipeline name
+_metrics = {}
+_metrics_lock = threading.Lock()
+
+
+class Pipeline:
+    """
+    Runs items through a chain of stages, one worker thread per stage, connected by
+    bounded queues. While one stage works on an item the previous stage can already
+    prepare the next one, so stages that release the GIL (PyTorch, OpenCV, zlib)
+    overlap. With a single worker per stage the output order matches the input order.
+    Once a stage fails no further items are pulled from the input and the items already
+    queued skip every stage; the first error is raised after the run.
+
+    stages is a list of (name, fn) pairs; each fn takes the previous stage's output.
+    After a run, `stats` holds for every stage the number of items processed, the
+    time spent in fn, the utilization over the run and the queue depth in front of it.
+    """
+
+    def __init__(self, name, stages, queue_size=2):
+        self.name = name
+        self.stages = stages
+        self.queue_size = queue_size
+        self.stats = {}
+
+    def run(self, items):
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages] + [queue.Queue()]
+        stats = {name: {"items": 0, "busy_seconds": 0.0, "max_queue_depth": 0, "queue_depth_sum": 0}
+                 for name, _ in self.stages}
+        errors = []
+
+        names = [name for name, _ in self.stages]
+
+        def worker(index, name, fn):
+            inbox, outbox = queues[index], queues[index + 1]
+            next_stats = stats[names[index + 1]] if index + 1 < len(names) else None
+            while True:
+                stats[name]["queue_depth_sum"] += inbox.qsize()
+                item = inbox.get()
+                if item is _DONE:
+                    outbox.put(_DONE)
+                    return
+                if errors:
+                    continue  # skip the work and drain the queue so upstream stages never block
+                start = time.perf_counter()
+                try:
+                    result = fn(item)
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                stats[name]["busy_seconds"] += time.perf_counter() - start
+                stats[name]["items"] += 1
+                outbox.put(result)
+                if next_stats is not None:
+                    next_stats["max_queue_depth"] = max(next_stats["max_queue_depth"], outbox.qsize())
+
+        threads = [threading.Thread(target=worker, args=(i, name, fn), daemon=True)
+                   for i, (name, fn) in enumerate(self.stages)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+
+        try:
+            for item in items:
+                if errors:
+                    break  # stop pulling (and decoding) items once a stage has failed
+                queues[0].put(item)
+                stats[names[0]]["max_queue_depth"] = max(stats[names[0]]["max_queue_depth"], queues[0].qsize())
+        finally:
+            queues[0].put(_DONE)
+
+        results = []
+        while True:
+            result = queues[-1].get()
+            if result is _DONE:
+                break
+            results.append(result)
+        for thread in threads:
+            thread.join()
+
+        wall = time.perf_counter() - started
+        self.stats = _summarize(stats, wall)
+        _record(self.name, self.stats, wall)
+        if errors:
+            raise errors[0]
+        return results
+
+
+def batched(items, size):
+    """Group an iterable into lists of at most size items, pulling items only as needed."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _summarize(stats, wall):
+    summary = {}
+    for name, s in stats.items():
+        gets = s["items"] + 1
+        summary[name] = {
+            "items": s["items"],
+            "busy_seconds": round(s["busy_seconds"], 4),
+            "utilization": round(s["busy_seconds"] / wall, 3) if wall > 0 else 0.0,
+            "max_queue_depth": s["max_queue_depth"],
+            "mean_queue_depth": round(s["queue_depth_sum"] / gets, 2),
+        }
+    return summary
+
+
+def _record(name, stats, wall):
+    with _metrics_lock:
+        entry = _metrics.setdefault(name, {"runs": 0, "wall_seconds": 0.0, "stages": {}})
+        entry["runs"] += 1
+        entry["wall_seconds"] += wall
+        entry["last_run"] = stats
+        for stage, s in stats.items():
+            total = entry["stages"].setdefault(stage, {"items": 0, "busy_seconds": 0.0, "max_queue_depth": 0})
+            total["items"] += s["items"]
+            total["busy_seconds"] += s["busy_seconds"]
+            total["max_queue_depth"] = max(total["max_queue_depth"], s["max_queue_depth"])
+
+
+def metrics_snapshot():
+    """Return the cumulative statistics of all pipelines, including each stage's utilization."""
+    with _metrics_lock:
+        snapshot = {}
+        for name, entry in _metrics.items():
+            wall = entry["wall_seconds"]
+            snapshot[name] = {
+                "runs": entry["runs"],
+                "wall_seconds": round(wall, 4),
+                "last_run": entry["last_run"],
+                "stages": {stage: dict(s, busy_seconds=round(s["busy_seconds"], 4),
+                                       utilization=round(s["busy_seconds"] / wall, 3) if wall > 0 else 0.0)
+                           for stage, s in entry["stages"].items()},
+            }
+        return snapshot
@@ -0,0 +1,57 @@
+import numpy as np
+from scipy import ndimage
+
+# 26-connectivity: voxels touching by a face, an edge or a corner belong to the same component
+_CONNECTIVITY = np.ones((3, 3, 3), dtype=bool)
+
+
+def assemble_mask_volume(masks, slice_indices, depth):
+    """Place an (h, w, N) mask stack of the segmented slices into an (h, w, depth) boolean volume."""
+    mask_volume = np.zeros(masks.shape[:2] + (depth,), dtype=bool)
+    mask_volume[:, :, slice_indices] = masks
+    return mask_volume
+
+
+def keep_largest_component(mask_volume):
+    """
+    Keep only the largest 3D connected component of a boolean mask volume.
+    Returns the filtered volume and the number of components that were removed.
+    """
+    labels, count = ndimage.label(mask_volume, structure=_CONNECTIVITY)
+    if count <= 1:
+        return mask_volume, 0
+    sizes = np.bincount(labels.ravel())
+    sizes[0] = 0  # background
+    return labels == sizes.argmax(), count - 1
+
+
+def mask_statistics(mask_volume, voxel_spacing, native_shape):
+    """
+    Compute volumetric statistics for a boolean (h, w, S) mask volume.
+
+    The mask may be at model resolution, so every mask voxel is scaled to the
+    native (H, W) slice size before the NIfTI voxel spacing (in mm) is applied.
+    """
+    scale = (native_shape[0] / mask_volume.shape[0]) * (native_shape[1] / mask_volume.shape[1])
+    voxel_count = int(np.count_nonzero(mask_volume))
+    voxel_ml = float(np.prod(voxel_spacing[:3])) / 1000.0
+    slices = np.flatnonzero(mask_volume.any(axis=(0, 1)))
+    return {
+        "voxel_count": int(round(voxel_count * scale)),
+        "volume_ml": round(voxel_count * scale * voxel_ml, 3),
+        "voxel_spacing_mm": [float(s) for s in voxel_spacing[:3]],
+        "slice_count": int(slices.size),
+        "slice_range": [int(slices[0]), int(slices[-1])] if slices.size else None,
+    }
+
+
+def postprocess_masks(probs, slice_indices, threshold, depth, voxel_spacing, native_shape):
+    """
+    Threshold a probability stack, keep the largest 3D atrium component and compute its statistics.
+    Returns the filtered (h, w, N) mask stack for the segmented slices and the statistics dict.
+    """
+    mask_volume = assemble_mask_volume(probs > threshold, slice_indices, depth)
+    mask_volume, removed = keep_largest_component(mask_volume)
+    stats = mask_statistics(mask_volume, voxel_spacing, native_shape)
+    stats["components_removed"] = removed
+    return mask_volume[:, :, slice_indices], stats
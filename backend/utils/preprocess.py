@@ -1,17 +1,27 @@
-import pydicom
 import cv2
 import numpy as np
-from torchvision import transforms
+import torch
+from utils.decode import decode_pixels
+from utils.buffers import empty
 
-def preprocess_dicom(dicom_path):
-    dcm = pydicom.read_file(dicom_path).pixel_array / 255.0
-    img = cv2.resize(dcm, (224, 224)).astype(np.float32)
-    transform = transforms.Compose([
-        transforms.ToTensor(),
-        transforms.Normalize([0.49], [0.248])
-    ])
-    tensor_img = transform(img)
-    return tensor_img
+def preprocess_dicom(dicom_path, reduced_decode=True, buffers=None):
+    # Compressed images are decoded at the smallest resolution level that still covers 224x224
+    return preprocess_pixels(decode_pixels(dicom_path, min_size=224 if reduced_decode else None), buffers)
+
+def preprocess_pixels(pixels, buffers=None):
+    """
+    Turn one decoded 2D frame into the normalized (1, 224, 224) X-ray model input.
+    The full-resolution intermediates are taken from buffers (a BufferScope) if given.
+    """
+    dcm = empty(buffers, pixels.shape, np.result_type(pixels, 255.0))
+    np.divide(pixels, 255.0, out=dcm)
+    resized = cv2.resize(dcm, (224, 224), dst=empty(buffers, (224, 224), dcm.dtype))
+    img = np.empty((1, 224, 224), dtype=np.float32)
+    np.copyto(img[0], resized, casting='same_kind')
+    # transforms.Normalize([0.49], [0.248]), in place
+    np.subtract(img, 0.49, out=img)
+    np.divide(img, 0.248, out=img)
+    return torch.from_numpy(img)
 
 def normalize_volume(volume):
     """Z-Normalization of the whole volume"""
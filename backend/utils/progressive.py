@@ -0,0 +1,39 @@
+import json
+import uuid
+import numpy as np
+
+
+def multipart_stream(parts, boundary):
+    """
+    Yield a multipart/mixed body chunk by chunk from an iterable of (headers, body) parts,
+    so each part reaches the client as soon as it has been produced.
+    """
+    for headers, body in parts:
+        head = "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+        yield f"--{boundary}\r\n{head}\r\n".encode() + body + b"\r\n"
+    yield f"--{boundary}--\r\n".encode()
+
+
+def new_boundary():
+    return uuid.uuid4().hex
+
+
+def json_part(name, data):
+    return {"Content-Type": "application/json", "Content-Disposition": f'inline; name="{name}"'}, \
+        json.dumps(data).encode()
+
+
+def png_part(name, png, filename=None):
+    disposition = f'inline; name="{name}"' + (f'; filename="{filename}"' if filename else "")
+    return {"Content-Type": "image/png", "Content-Disposition": disposition}, bytes(png)
+
+
+def center_out(positions, center=None):
+    """
+    Order indices into positions by distance from the center (the middle of their range
+    by default), nearest first; ties keep their original order.
+    """
+    positions = np.asarray(positions, dtype=np.float64)
+    if center is None:
+        center = (positions.min() + positions.max()) / 2 if positions.size else 0
+    return np.argsort(np.abs(positions - center), kind="stable")
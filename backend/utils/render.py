@@ -0,0 +1,111 @@
+import cv2
+import numpy as np
+from utils.pipeline import Pipeline
+from utils.buffers import empty, release
+
+# Edge of the blocks used to transpose stacks that are not stored slice by slice
+_TRANSPOSE_BLOCK = 64
+
+
+def window_slices(volume, indices):
+    """
+    Scale each selected slice of an (H, W, S) volume to 0-255 based on its own min/max.
+    Constant slices become black. Returns a uint8 (H, W, N) stack.
+    """
+    slices = volume[:, :, indices]
+    min_vals = slices.min(axis=(0, 1))
+    ranges = slices.max(axis=(0, 1)) - min_vals
+    # Avoid division by zero for constant slices, which are all zeros after the subtraction
+    ranges = np.where(ranges > 0, ranges, 1)
+    return ((slices - min_vals) / ranges * 255).astype(np.uint8)
+
+
+def _slice_major(view, out):
+    """
+    Copy an (N, W, H) display-oriented view of an (H, W, N) stack into the C-contiguous out.
+    Stacks that are not laid out slice by slice in memory are copied in square blocks,
+    which keeps the strided reads cache friendly.
+    """
+    if abs(view.strides[2]) == view.itemsize:
+        np.copyto(out, view)
+        return out
+    for j in range(0, view.shape[1], _TRANSPOSE_BLOCK):
+        for i in range(0, view.shape[2], _TRANSPOSE_BLOCK):
+            out[:, j:j + _TRANSPOSE_BLOCK, i:i + _TRANSPOSE_BLOCK] = \
+                view[:, j:j + _TRANSPOSE_BLOCK, i:i + _TRANSPOSE_BLOCK]
+    return out
+
+
+def _half_round_even(values):
+    """values / 2 rounded half to even for unsigned integers, as cv2.addWeighted rounds."""
+    return (values >> 1) + ((values & 3) == 3)
+
+
+def render_overlays(backgrounds, masks, out=None, buffers=None):
+    """
+    Blend red segmentation masks onto a stack of uint8 slices for display, all at once.
+
+    backgrounds and masks are (H, W, N) stacks. Every slice is rotated 90 degrees
+    counter-clockwise and flipped horizontally, i.e. transposed with both axes
+    reversed, and written into a contiguous (N, W, H, 3) BGR buffer whose slices
+    can be handed to the encoder as views. Masked pixels are averaged 50/50 with
+    red exactly like cv2.addWeighted; only those pixels are touched after the
+    grayscale to BGR conversion. Without out, the result and the intermediate
+    grayscale stack are taken from buffers (a BufferScope) if given.
+    """
+    height, width, count = backgrounds.shape
+    # Rotate 90 CCW + horizontal flip: display[n, i, j] = slice[H-1-j, W-1-i]
+    display = _slice_major(backgrounds[::-1, ::-1].transpose(2, 1, 0),
+                           empty(buffers, (count, width, height), backgrounds.dtype))
+    if out is None:
+        out = empty(buffers, (count, width, height, 3), np.uint8)
+    # Convert the whole stack to BGR in one call by treating it as a single (N*W, H) image
+    cv2.cvtColor(display.reshape(-1, height), cv2.COLOR_GRAY2BGR, dst=out.reshape(-1, height, 3))
+
+    positive = np.flatnonzero(masks > 0)
+    if positive.size == 0:
+        release(buffers, display)
+        return out
+    rows, cols, slices = np.unravel_index(positive, masks.shape)
+    pixels = (slices * width + (width - 1 - cols)) * height + (height - 1 - rows)
+    gray = display.reshape(-1)[pixels].astype(np.uint16)
+    red = (masks[rows, cols, slices] * 255).astype(np.uint8)
+
+    # Blue and green are blended with 0, red with the mask intensity
+    bgr = out.reshape(-1, 3)
+    dimmed = _half_round_even(gray).astype(np.uint8)
+    bgr[pixels, 0] = dimmed
+    bgr[pixels, 1] = dimmed
+    bgr[pixels, 2] = _half_round_even(gray + red).astype(np.uint8)
+    release(buffers, display)
+    return out
+
+
+def write_overlays_to_zip(zipf, slice_indices, backgrounds, masks, batch_size=16, buffers=None):
+    """
+    Render, PNG-encode and store the overlays of all segmented slices in an open ZipFile.
+
+    Rendering, PNG encoding and ZIP writing run as pipeline stages over batches of
+    slices, so the compression of one batch overlaps with rendering the next. With
+    buffers (a BufferScope), the overlay buffer of a batch is handed back once it has
+    been encoded and is reused for a later batch. Returns the per-stage pipeline statistics.
+    """
+    def render(start):
+        stop = start + batch_size
+        return start, render_overlays(backgrounds[:, :, start:stop], masks[:, :, start:stop], buffers=buffers)
+
+    def encode(rendered):
+        start, overlays = rendered
+        # Encode each slice straight from a view into the overlay buffer
+        encoded = [(f"slice_{slice_indices[start + n]:03d}.png", cv2.imencode('.png', overlay)[1])
+                   for n, overlay in enumerate(overlays)]
+        release(buffers, overlays)
+        return encoded
+
+    def write(encoded):
+        for filename, png in encoded:
+            zipf.writestr(filename, png)
+
+    pipeline = Pipeline("atrium_render", [("render", render), ("encode", encode), ("zip", write)])
+    pipeline.run(range(0, len(slice_indices), batch_size))
+    return pipeline.stats
@@ -0,0 +1,257 @@
+import cv2
+import numpy as np
+import torch
+from utils.pipeline import Pipeline
+from utils.buffers import empty, release
+
+MODEL_INPUT_SIZE = 224
+# The UNet pools three times, so crops fed to it must be a multiple of 8 pixels
+UNET_ALIGNMENT = 8
+# Rough peak UNet activation memory per input pixel (float32, all levels and skips)
+UNET_BYTES_PER_PIXEL = 2560
+MIN_TILE_SIZE = 64
+DEFAULT_TILE_MEMORY_MB = 256
+INFERENCE_MODES = ("resize", "native", "tiled")
+# OpenCV caps the number of channels a single cv2.resize call can handle
+_RESIZE_CHUNK = 128
+
+
+def foreground_slices(volume, threshold=0.01):
+    """Return the indices of the slices (last axis) that are not completely black."""
+    slice_max = volume.max(axis=(0, 1))
+    # Written as a negated comparison so that slices containing NaNs are kept, as before
+    return np.flatnonzero(~(slice_max < threshold))
+
+
+def resize_stack(stack, dsize, interpolation=cv2.INTER_LINEAR):
+    """
+    Resize every slice of an (H, W, N) stack to dsize=(width, height) in bulk.
+    The slices are passed to OpenCV as channels, so there is one call per chunk
+    instead of one per slice. Returns a float32 (height, width, N) array.
+    """
+    width, height = dsize
+    out = np.empty((height, width, stack.shape[2]), dtype=np.float32)
+    for start in range(0, stack.shape[2], _RESIZE_CHUNK):
+        chunk = np.ascontiguousarray(stack[:, :, start:start + _RESIZE_CHUNK], dtype=np.float32)
+        resized = cv2.resize(chunk, dsize, interpolation=interpolation)
+        out[:, :, start:start + chunk.shape[2]] = resized.reshape(height, width, -1)
+    return out
+
+
+def align_box(box, shape=(MODEL_INPUT_SIZE, MODEL_INPUT_SIZE), alignment=UNET_ALIGNMENT):
+    """Grow an (x0, y0, x1, y1) box outwards to the UNet alignment, clamped to an (H, W) image."""
+    x0, y0, x1, y1 = box
+    x0 = max(0, x0 // alignment * alignment)
+    y0 = max(0, y0 // alignment * alignment)
+    x1 = min(shape[1], -(-x1 // alignment) * alignment)
+    y1 = min(shape[0], -(-y1 // alignment) * alignment)
+    if x1 <= x0 or y1 <= y0:
+        raise ValueError("Crop box is empty")
+    return x0, y0, x1, y1
+
+
+def scale_box(box, shape, size=MODEL_INPUT_SIZE):
+    """Scale an (x0, y0, x1, y1) box given in model-input coordinates to an (H, W) image."""
+    x0, y0, x1, y1 = box
+    sx, sy = shape[1] / size, shape[0] / size
+    return int(x0 * sx), int(y0 * sy), int(np.ceil(x1 * sx)), int(np.ceil(y1 * sy))
+
+
+def mask_bounding_box(masks, margin=16):
+    """Return the aligned (x0, y0, x1, y1) box around all positives of an (H, W, N) mask stack."""
+    rows = np.flatnonzero(masks.any(axis=(1, 2)))
+    cols = np.flatnonzero(masks.any(axis=(0, 2)))
+    if rows.size == 0:
+        return None
+    return align_box((cols[0] - margin, rows[0] - margin,
+                      cols[-1] + 1 + margin, rows[-1] + 1 + margin), masks.shape[:2])
+
+
+def tile_size_for_budget(memory_mb, batch_size=8, alignment=UNET_ALIGNMENT):
+    """Return the largest aligned tile edge whose UNet activations for one batch fit into memory_mb."""
+    pixels = memory_mb * 1024 * 1024 / (UNET_BYTES_PER_PIXEL * batch_size)
+    return max(MIN_TILE_SIZE, int(np.sqrt(pixels)) // alignment * alignment)
+
+
+def predict_stack(model, stack, device, batch_size=8, buffers=None):
+    """
+    Run the segmentation model over an (H, W, N) stack in batches.
+    Slices whose size is not a multiple of 8 are edge-padded for the UNet and
+    cropped back afterwards. Batch preparation runs on its own pipeline stage so
+    the next batch is ready while the model works on the current one. With buffers
+    (a BufferScope), the input batches are reused once the model has run on them.
+    Returns an (H, W, N) float32 probability stack.
+    """
+    height, width = stack.shape[:2]
+    pad_h, pad_w = -height % UNET_ALIGNMENT, -width % UNET_ALIGNMENT
+
+    def prepare(start):
+        slices = stack[:, :, start:start + batch_size].transpose(2, 0, 1)
+        batch = empty(buffers, (slices.shape[0], 1, height + pad_h, width + pad_w), np.float32)
+        batch[:, 0, :height, :width] = slices
+        # Edge padding, as np.pad(mode='edge')
+        batch[:, 0, :height, width:] = batch[:, 0, :height, width - 1:width]
+        batch[:, 0, height:] = batch[:, 0, height - 1:height]
+        return start, batch, torch.from_numpy(batch).to(device)
+
+    def infer(prepared):
+        start, batch, batch_tensor = prepared
+        with torch.no_grad():
+            # AtriumSegmentation forward already applies sigmoid
+            pred = model(batch_tensor)
+        return start, batch, pred[:, 0, :height, :width].cpu().numpy()
+
+    probs = np.empty(stack.shape, dtype=np.float32)
+    pipeline = Pipeline("atrium_inference", [("prepare", prepare), ("inference", infer)])
+    for start, batch, pred in pipeline.run(range(0, stack.shape[2], batch_size)):
+        probs[:, :, start:start + batch_size] = pred.transpose(1, 2, 0)
+        # Reused only once copied out: on the CPU the prediction may share memory with the batch
+        release(buffers, batch)
+    return probs
+
+
+def _tile_starts(length, tile_size, overlap):
+    if length <= tile_size:
+        return [0]
+    starts = list(range(0, length - tile_size, tile_size - overlap))
+    return starts + [length - tile_size]
+
+
+def _blend_window(tile_size, overlap):
+    """2D weights ramping up over the overlap so that neighbouring tiles fade into each other."""
+    ramp = np.minimum(np.arange(1, tile_size + 1), np.arange(tile_size, 0, -1))
+    ramp = np.minimum(ramp / (overlap + 1), 1.0).astype(np.float32)
+    return np.minimum.outer(ramp, ramp)[:, :, None]
+
+
+def predict_tiled(model, stack, device, tile_size, overlap=32, batch_size=8, buffers=None):
+    """
+    Run the segmentation model over an (H, W, N) stack in overlapping tiles.
+    Each tile position is processed for a batch of slices at a time and the tile
+    predictions are blended with a linear ramp across the overlapping seams.
+    """
+    height, width = stack.shape[:2]
+    if height <= tile_size and width <= tile_size:
+        return predict_stack(model, stack, device, batch_size, buffers)
+
+    overlap = min(overlap, tile_size // 2)
+    probs = np.zeros(stack.shape, dtype=np.float32)
+    weights = np.zeros((height, width, 1), dtype=np.float32)
+    for y in _tile_starts(height, tile_size, overlap):
+        for x in _tile_starts(width, tile_size, overlap):
+            tile = stack[y:y + tile_size, x:x + tile_size]
+            window = _blend_window(tile_size, overlap)[:tile.shape[0], :tile.shape[1]]
+            pred = predict_stack(model, tile, device, batch_size, buffers)
+            probs[y:y + tile_size, x:x + tile_size] += window * pred
+            weights[y:y + tile_size, x:x + tile_size] += window
+    probs /= weights
+    return probs
+
+
+def _predict_region(model, stack, device, mode, batch_size, tile_size, box=None, buffers=None):
+    """Run the model over the whole stack or, if a box is given, that region only (zeros elsewhere)."""
+    if box is None:
+        region = stack
+    else:
+        x0, y0, x1, y1 = box
+        region = stack[y0:y1, x0:x1]
+    if mode == "tiled":
+        pred = predict_tiled(model, region, device, tile_size, batch_size=batch_size, buffers=buffers)
+    else:
+        pred = predict_stack(model, region, device, batch_size, buffers)
+    if box is None:
+        return pred
+    probs = np.zeros(stack.shape, dtype=np.float32)
+    probs[y0:y1, x0:x1] = pred
+    return probs
+
+
+def segment_volume(model, volume, device, mode="resize", roi="off", crop_box=None, batch_size=8,
+                   tile_size=None, threshold=0.5, stride=4, margin=16, buffers=None):
+    """
+    Segment the foreground slices of a standardized (H, W, S) volume.
+
+    Empty slices are dropped with a single vectorized test. Depending on the mode the
+    remaining slices are
+    - "resize": resized to the 224x224 model input in bulk,
+    - "native": segmented at their native resolution (padded to a multiple of 8),
+    - "tiled": segmented at native resolution in overlapping tile_size tiles.
+    The UNet is then run
+    - on the full slices when roi is "off",
+    - on the given crop_box (x0, y0, x1, y1 in 224x224 model-input coordinates) if one is set,
+    - when roi is "auto", on every `stride`-th slice first; the slab between the first
+      and last positive probe is then segmented on the bounding box of the probe masks
+      only, and slices outside of it are left empty.
+
+    The UNet input batches are taken from buffers (a BufferScope) if given. Returns the
+    indices of the foreground slices and their probabilities as an (h, w, N) array in
+    the resolution the model was run at.
+    """
+    indices, stack = model_input(volume, mode)
+    return segment_stack(model, indices, stack, device, mode, roi, crop_box, batch_size,
+                         tile_size, threshold, stride, margin, buffers)
+
+
+def model_input(volume, mode="resize"):
+    """
+    The indices of the foreground slices of a standardized (H, W, S) volume and their float32
+    (h, w, N) stack as the UNet is run on it in the given mode (see segment_volume).
+    """
+    if mode not in INFERENCE_MODES:
+        raise ValueError(f"Unknown inference mode: {mode}")
+    indices = foreground_slices(volume)
+    if mode == "resize":
+        stack = resize_stack(volume[:, :, indices], (MODEL_INPUT_SIZE, MODEL_INPUT_SIZE))
+    else:
+        stack = volume[:, :, indices].astype(np.float32)
+    return indices, stack
+
+
+def segment_stack(model, indices, stack, device, mode="resize", roi="off", crop_box=None, batch_size=8,
+                  tile_size=None, threshold=0.5, stride=4, margin=16, buffers=None):
+    """segment_volume on the foreground slices and stack from model_input, which may have been prepared elsewhere."""
+    if len(indices) == 0:
+        return indices, stack
+
+    tile_size = tile_size or tile_size_for_budget(DEFAULT_TILE_MEMORY_MB, batch_size)
+
+    def run(slices, box=None):
+        return _predict_region(model, slices, device, mode, batch_size, tile_size, box, buffers)
+
+    if crop_box is not None:
+        if mode != "resize":
+            crop_box = scale_box(crop_box, stack.shape[:2])
+        return indices, run(stack, align_box(crop_box, stack.shape[:2]))
+    if roi == "off":
+        return indices, run(stack)
+    if roi != "auto":
+        raise ValueError(f"Unknown ROI mode: {roi}")
+
+    probe = np.arange(0, len(indices), stride)
+    if probe[-1] != len(indices) - 1:
+        probe = np.append(probe, len(indices) - 1)
+    probs = np.zeros_like(stack)
+    probs[:, :, probe] = run(stack[:, :, probe])
+
+    probe_masks = probs[:, :, probe] > threshold
+    hits = probe[probe_masks.any(axis=(0, 1))]
+    if hits.size == 0:
+        # Nothing found on the coarse pass, fall back to segmenting every slice
+        rest = np.setdiff1d(np.arange(len(indices)), probe)
+        probs[:, :, rest] = run(stack[:, :, rest])
+        return indices, probs
+
+    box = mask_bounding_box(probe_masks, margin)
+    slab = np.arange(max(hits[0] - stride + 1, 0), min(hits[-1] + stride, len(indices)))
+    rest = np.setdiff1d(slab, probe)
+    if rest.size:
+        probs[:, :, rest] = run(stack[:, :, rest], box)
+    return indices, probs
+
+
+def masks_to_native(probs, threshold, shape):
+    """Threshold a probability stack and bring the binary masks to the native (H, W) slice shape."""
+    masks = (probs > threshold).astype(np.float32)
+    if masks.shape[:2] == tuple(shape):
+        return masks
+    return resize_stack(masks, (shape[1], shape[0]))
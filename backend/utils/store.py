@@ -0,0 +1,240 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import queue
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import numpy as np
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS predictions (
+    id INTEGER PRIMARY KEY,
+    created REAL NOT NULL,
+    endpoint TEXT NOT NULL,
+    model TEXT NOT NULL,
+    model_version TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    study_uid TEXT,
+    series_uid TEXT,
+    instance_uid TEXT,
+    result TEXT NOT NULL,
+    masks TEXT
+);
+CREATE INDEX IF NOT EXISTS predictions_study ON predictions (study_uid, created);
+CREATE INDEX IF NOT EXISTS predictions_content ON predictions (content_hash, created);
+"""
+
+COLUMNS = ("id", "created", "endpoint", "model", "model_version", "content_hash",
+           "study_uid", "series_uid", "instance_uid", "result", "masks")
+
+DIGEST = re.compile(r"[0-9a-f]{64}")
+
+_STOP = object()
+
+logger = logging.getLogger(__name__)
+
+
+def _encode_masks(bits, shape):
+    """Packed binary masks as a compressed .npz blob of their bits and shape."""
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, bits=bits, shape=np.array(shape))
+    return buffer.getvalue()
+
+
+def decode_masks(blob):
+    """The boolean masks of a mask blob."""
+    with np.load(io.BytesIO(blob)) as data:
+        shape = tuple(int(v) for v in data["shape"])
+        return np.unpackbits(data["bits"], count=int(np.prod(shape))).reshape(shape).astype(bool)
+
+
+class PredictionStore:
+    """
+    Persistent record of prediction results: a SQLite database with one row per prediction
+    (endpoint, model and version, content hash of the input, study/series/instance UIDs and
+    the result as JSON) and a directory of mask blobs addressed by their SHA-256, so
+    identical masks are stored once. Rows are indexed by study UID and by content hash.
+
+    Recording never blocks the caller: records are queued and a background thread writes
+    them in batches of up to batch_size rows per transaction, waiting at most
+    flush_interval seconds for a batch to fill. When max_queue records are already waiting
+    further ones are dropped and counted. A record that cannot be written is logged and
+    counted as an error; the writer carries on with the next ones. Lookups read the
+    database directly and do not see records still in the queue.
+    """
+
+    def __init__(self, directory, max_queue=10000, batch_size=256, flush_interval=1.0):
+        self.directory = directory
+        self.blob_dir = os.path.join(directory, "blobs")
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self.path = os.path.join(directory, "predictions.sqlite")
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._local = threading.local()
+        db = self._connect()
+        db.executescript(SCHEMA)
+        db.close()
+        self._queue = queue.Queue(max_queue)
+        self._lock = threading.Lock()
+        self.recorded = 0
+        self.dropped = 0
+        self.written = 0
+        self.batches = 0
+        self.blobs_written = 0
+        self.blobs_shared = 0
+        self.errors = 0
+        self.error = None
+        self._writer = threading.Thread(target=self._write_loop, name="prediction-store", daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def _reader(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = self._connect()
+            db.row_factory = sqlite3.Row
+        return db
+
+    def record(self, endpoint, model, model_version, content_hash, result, uids=None, masks=None):
+        """
+        Queue a prediction for writing: result is a JSON-serializable dict, uids an optional
+        (study, series, instance) tuple and masks optional binary masks. Returns False if the
+        record was dropped because the queue is full.
+        """
+        study, series, instance = uids or (None, None, None)
+        # Only the bits are kept until the writer compresses them, not the caller's masks
+        packed = (np.packbits(np.asarray(masks) > 0), np.shape(masks)) if masks is not None else None
+        # Serialized by the writer
+        row = [time.time(), endpoint, model, model_version, content_hash, study, series, instance, result]
+        try:
+            self._queue.put_nowait((row, packed))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.recorded += 1
+        return True
+
+    def _write_loop(self):
+        db = self._connect()
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while batch[-1] is not _STOP and len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            stop = batch[-1] is _STOP
+            records = batch[:-1] if stop else batch
+            try:
+                if records:
+                    self._write(db, records)
+            except Exception as e:
+                logger.exception("Failed to write %d prediction records", len(records))
+                self._failed(len(records), e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if stop:
+                db.close()
+                return
+
+    def _failed(self, count, error):
+        with self._lock:
+            self.errors += count
+            self.error = f"{type(error).__name__}: {error}"
+
+    def _write(self, db, records):
+        rows = []
+        for row, packed in records:
+            try:
+                result = json.dumps(row[-1])
+                digest = self._write_blob(*packed) if packed is not None else None
+            except (TypeError, ValueError) as e:
+                # Only this record is lost, not its batch
+                logger.exception("Failed to serialize a prediction record of %s", row[1])
+                self._failed(1, e)
+                continue
+            rows.append(row[:-1] + [result, digest])
+        with db:
+            db.executemany(f"INSERT INTO predictions ({', '.join(COLUMNS[1:])}) "
+                           f"VALUES ({', '.join('?' * (len(COLUMNS) - 1))})", rows)
+        with self._lock:
+            self.written += len(rows)
+            self.batches += 1
+
+    def _write_blob(self, bits, shape):
+        blob = _encode_masks(bits, shape)
+        digest = hashlib.sha256(blob).hexdigest()
+        path = self._blob_path(digest)
+        if os.path.exists(path):
+            with self._lock:
+                self.blobs_shared += 1
+            return digest
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(blob)
+        os.replace(temp_path, path)
+        with self._lock:
+            self.blobs_written += 1
+        return digest
+
+    def _blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest[:2], digest[2:] + ".npz")
+
+    def blob_path(self, digest):
+        """The file of a mask blob, or None if there is none with this digest."""
+        if not DIGEST.fullmatch(digest):
+            return None
+        path = self._blob_path(digest)
+        return path if os.path.exists(path) else None
+
+    def _select(self, column, value, limit):
+        rows = self._reader().execute(
+            f"SELECT {', '.join(COLUMNS)} FROM predictions WHERE {column} = ? "
+            f"ORDER BY created DESC, id DESC LIMIT ?", (value, limit)).fetchall()
+        return [dict(row, result=json.loads(row["result"])) for row in rows]
+
+    def by_study(self, study_uid, limit=100):
+        """The predictions recorded for a study, newest first."""
+        return self._select("study_uid", study_uid, limit)
+
+    def by_content(self, content_hash, limit=100):
+        """The predictions recorded for an input with this content hash, newest first."""
+        return self._select("content_hash", content_hash, limit)
+
+    def flush(self):
+        """Wait until every record queued so far has been written."""
+        self._queue.join()
+
+    def close(self):
+        """Write the queued records and stop the writer."""
+        self._queue.put(_STOP)
+        self._writer.join()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queued": self._queue.qsize(),
+                "recorded": self.recorded,
+                "dropped": self.dropped,
+                "written": self.written,
+                "batches": self.batches,
+                "blobs_written": self.blobs_written,
+                "blobs_shared": self.blobs_shared,
+                "errors": self.errors,
+                "error": self.error,
+            }
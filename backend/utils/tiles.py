@@ -0,0 +1,167 @@
+import contextlib
+import threading
+import uuid
+import cv2
+import numpy as np
+from utils.cache import LRUCache
+from utils.buffers import empty
+
+
+def _ceil_div(a, b):
+    return -(-a // b)
+
+
+class TileSource:
+    """
+    A deep-zoom pyramid over one or more same-sized grayscale images with a prediction
+    overlay, rendered tile by tile on demand.
+
+    Levels follow the Deep Zoom convention: the last level (max_level) is the full
+    resolution and every level below halves it, down to a single pixel at level 0.
+    The background (and mask) of a level is computed from the next finer level the first
+    time a tile of it is requested. The overlay is one of a 7x7 CAM blended as a heatmap,
+    a bounding box in full-resolution pixels, or per-image masks (0-255) blended in red,
+    and is drawn at the tile's own resolution only.
+    """
+
+    def __init__(self, backgrounds, cam=None, bbox=None, masks=None, tile_size=256):
+        self.backgrounds = backgrounds
+        self.cam = cam
+        self.bbox = bbox
+        self.masks = masks
+        self.tile_size = tile_size
+        self.height, self.width = backgrounds[0].shape[:2]
+        self.max_level = (max(self.width, self.height) - 1).bit_length()
+        self._levels = {}  # (image, level) -> (background, mask) of the lower levels
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        """Memory of the full-resolution images plus the lower levels, which add up to a third of it."""
+        base = sum(b.nbytes for b in self.backgrounds) + sum(m.nbytes for m in self.masks or [])
+        return base * 4 // 3
+
+    def level_size(self, level):
+        """(width, height) of a pyramid level."""
+        scale = 1 << (self.max_level - level)
+        return _ceil_div(self.width, scale), _ceil_div(self.height, scale)
+
+    def grid_size(self, level):
+        """(columns, rows) of tiles covering a pyramid level."""
+        width, height = self.level_size(level)
+        return _ceil_div(width, self.tile_size), _ceil_div(height, self.tile_size)
+
+    def _level(self, image, level):
+        if level == self.max_level:
+            return self.backgrounds[image], self.masks[image] if self.masks is not None else None
+        with self._lock:
+            cached = self._levels.get((image, level))
+        if cached is not None:
+            return cached
+        background, mask = self._level(image, level + 1)
+        size = self.level_size(level)
+        cached = (cv2.resize(background, size, interpolation=cv2.INTER_AREA),
+                  cv2.resize(mask, size, interpolation=cv2.INTER_AREA) if mask is not None else None)
+        with self._lock:
+            self._levels[(image, level)] = cached
+        return cached
+
+    def render_tile(self, image, level, col, row, buffers=None):
+        """
+        Render one tile as a BGR image, taking it and its intermediates from buffers (a
+        BufferScope) if given. Raises KeyError for coordinates outside the pyramid.
+        """
+        columns, rows = self.grid_size(level) if 0 <= level <= self.max_level else (0, 0)
+        if not (0 <= image < len(self.backgrounds) and 0 <= col < columns and 0 <= row < rows):
+            raise KeyError((image, level, col, row))
+        background, mask = self._level(image, level)
+        x0, y0 = col * self.tile_size, row * self.tile_size
+        crop = background[y0:y0 + self.tile_size, x0:x0 + self.tile_size]
+        height, width = crop.shape
+        tile = cv2.cvtColor(crop, cv2.COLOR_GRAY2BGR, dst=empty(buffers, (height, width, 3), np.uint8))
+
+        if self.cam is not None:
+            # Bilinear CAM upsampling straight to the tile's pixels, with the same pixel-center
+            # alignment as resizing the whole CAM to the level size
+            level_width, level_height = self.level_size(level)
+            sx, sy = self.cam.shape[1] / level_width, self.cam.shape[0] / level_height
+            transform = np.float32([[sx, 0, (x0 + 0.5) * sx - 0.5], [0, sy, (y0 + 0.5) * sy - 0.5]])
+            cam = cv2.warpAffine(self.cam.astype(np.float32), transform, (width, height),
+                                 dst=empty(buffers, (height, width), np.float32),
+                                 flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP, borderMode=cv2.BORDER_REPLICATE)
+            np.multiply(cam, 255, out=cam)
+            cam_u8 = empty(buffers, (height, width), np.uint8)
+            np.copyto(cam_u8, cam, casting='unsafe')
+            heatmap = cv2.applyColorMap(cam_u8, cv2.COLORMAP_JET, dst=empty(buffers, (height, width, 3), np.uint8))
+            tile = cv2.addWeighted(tile, 0.5, heatmap, 0.5, 0, dst=tile)
+
+        if mask is not None:
+            mask = mask[y0:y0 + height, x0:x0 + width]
+            masked = mask > 0
+            if masked.any():
+                red = empty(buffers, (height, width, 3), np.uint8)
+                red[:, :, :2] = 0
+                red[:, :, 2] = mask
+                blended = cv2.addWeighted(tile, 0.5, red, 0.5, 0, dst=red)
+                np.copyto(tile, blended, where=masked[:, :, None])
+
+        if self.bbox is not None:
+            scale = 1 / (1 << (self.max_level - level))
+            x1, y1, x2, y2 = (int(v * scale) for v in self.bbox)
+            cv2.rectangle(tile, (x1 - x0, y1 - y0), (x2 - x0, y2 - y0), (0, 255, 0), 2)
+        return tile
+
+    def descriptor(self):
+        return {
+            "width": self.width,
+            "height": self.height,
+            "tile_size": self.tile_size,
+            "max_level": self.max_level,
+            "images": len(self.backgrounds),
+            "format": "png",
+        }
+
+
+class TileStore:
+    """
+    Keeps tile sources by id in an LRU cache bounded by their memory, and the PNG tiles
+    rendered from them in a second one, so a viewer panning back and forth or several
+    viewers looking at the same result get the tile without rendering it again. Tiles are
+    rendered in buffers from pool (a BufferPool) if given.
+    """
+
+    def __init__(self, source_bytes, tile_bytes, pool=None):
+        self.sources = LRUCache(source_bytes)
+        self.tiles = LRUCache(tile_bytes)
+        self.pool = pool
+
+    def add(self, source):
+        """Register a source; returns its descriptor, with the id and URL it is served under."""
+        source_id = uuid.uuid4().hex
+        self.sources.put(source_id, source, size=source.nbytes)
+        return self._descriptor(source_id, source)
+
+    def _descriptor(self, source_id, source):
+        return dict(source.descriptor(), id=source_id, url=f"/tiles/{source_id}")
+
+    def descriptor(self, source_id):
+        """The descriptor of a source, or None if it is unknown or has been evicted."""
+        source = self.sources.get(source_id)
+        return self._descriptor(source_id, source) if source is not None else None
+
+    def tile_png(self, source_id, image, level, col, row):
+        """The PNG of a tile, or None if its source is unknown. Raises KeyError for coordinates outside it."""
+        key = (source_id, image, level, col, row)
+        png = self.tiles.get(key)
+        if png is not None:
+            return png
+        source = self.sources.get(source_id)
+        if source is None:
+            return None
+        with self.pool.scope() if self.pool is not None else contextlib.nullcontext() as buffers:
+            png = cv2.imencode('.png', source.render_tile(image, level, col, row, buffers))[1].tobytes()
+        self.tiles.put(key, png, size=len(png))
+        return png
+
+    def stats(self):
+        return {"sources": self.sources.stats(), "tiles": self.tiles.stats()}
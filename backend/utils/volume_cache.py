@@ -0,0 +1,190 @@
+import json
+import logging
+import os
+import queue
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+import numpy as np
+from utils.cache import LRUCache, nbytes
+from utils.render import window_slices
+from utils.segmentation import foreground_slices, resize_stack, MODEL_INPUT_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+def prepare_volume(volume, volume_std, voxel_spacing, dtype=np.float32):
+    """
+    Everything a segmentation needs from a decoded (H, W, S) NIfTI volume and its standardized
+    copy: the indices of the foreground slices, those slices standardized (the "native" and
+    "tiled" model input) and resized to 224x224 (the "resize" model input), both in dtype,
+    and as uint8 display slices.
+    """
+    indices = foreground_slices(volume_std)
+    foreground = volume_std[:, :, indices]
+    return {
+        "indices": indices,
+        "foreground": foreground.astype(dtype),
+        "resized": resize_stack(foreground, (MODEL_INPUT_SIZE, MODEL_INPUT_SIZE)).astype(dtype, copy=False),
+        "backgrounds": window_slices(volume, indices),
+        "depth": volume.shape[2],
+        "voxel_spacing": tuple(float(s) for s in voxel_spacing),
+    }
+
+
+def model_stack(prepared, mode):
+    """The float32 model input stack of a prepared volume for an inference mode."""
+    return np.asarray(prepared["resized" if mode == "resize" else "foreground"], dtype=np.float32)
+
+
+class VolumeCache:
+    """
+    Prepared volumes (see prepare_volume) by upload hash, so segmenting the same volume again
+    skips decoding and preprocessing it.
+
+    The most recently used volumes are kept in memory up to memory_bytes. Volumes evicted
+    from there are spilled to directory, one subdirectory of .npy files per volume, and read
+    back memory-mapped, so only the slices a request touches are paged in. The spilled
+    volumes are bounded by disk_bytes, least recently used first out, and are found again
+    after a restart. Without a directory evicted volumes are dropped.
+
+    Spilling is left to a background thread, so the request whose volume caused the
+    eviction does not wait for it. Until written, evicted volumes are still served from
+    memory; beyond max_pending of them waiting, further evictions are dropped and counted.
+    """
+
+    def __init__(self, memory_bytes, directory=None, disk_bytes=0, max_pending=2):
+        self.memory = LRUCache(memory_bytes, on_evict=self._spill if directory else None)
+        self.directory = directory
+        self.disk_bytes = disk_bytes
+        self.max_pending = max_pending
+        self._disk = OrderedDict()  # key -> size of the spilled files
+        self._pending = {}  # key -> evicted volume waiting to be spilled
+        self._spills = queue.Queue()
+        self._lock = threading.Lock()
+        self.disk_hits = 0
+        self.spills = 0
+        self.spills_dropped = 0
+        self.disk_evictions = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._scan()
+            threading.Thread(target=self._spill_loop, name="volume-spill", daemon=True).start()
+
+    def _scan(self):
+        """Index the volumes spilled by earlier runs, oldest use first, and drop unfinished spills."""
+        found = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            meta = os.path.join(path, "meta.json")
+            if not os.path.exists(meta):
+                shutil.rmtree(path, ignore_errors=True)
+                continue
+            size = sum(entry.stat().st_size for entry in os.scandir(path))
+            found.append((os.path.getmtime(meta), name, size))
+        for _, name, size in sorted(found):
+            self._disk[name] = size
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        """The prepared volume, from memory or memory-mapped from disk, or None."""
+        prepared = self.memory.get(key)
+        if prepared is not None or not self.directory:
+            return prepared
+        with self._lock:
+            if key in self._pending:
+                return self._pending[key]
+            if key not in self._disk:
+                return None
+            self._disk.move_to_end(key)
+        path = self._path(key)
+        try:
+            with open(os.path.join(path, "meta.json")) as f:
+                prepared = json.load(f)
+            for name in prepared.pop("arrays"):
+                prepared[name] = np.load(os.path.join(path, name + ".npy"), mmap_mode="r")
+            os.utime(os.path.join(path, "meta.json"))
+        except OSError:
+            # Evicted by another thread meanwhile
+            return None
+        prepared["voxel_spacing"] = tuple(prepared["voxel_spacing"])
+        with self._lock:
+            self.disk_hits += 1
+        return prepared
+
+    def put(self, key, prepared):
+        if not self.memory.put(key, prepared) and self.directory:
+            # Too large for the memory budget, but it may still fit on disk
+            self._spill(key, prepared)
+
+    def _spill(self, key, prepared):
+        """Hand a volume to the spill thread, unless it is spilled already or too many are waiting."""
+        with self._lock:
+            if key in self._disk or key in self._pending or nbytes(prepared) > self.disk_bytes:
+                return
+            if len(self._pending) >= self.max_pending:
+                self.spills_dropped += 1
+                return
+            self._pending[key] = prepared
+        self._spills.put(key)
+
+    def _spill_loop(self):
+        while True:
+            key = self._spills.get()
+            try:
+                with self._lock:
+                    prepared = self._pending[key]
+                self._write(key, prepared)
+            except Exception:
+                logger.exception("Failed to spill volume %s", key)
+            finally:
+                with self._lock:
+                    del self._pending[key]
+                self._spills.task_done()
+
+    def flush(self):
+        """Wait until the volumes handed to the spill thread so far have been written."""
+        self._spills.join()
+
+    def _write(self, key, prepared):
+        temp_path = tempfile.mkdtemp(dir=self.directory, prefix=".spill-")
+        arrays = [name for name, value in prepared.items() if isinstance(value, np.ndarray)]
+        try:
+            for name in arrays:
+                np.save(os.path.join(temp_path, name + ".npy"), prepared[name])
+            meta = {name: value for name, value in prepared.items() if name not in arrays}
+            with open(os.path.join(temp_path, "meta.json"), "w") as f:
+                json.dump(dict(meta, arrays=arrays), f)
+            size = sum(entry.stat().st_size for entry in os.scandir(temp_path))
+            os.replace(temp_path, self._path(key))
+        except OSError:
+            # Out of disk space
+            shutil.rmtree(temp_path, ignore_errors=True)
+            return
+        evicted = []
+        with self._lock:
+            self._disk[key] = size
+            self.spills += 1
+            while sum(self._disk.values()) > self.disk_bytes:
+                evicted.append(self._disk.popitem(last=False)[0])
+                self.disk_evictions += 1
+        # Volumes still memory-mapped by a request stay readable until it is done with them
+        for evicted_key in evicted:
+            shutil.rmtree(self._path(evicted_key), ignore_errors=True)
+
+    def stats(self):
+        with self._lock:
+            disk = {
+                "entries": len(self._disk),
+                "bytes": sum(self._disk.values()),
+                "max_bytes": self.disk_bytes if self.directory else 0,
+                "hits": self.disk_hits,
+                "spills": self.spills,
+                "pending": len(self._pending),
+                "spills_dropped": self.spills_dropped,
+                "evictions": self.disk_evictions,
+            }
+        return {"memory": self.memory.stats(), "disk": disk}
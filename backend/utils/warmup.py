@@ -0,0 +1,124 @@
+import io
+import threading
+import time
+import zipfile
+import cv2
+import numpy as np
+import pydicom
+import torch
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.encaps import encapsulate
+from PIL import Image
+from utils.cam import compute_cams
+from utils.decode import decode_pixels
+from utils.preprocess import preprocess_pixels
+from utils.render import render_overlays
+from utils.segmentation import resize_stack, MODEL_INPUT_SIZE
+
+
+def warm_up_model(model_name, model, device, batch_sizes):
+    """
+    Run dummy 224x224 batches of every given size through a model, so kernel selection
+    and allocator growth happen before the first request instead of during it.
+    """
+    for batch_size in batch_sizes:
+        batch = torch.zeros((batch_size, 1, MODEL_INPUT_SIZE, MODEL_INPUT_SIZE), device=device)
+        if model_name == "pneumonia":
+            compute_cams(model, batch)
+        else:
+            with torch.no_grad():
+                model(batch)
+
+
+def _jpeg_dicom(size=64):
+    """A tiny JPEG Baseline CR DICOM in memory, to load the decoding code paths."""
+    buffer = io.BytesIO()
+    Image.fromarray(np.zeros((size, size), dtype=np.uint8)).save(buffer, 'JPEG')
+    ds = Dataset()
+    ds.file_meta = FileMetaDataset()
+    ds.file_meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.1'
+    ds.file_meta.MediaStorageSOPInstanceUID = pydicom.uid.generate_uid()
+    ds.file_meta.TransferSyntaxUID = '1.2.840.10008.1.2.4.50'
+    ds.is_little_endian, ds.is_implicit_VR = True, False
+    ds.Modality = 'CR'
+    ds.PhotometricInterpretation = 'MONOCHROME2'
+    ds.SamplesPerPixel = 1
+    ds.Rows = ds.Columns = size
+    ds.BitsAllocated = ds.BitsStored = 8
+    ds.HighBit = 7
+    ds.PixelRepresentation = 0
+    ds.PixelData = encapsulate([buffer.getvalue()])
+    ds['PixelData'].is_undefined_length = True
+    out = io.BytesIO()
+    ds.save_as(out, write_like_original=False)
+    return out.getvalue()
+
+
+def warm_up_codecs(display_size=1024):
+    """
+    Exercise DICOM decoding, preprocessing, overlay rendering and PNG/ZIP encoding once,
+    which imports pydicom's pixel handlers and initializes the OpenCV and Pillow codecs.
+    """
+    dicom = _jpeg_dicom()
+    decode_pixels(io.BytesIO(dicom), min_size=16)
+    pixels = decode_pixels(io.BytesIO(dicom))
+    preprocess_pixels(pixels)
+
+    display = cv2.resize(pixels.astype(np.float32), (display_size, display_size)).astype(np.uint8)
+    heatmap = cv2.applyColorMap(display, cv2.COLORMAP_JET)
+    overlay = cv2.addWeighted(cv2.cvtColor(display, cv2.COLOR_GRAY2BGR), 0.5, heatmap, 0.5, 0)
+    cv2.imencode('.png', overlay)
+
+    stack = resize_stack(np.zeros((64, 64, 2), dtype=np.float32), (MODEL_INPUT_SIZE, MODEL_INPUT_SIZE))
+    overlays = render_overlays(stack.astype(np.uint8), stack > 0.5)
+    with zipfile.ZipFile(io.BytesIO(), 'w') as zipf:
+        zipf.writestr('warmup.png', cv2.imencode('.png', overlays[0])[1])
+
+
+class WarmUp:
+    """
+    Runs warm-up tasks in a background thread and reports readiness.
+
+    tasks is a list of (name, fn) pairs. The service is ready once every task has
+    run without error; the time each task took is kept for the readiness report.
+    """
+
+    def __init__(self, tasks):
+        self.tasks = tasks
+        self.seconds = {}
+        self.error = None
+        self._done = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="warmup", daemon=True)
+        self._thread.start()
+        return self
+
+    def run(self):
+        try:
+            for name, fn in self.tasks:
+                start = time.perf_counter()
+                fn()
+                self.seconds[name] = round(time.perf_counter() - start, 4)
+        except Exception as e:
+            self.error = f"{name}: {e}"
+        finally:
+            self._done.set()
+
+    def wait(self, timeout=None):
+        """Block until warm-up has finished; returns whether the service is ready."""
+        self._done.wait(timeout)
+        return self.ready
+
+    @property
+    def ready(self):
+        return self._done.is_set() and self.error is None
+
+    def status(self):
+        return {
+            "ready": self.ready,
+            "warming_up": not self._done.is_set(),
+            "seconds": dict(self.seconds),
+            "error": self.error,
+        }